@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Replay recorded Telegram updates against the bot's Dispatcher offline.
+
+Record in production with RECORD_UPDATES_PATH=updates.ndjson (see src/bot.py),
+then:
+
+    python3 scripts/replay_updates.py updates.ndjson --db bookings.db --speed 10 --profile replay.prof
+
+The bot runs on a copy of the database and a fake Bot API session, so nothing
+is sent to Telegram and the original DB is untouched. Prints per-handler timings
+and the Bot API calls the handlers made; optionally writes cProfile stats and,
+if pyinstrument is installed, an HTML flame report.
+"""
+import argparse
+import asyncio
+import cProfile
+import importlib
+import json
+import os
+import pstats
+import shutil
+import sqlite3
+import sys
+import tempfile
+import typing
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def copy_db(src: str, dst: str):
+    # online backup API: safe even if the bot is writing to src right now
+    if not os.path.exists(src):
+        return
+    source = sqlite3.connect(src)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def load_bot(db_path: str, admins: str, speed: float):
+    os.environ["DB_PATH"] = db_path
+    os.environ["BOT_TOKEN"] = "42:replay"
+    os.environ["ADMIN_IDS"] = admins
+    os.environ["WORKERS"] = "1"
+    os.environ.pop("RECORD_UPDATES_PATH", None)
+    if speed > 0:
+        # keep the duplicate-tap window proportional to the compressed timeline
+        window = float(os.environ.get("DUPLICATE_TAP_WINDOW", "1.0"))
+        os.environ["DUPLICATE_TAP_WINDOW"] = str(window / speed)
+    # token buckets would refuse a compressed timeline; measure the handlers instead
+    os.environ["THROTTLE_ENABLED"] = "0"
+    sys.path.insert(0, str(PROJECT_ROOT))
+    return importlib.import_module("src.bot")
+
+
+def make_fake_session(bot_module):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message, User
+
+    class FakeSession(BaseSession):
+        """Answers every Bot API call locally with a minimal valid result."""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = Counter()
+            self._message_id = 0
+
+        def _fake_result(self, method):
+            returning = method.__returning__
+            options = typing.get_args(returning) or (returning,)
+            if Message in options:
+                self._message_id += 1
+                chat_id = getattr(method, "chat_id", None) or 0
+                return Message(
+                    message_id=self._message_id,
+                    date=datetime.now(),
+                    chat=Chat(id=int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, type="private"),
+                    text=getattr(method, "text", None),
+                )
+            if User in options:
+                return User(id=42, is_bot=True, first_name="replay", username="replay_bot")
+            if typing.get_origin(returning) is list or returning is list:
+                return []
+            return True
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls[type(method).__name__] += 1
+            return self._fake_result(method)
+
+        async def stream_content(self, *args, **kwargs):
+            if False:
+                yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+def install_timer(bot_module, timings):
+    from aiogram import BaseMiddleware
+
+    class HandlerTimer(BaseMiddleware):
+        async def __call__(self, handler, event, data):
+            name = data["handler"].callback.__name__
+            started = perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                timings[name].append(perf_counter() - started)
+
+    timer = HandlerTimer()
+    bot_module.dp.message.middleware(timer)
+    bot_module.dp.callback_query.middleware(timer)
+
+
+def read_records(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+async def replay(bot_module, path: str, speed: float):
+    from aiogram.types import Update
+
+    bot = bot_module.bot
+    dp = bot_module.dp
+    await bot_module.init_db()
+
+    tasks = set()
+    errors = 0
+    count = 0
+    first_ts = None
+    started = perf_counter()
+
+    async def handle(update):
+        nonlocal errors
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            errors += 1
+            print(f"Error replaying update {update.update_id}: {e}")
+
+    for record in read_records(path):
+        if speed > 0:
+            if first_ts is None:
+                first_ts = record["ts"]
+            delay = (record["ts"] - first_ts) / speed - (perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = Update.model_validate(record["update"], context={"bot": bot})
+        task = asyncio.create_task(handle(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        count += 1
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    return count, errors, perf_counter() - started
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def print_report(count, errors, elapsed, timings, calls):
+    print(f"\nReplayed {count} updates in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.1f} updates/s), {errors} errors\n")
+    print(f"{'handler':<28}{'calls':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}")
+    rows = sorted(timings.items(), key=lambda kv: sum(kv[1]), reverse=True)
+    for name, values in rows:
+        print(f"{name:<28}{len(values):>7}{1000 * sum(values) / len(values):>10.2f}"
+              f"{1000 * percentile(values, 50):>10.2f}{1000 * percentile(values, 95):>10.2f}"
+              f"{1000 * max(values):>10.2f}{sum(values):>10.3f}")
+    print("\nBot API calls:")
+    for name, n in calls.most_common():
+        print(f"  {name:<26}{n:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates against the bot dispatcher")
+    parser.add_argument("updates", help="NDJSON file written by RECORD_UPDATES_PATH")
+    parser.add_argument("--db", default="bookings.db", help="database to copy and replay against")
+    parser.add_argument("--speed", type=float, default=1.0, help="time acceleration; 0 replays as fast as possible")
+    parser.add_argument("--admins", default="", help="comma-separated anonymized admin ids (printed by the recorder)")
+    parser.add_argument("--profile", help="write cProfile stats to this file")
+    parser.add_argument("--pyinstrument", help="write a pyinstrument HTML report to this file")
+    parser.add_argument("--keep-db", action="store_true", help="keep the replay DB copy and print its path")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    db_copy = os.path.join(workdir, "bookings.db")
+    copy_db(args.db, db_copy)
+
+    bot_module = load_bot(db_copy, args.admins, args.speed)
+    session = make_fake_session(bot_module)
+    bot_module.bot.session = session
+    timings = defaultdict(list)
+    install_timer(bot_module, timings)
+
+    profiler = cProfile.Profile() if args.profile else None
+    instrument = None
+    if args.pyinstrument:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed; skipping --pyinstrument (pip install pyinstrument)")
+        else:
+            instrument = Profiler(async_mode="enabled")
+
+    if profiler:
+        profiler.enable()
+    if instrument:
+        instrument.start()
+    try:
+        count, errors, elapsed = asyncio.run(replay(bot_module, args.updates, args.speed))
+    finally:
+        if instrument:
+            instrument.stop()
+        if profiler:
+            profiler.disable()
+
+    print_report(count, errors, elapsed, timings, session.calls)
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print(f"\ncProfile stats written to {args.profile}; top functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    if instrument:
+        with open(args.pyinstrument, "w", encoding="utf-8") as f:
+            f.write(instrument.output_html())
+        print(f"pyinstrument report written to {args.pyinstrument}")
+
+    if args.keep_db:
+        print(f"Replay DB kept at {db_copy}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
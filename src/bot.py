@@ -1,17 +1,100 @@
 import asyncio
+import aiogram
 import aiosqlite
+import certifi
+import collections
+import hashlib
+import heapq
+import json
+import multiprocessing
 import os
-from aiogram import Bot, Dispatcher, types
+import queue as queue_module
+import signal
+import sqlite3
+import ssl
+import sys
+import threading
+import traceback
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from time import monotonic
+from aiogram import BaseMiddleware, Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters.command import Command
+from aiogram.filters.command import Command, CommandObject
+from aiohttp import ClientSession, TCPConnector
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# always admins; more can be added at runtime with /admin_add (see RuntimeConfig)
 ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "0").split(",") if id.strip()]
 DB_PATH = os.getenv("DB_PATH", "bookings.db")
+# name of this bot when src/multibot.py hosts several in one process (shown in logs and /health)
+TENANT_NAME = os.getenv("TENANT_NAME", "")
+# number of worker processes; 1 keeps the classic single-process polling mode
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+# seconds a connection waits for the write lock held by another worker
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "10"))
+# repeated taps on the same button within this many seconds are dropped
+DUPLICATE_TAP_WINDOW = float(os.getenv("DUPLICATE_TAP_WINDOW", "1.0"))
+# per-user token buckets; 0 turns throttling off
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1") != "0"
+# outbound Bot API client: pooled keep-alive connections, bounded retries
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "100"))
+API_KEEPALIVE = float(os.getenv("API_KEEPALIVE", "60"))
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+# when set, every incoming update is appended to this NDJSON file with user ids anonymized
+RECORD_UPDATES_PATH = os.getenv("RECORD_UPDATES_PATH")
+RECORD_SALT = os.getenv("RECORD_SALT") or os.urandom(16).hex()
+# outbox sender: parallel sends, give-up threshold, idle poll interval (seconds)
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+# online backups: target dir, schedule (0 disables), how many to keep, pages copied per step
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "64"))
+# archival: bookings older than this many days leave the live table; reviews beyond the newest N approved
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+REVIEWS_KEEP_LIVE = int(os.getenv("REVIEWS_KEEP_LIVE", "50"))
+# waitlist: how long a freed slot is held for the first waiting user
+WAITLIST_HOLD_MINUTES = float(os.getenv("WAITLIST_HOLD_MINUTES", "30"))
+WAITLIST_SWEEP_INTERVAL = float(os.getenv("WAITLIST_SWEEP_INTERVAL", "60"))
+# seconds a day (or a deep-linked time) stays reserved for a user who opened its time picker
+SLOT_HOLD_SECONDS = float(os.getenv("SLOT_HOLD_SECONDS", "180"))
+# event-loop watchdog: stalls longer than this (ms) are logged with a stack sample; 0 disables
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+# outgoing messages per second, shared by /broadcast, the outbox and admin notifications
+# (Telegram allows about 30 overall); /broadcast: parallel sends, recipients per chunk
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "200"))
+# shutdown: seconds to finish in-flight updates and queued writes/notifications before exiting
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+# seconds after which handled updates are dropped from bot_state when no poll did it first
+UPDATE_CHECKPOINT_INTERVAL = float(os.getenv("UPDATE_CHECKPOINT_INTERVAL", "1"))
+# admin audit log: entries are buffered and written in one transaction per flush
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "5"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+# review moderation: new reviews reach admins as one digest message per batch, every N seconds
+REVIEW_DIGEST_INTERVAL = float(os.getenv("REVIEW_DIGEST_INTERVAL", "900"))
+REVIEW_DIGEST_SIZE = int(os.getenv("REVIEW_DIGEST_SIZE", "10"))
+# seconds the public page of approved reviews is served from cache
+REVIEWS_TTL = float(os.getenv("REVIEWS_TTL", "300"))
+# keep bookings and reviews in memory and persist writes through a group-commit journal (single process only)
+MEMORY_STORE = os.getenv("MEMORY_STORE", "0") == "1"
+# how long the journal waits for more writes to join a commit (ms)
+JOURNAL_GROUP_WINDOW_MS = float(os.getenv("JOURNAL_GROUP_WINDOW_MS", "2"))
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN not found in environment variables")
@@ -20,18 +103,386 @@ if not BOT_TOKEN:
 print(f"Using DB path: {DB_PATH}")
 
 def is_admin(user_id):
-    return user_id in ADMIN_IDS
+    return user_id in config.admins
 
-bot = Bot(BOT_TOKEN)
+class RetryMiddleware(BaseRequestMiddleware):
+    """
+    Retry Bot API calls that Telegram asked us to repeat: flood control
+    (RetryAfter, waits exactly as long as requested) and transient 5xx
+    failures (exponential backoff). Network errors and timeouts are retried
+    only for IDEMPOTENT_METHODS: a sendMessage whose response was lost may
+    have been delivered, and sending it again would duplicate the message.
+    Anything else is raised to the handler.
+    """
+
+    IDEMPOTENT_METHODS = frozenset({"getUpdates", "getMe", "answerCallbackQuery", "deleteWebhook"})
+
+    def __init__(self, max_retries: int = API_MAX_RETRIES, backoff: float = 0.5):
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def __call__(self, make_request, bot, method):
+        attempt = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = e.retry_after
+            except TelegramServerError:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            except TelegramNetworkError:
+                if attempt >= self.max_retries or method.__api_method__ not in self.IDEMPOTENT_METHODS:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+class KeepAliveSession(AiohttpSession):
+    """AiohttpSession whose connection pool keeps idle connections open for `keepalive_timeout` seconds."""
+
+    def __init__(self, keepalive_timeout: float, limit: int = 100, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.keepalive_timeout = keepalive_timeout
+        self.limit = limit
+
+    async def create_session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+                limit=self.limit,
+                ttl_dns_cache=3600,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = ClientSession(connector=connector, headers={"User-Agent": f"aiogram/{aiogram.__version__}"})
+        return self._session
+
+
+def make_session():
+    # keep idle connections to api.telegram.org open between user interactions
+    session = KeepAliveSession(API_KEEPALIVE, limit=API_POOL_SIZE, timeout=API_TIMEOUT)
+    session.middleware(RetryMiddleware())
+    return session
+
+
+bot = Bot(BOT_TOKEN, session=make_session())
 dp = Dispatcher()
 
 # in-memory state for pending review submissions
 pending_reviews = set()
 # in-memory state for pending admin range selections {admin_id: {stage: 'start'|'end', start: 'YYYY-MM-DD'}}
 pending_range = {}
+# long-running tasks started from main(); kept here so they are not garbage collected
+background_tasks = set()
+
+# serializes writers inside this process; BEGIN IMMEDIATE does the same across worker processes
+_write_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def db_connect():
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        yield db
+
+
+@asynccontextmanager
+async def db_write():
+    """
+    Open a write transaction. All writes go through here so there is a single
+    writer at a time: the process-local lock orders coroutines, BEGIN IMMEDIATE
+    takes SQLite's reserved lock so concurrent worker processes queue up too.
+    Commits on success, rolls back on error.
+    """
+    async with _write_lock:
+        async with db_connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                await db.rollback()
+                raise
+            await db.commit()
+
+
+def is_not_modified(e: Exception) -> bool:
+    return isinstance(e, TelegramBadRequest) and "message is not modified" in e.message.lower()
+
+
+async def edit_or_answer(message: types.Message, text: str, reply_markup=None):
+    """
+    Navigation flows edit the message the button belongs to instead of sending
+    a new one. Falls back to a new message when the original can't be edited
+    (too old, deleted); an unchanged message is not an error.
+    """
+    try:
+        return await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if is_not_modified(e):
+            return message
+        return await message.answer(text, reply_markup=reply_markup)
+
+
+async def notify_admins(text: str):
+    """Send `text` to every admin concurrently; one unreachable admin does not delay the others."""
+    async def send(admin_id):
+        try:
+            await send_limiter.acquire()
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            print(f"Could not notify admin {admin_id}: {e}")
+
+    admins = config.admins
+    if admins:
+        await asyncio.gather(*(send(admin_id) for admin_id in admins))
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """
+    Run updates of one user strictly one after another (booking → comment,
+    leave_review → review text) while different users are handled concurrently.
+    A user's lock only exists while they have updates in flight.
+    """
+
+    def __init__(self):
+        # user_id -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        entry = self._locks.get(user.id)
+        if entry is None:
+            entry = self._locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user.id]
+
+
+class DuplicateTapMiddleware(BaseMiddleware):
+    """
+    Drop a callback that repeats the previous tap of the same user on the same
+    button within `window` seconds (double taps on a calendar day, time slot...).
+    The window counts from when the first tap finished, so a slow first render
+    still swallows the second tap.
+    """
+
+    def __init__(self, window: float = DUPLICATE_TAP_WINDOW):
+        self.window = window
+        # (user_id, message_id, data) -> monotonic time of the last handled tap
+        self._seen = {}
+
+    def _prune(self, now: float):
+        stale = [k for k, t in self._seen.items() if now - t >= self.window]
+        for k in stale:
+            del self._seen[k]
+
+    async def __call__(self, handler, event: types.CallbackQuery, data):
+        message_id = event.message.message_id if event.message else None
+        key = (event.from_user.id, message_id, event.data)
+        now = monotonic()
+        last = self._seen.get(key)
+        if last is not None and now - last < self.window:
+            try:
+                await event.answer()
+            except Exception:
+                pass
+            return None
+
+        self._seen[key] = now
+        try:
+            return await handler(event, data)
+        finally:
+            self._seen[key] = monotonic()
+            if len(self._seen) > 1000:
+                self._prune(monotonic())
+
+
+# cost class -> (burst, tokens refilled per second)
+THROTTLE_LIMITS = {
+    "nav": (10, 3.0),     # static replies, no DB
+    "heavy": (5, 0.5),    # calendar renders, bookings, admin lists
+    "text": (5, 1.0),     # commands and free text (comments, reviews)
+}
+# callbacks answered without touching the DB or rendering a calendar
+CHEAP_CALLBACKS = ("noop", "cal_disabled", "cal_blocked", "contact", "mywork", "leave_review", "cancel_block_range")
+
+
+def throttle_class(event) -> str:
+    if isinstance(event, types.Message):
+        return "text"
+    data = event.data or ""
+    return "nav" if data.startswith(CHEAP_CALLBACKS) else "heavy"
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """
+    Token bucket per (user, cost class) so one client hammering the calendar
+    or flooding free text cannot starve everyone else. Admins are exempt.
+    A bucket that has refilled to full is the same as no bucket, so idle ones
+    are dropped once the store grows.
+    """
+
+    def __init__(self, limits: dict = None):
+        self.limits = limits or THROTTLE_LIMITS
+        # (user_id, cost class) -> [tokens, monotonic time of last update, already told]
+        self._buckets = {}
+
+    def _prune(self, now: float):
+        stale = []
+        for key, (tokens, last, _) in self._buckets.items():
+            burst, rate = self.limits[key[1]]
+            if tokens + (now - last) * rate >= burst:
+                stale.append(key)
+        for key in stale:
+            del self._buckets[key]
+
+    def allow(self, user_id: int, cost_class: str, now: float = None):
+        """Take a token. Returns (allowed, first refusal of this streak)."""
+        now = monotonic() if now is None else now
+        burst, rate = self.limits[cost_class]
+        key = (user_id, cost_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(burst), now, False]
+        else:
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, False
+        first = not bucket[2]
+        bucket[2] = True
+        return False, first
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or is_admin(user.id):
+            return await handler(event, data)
+
+        allowed, first = self.allow(user.id, throttle_class(event))
+        if allowed:
+            return await handler(event, data)
+        try:
+            if isinstance(event, types.CallbackQuery):
+                await event.answer("⏳ Слишком часто, подождите немного")
+            elif first:
+                # one reply per streak, otherwise the flood would be answered message for message
+                await event.answer("⏳ Слишком часто, подождите немного")
+        except Exception:
+            pass
+        return None
+
+
+class UpdateRecorder:
+    """
+    Append incoming updates to an NDJSON file for offline replay
+    (scripts/replay_updates.py). User and chat ids are replaced by a salted
+    hash, names are dropped; one line per update: {"ts": ..., "update": {...}}.
+    """
+
+    def __init__(self, path: str, salt: str = RECORD_SALT):
+        self.salt = salt
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def anon_id(self, value: int) -> int:
+        digest = hashlib.sha256(f"{self.salt}:{value}".encode()).digest()
+        # keep it positive and below 2**52 so it is still a valid Telegram id
+        return int.from_bytes(digest[:6], "big")
+
+    def _anonymize(self, obj):
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if key in ("from", "chat", "user", "sender_chat") and isinstance(value, dict) and "id" in value:
+                    value["id"] = self.anon_id(value["id"])
+                    for field in ("username", "last_name", "first_name", "title"):
+                        if field in value:
+                            value[field] = "anon"
+                self._anonymize(value)
+        elif isinstance(obj, list):
+            for item in obj:
+                self._anonymize(item)
+        return obj
+
+    def record(self, update: types.Update):
+        try:
+            raw = self._anonymize(update.model_dump(mode="json", exclude_unset=True, by_alias=True))
+            self._file.write(json.dumps({"ts": datetime.now().timestamp(), "update": raw}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Error recording update: {e}")
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    def __init__(self, recorder: UpdateRecorder):
+        self.recorder = recorder
+
+    async def __call__(self, handler, event: types.Update, data):
+        self.recorder.record(event)
+        return await handler(event, data)
+
+
+recorder = UpdateRecorder(RECORD_UPDATES_PATH) if RECORD_UPDATES_PATH else None
+if recorder:
+    print(f"Recording updates to {RECORD_UPDATES_PATH}; admins appear as {[recorder.anon_id(a) for a in ADMIN_IDS]}")
+    # sharded mode records in the ingress instead, before updates fan out to workers
+    if WORKERS == 1:
+        dp.update.outer_middleware(UpdateRecorderMiddleware(recorder))
+
+class UpdateStatsMiddleware(BaseMiddleware):
+    """
+    Counters for /health and the multi-bot host: updates handled, updates whose
+    handler raised, and total handling time (excluding the per-user queue wait).
+    """
+
+    def __init__(self):
+        self.updates = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    async def __call__(self, handler, event, data):
+        started = monotonic()
+        self.updates += 1
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.busy_seconds += monotonic() - started
+
+    def summary(self) -> str:
+        avg = 1000 * self.busy_seconds / self.updates if self.updates else 0
+        return f"updates {self.updates}, errors {self.errors}, avg {avg:.1f} ms"
+
+
+update_stats = UpdateStatsMiddleware()
+
+dp.update.outer_middleware(UserOrderingMiddleware())
+dp.update.outer_middleware(update_stats)
+dp.callback_query.outer_middleware(DuplicateTapMiddleware())
+if THROTTLE_ENABLED:
+    throttle = ThrottleMiddleware()
+    dp.callback_query.outer_middleware(throttle)
+    dp.message.outer_middleware(throttle)
+
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
+        # WAL lets readers in other workers proceed while one of them writes
+        await db.execute("PRAGMA journal_mode=WAL")
         await db.execute("""
         CREATE TABLE IF NOT EXISTS bookings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -64,9 +515,21 @@ async def init_db():
             user_id INTEGER,
             name TEXT,
             text TEXT,
-            created_at TEXT
+            created_at TEXT,
+            status TEXT NOT NULL DEFAULT 'approved',
+            digest_sent INTEGER NOT NULL DEFAULT 0
         )
         """)
+        # moderation: reviews written before it existed stay published, new ones
+        # are inserted as 'pending' and go out to admins in digests (digest_sent:
+        # 0 = waiting, 2 = queued in the outbox, 1 = delivered to an admin)
+        cursor = await db.execute("PRAGMA table_info(reviews)")
+        review_cols = {c[1] for c in await cursor.fetchall()}
+        if 'status' not in review_cols:
+            await db.execute("ALTER TABLE reviews ADD COLUMN status TEXT NOT NULL DEFAULT 'approved'")
+        if 'digest_sent' not in review_cols:
+            await db.execute("ALTER TABLE reviews ADD COLUMN digest_sent INTEGER NOT NULL DEFAULT 0")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_reviews_status ON reviews(status, id)")
         # table for blocked dates (admin can block/unblock specific dates)
         await db.execute("""
         CREATE TABLE IF NOT EXISTS blocked_dates (
@@ -79,676 +542,3568 @@ async def init_db():
             weekday INTEGER PRIMARY KEY
         )
         """)
+        # transactional outbox: user notifications written together with the booking change
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at TEXT NOT NULL,
+            last_error TEXT,
+            review_batch TEXT
+        )
+        """)
+        # review_batch: ids of the reviews a digest message covers ("3,4,5")
+        cursor = await db.execute("PRAGMA table_info(outbox)")
+        if 'review_batch' not in {c[1] for c in await cursor.fetchall()}:
+            await db.execute("ALTER TABLE outbox ADD COLUMN review_batch TEXT")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings(date)")
+        # small process state that must survive restarts (the update offset to resume from)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+        # admin actions, see AuditLog; append-only
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            at TEXT,
+            admin_id INTEGER,
+            action TEXT,
+            booking_id INTEGER,
+            details TEXT
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_audit_at ON audit_log(at)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_audit_admin ON audit_log(admin_id, at)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_audit_booking ON audit_log(booking_id) WHERE booking_id IS NOT NULL")
+        # admins added at runtime (ADMIN_IDS from the env are always admins) and /set overrides
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY,
+            added_by INTEGER,
+            added_at TEXT
+        )
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+        # recurring schedule rules, see ScheduleRule; weekdays/slots are comma lists, empty = all
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT,
+            weekdays TEXT,
+            slots TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            every_weeks INTEGER DEFAULT 1,
+            priority INTEGER DEFAULT 0,
+            note TEXT
+        )
+        """)
+        # waitlist for full days; status: waiting -> offered -> booked / declined / expired
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT,
+            date TEXT,
+            joined_at REAL,
+            status TEXT DEFAULT 'waiting',
+            offered_time TEXT,
+            offer_expires_at REAL
+        )
+        """)
+        # the queue of a date in join order: next in line is one index probe
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_queue ON waitlist(date, joined_at) WHERE status = 'waiting'")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_offers ON waitlist(date, offered_time) WHERE status = 'offered'")
+        # short booking-flow leases, one per user; mirrors SlotHolds so other workers see them
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS slot_holds (
+            user_id INTEGER PRIMARY KEY,
+            date TEXT,
+            time TEXT,
+            expires_at REAL
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_slot_holds_date ON slot_holds(date)")
+        # broadcasts walk recipients by user_id; last_user_id is the resume point
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            text TEXT,
+            since TEXT,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """)
+        # users who blocked the bot (learned from 403 answers); never messaged proactively again
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            user_id INTEGER PRIMARY KEY,
+            blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id)")
+        # archives: same columns as the live tables plus when the row was moved
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS bookings_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            name TEXT,
+            date TEXT,
+            time TEXT,
+            comment TEXT,
+            archived_at TEXT
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_date ON bookings_archive(date)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_user ON bookings_archive(user_id)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS reviews_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            name TEXT,
+            text TEXT,
+            created_at TEXT,
+            archived_at TEXT,
+            status TEXT
+        )
+        """)
+        cursor = await db.execute("PRAGMA table_info(reviews_archive)")
+        if 'status' not in {c[1] for c in await cursor.fetchall()}:
+            await db.execute("ALTER TABLE reviews_archive ADD COLUMN status TEXT")
         await db.commit()
 
-import calendar
 
-async def build_calendar(year: int = None, month: int = None, months: int = 2, booking_id: int = 0, admin_mode: bool = False):
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+class LoopLagMonitor:
     """
-    Build an inline keyboard calendar that can render multiple sequential months when `months` > 1.
-    - dates outside allowed range are disabled
-    - dates with >=2 bookings are marked as full and disabled
-    - dates with 1 booking show (1/2)
-    - admin_mode=True will show blocked dates and allow toggling and includes admin controls in the same keyboard
+    Measures event-loop lag: a task asks to wake every `interval` seconds and
+    records how late it actually woke. A watchdog thread watches the task's
+    heartbeat; when the loop has not come back for `threshold` seconds it
+    prints the loop thread's current stack, i.e. whatever is blocking it.
     """
-    today = datetime.now().date()
-    if year is None or month is None:
-        year = today.year
-        month = today.month
 
-    min_date = today
-    max_date = today + timedelta(days=30 * months)
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD_MS / 1000, keep: int = 2400):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = collections.deque(maxlen=keep)
+        self.stalls = 0
+        self.started_at = None
+        self.heartbeat = None
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+
+    def percentiles(self):
+        """Lag in ms: p50, p95, p99 and max over the kept samples (None before the first one)."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        pick = lambda pct: 1000 * ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+        return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "max": 1000 * ordered[-1]}
+
+    def _watchdog(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self.heartbeat
+            stalled = monotonic() - beat
+            if stalled < self.threshold or beat == reported:
+                continue
+            # one sample per stall: the heartbeat does not move until the loop is back
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            print(f"⚠️ Event loop blocked for {stalled * 1000:.0f} ms, loop thread stack:\n{stack}")
+
+    async def run(self):
+        self._loop_thread_id = threading.get_ident()
+        self.started_at = self.heartbeat = monotonic()
+        if self.threshold > 0:
+            threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                expected = monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = monotonic()
+                self.samples.append(max(0.0, now - expected))
+                self.heartbeat = now
+        finally:
+            self._stop.set()
 
-    keyboard = []
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        # fetch closed weekdays (recurring non-working days)
-        cursor = await db.execute("SELECT weekday FROM closed_weekdays")
-        rows = await cursor.fetchall()
-        closed_wd = {r[0] for r in rows}
-
-        # render sequential months
-        for offset in range(months):
-            cur_month = month + offset
-            cur_year = year
-            # normalize month/year
-            while cur_month > 12:
-                cur_month -= 12
-                cur_year += 1
-
-            # month header
-            header_row = [InlineKeyboardButton(text=f"{calendar.month_name[cur_month]} {cur_year}", callback_data="noop")]
-            keyboard.append(header_row)
-
-            cal_matrix = calendar.monthcalendar(cur_year, cur_month)
-            # Weekday headers (only once per month)
-            weekday_names = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
-            keyboard.append([InlineKeyboardButton(text=wd, callback_data="noop") for wd in weekday_names])
-
-            for week in cal_matrix:
-                row = []
-                for day in week:
-                    if day == 0:
-                        row.append(InlineKeyboardButton(text=" ", callback_data="noop"))
-                    else:
-                        d = datetime(cur_year, cur_month, day).date()
-                        if d < min_date or d > max_date:
-                            row.append(InlineKeyboardButton(text=str(day), callback_data="cal_disabled"))
-                        else:
-                            # check blocked (single-date blocks)
-                            cursor = await db.execute("SELECT 1 FROM blocked_dates WHERE date = ?", (d.isoformat(),))
-                            blocked = await cursor.fetchone() is not None
-                            # check if this weekday is globally closed
-                            week_closed = d.weekday() in closed_wd
-                            # check booking count
-                            cursor = await db.execute("SELECT COUNT(*) FROM bookings WHERE date = ?", (d.strftime("%d.%m.%Y"),))
-                            cnt = (await cursor.fetchone())[0]
-
-                            # Represent closed weekdays as blocked for users
-                            if admin_mode:
-                                text = f"{d.day}"
-                                if blocked or week_closed:
-                                    text = f"⛔{d.day}"
-                                    cb = f"toggle_block_{d.isoformat()}"
-                                else:
-                                    if cnt >= 2:
-                                        text = f"🔴{d.day}"
-                                    elif cnt == 1:
-                                        text = f"{d.day} (1/2)"
-                                    cb = f"toggle_block_{d.isoformat()}"
-                                row.append(InlineKeyboardButton(text=text, callback_data=cb))
-                            else:
-                                if blocked or week_closed:
-                                    row.append(InlineKeyboardButton(text=f"⛔{d.day}", callback_data="cal_blocked"))
-                                else:
-                                    if cnt >= 2:
-                                        row.append(InlineKeyboardButton(text=f"🔴{d.day}", callback_data="cal_disabled"))
-                                    elif cnt == 1:
-                                        cb = f"cal_day_{d.isoformat()}_{booking_id}"
-                                        row.append(InlineKeyboardButton(text=f"{d.day} (1/2)", callback_data=cb))
-                                    else:
-                                        cb = f"cal_day_{d.isoformat()}_{booking_id}"
-                                        row.append(InlineKeyboardButton(text=str(d.day), callback_data=cb))
-                keyboard.append(row)
-
-        # Navigation row for the first month (keeps previous behaviour)
-        prev_month_date = (datetime(year, month, 1) - timedelta(days=1))
-        next_month_date = (datetime(cur_year, cur_month, calendar.monthrange(cur_year, cur_month)[1]) + timedelta(days=1))
-
-        nav_row = []
-        nav_row.append(InlineKeyboardButton(text="◀️", callback_data=f"cal_month_{prev_month_date.year}_{prev_month_date.month}_{months}_{int(admin_mode)}"))
-        nav_row.append(InlineKeyboardButton(text=f"{calendar.month_name[month]} {year}", callback_data=f"choose_month_{year}_{int(admin_mode)}"))
-        nav_row.append(InlineKeyboardButton(text="▶️", callback_data=f"cal_month_{next_month_date.year}_{next_month_date.month}_{months}_{int(admin_mode)}"))
-
-        keyboard.append(nav_row)
-
-        # Months range selector + choose month
-        keyboard.append([
-            InlineKeyboardButton(text="Выбрать месяц", callback_data=f"choose_month_{year}_{int(admin_mode)}"),
-            InlineKeyboardButton(text="1 мес", callback_data=f"cal_set_1_{int(admin_mode)}"),
-            InlineKeyboardButton(text="2 мес", callback_data=f"cal_set_2_{int(admin_mode)}")
-        ])
+loop_monitor = LoopLagMonitor()
 
-        # If admin mode, add admin controls directly in the same keyboard (single message)
-        if admin_mode:
-            keyboard.append([
-                InlineKeyboardButton(text="⚠️ Блокировать диапазон", callback_data="admin_block_range"),
-                InlineKeyboardButton(text="⛔ Очистить блокировки", callback_data="admin_clear_blocks")
-            ])
-            keyboard.append([InlineKeyboardButton(text="Назад", callback_data="admin")])
 
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+class AuditLog:
+    """
+    Append-only record of admin actions. record() only appends to a memory
+    buffer, so an admin tap costs no extra commit; flusher() writes the buffer
+    every AUDIT_FLUSH_INTERVAL seconds (sooner once AUDIT_BATCH_SIZE entries
+    are waiting) in one transaction. Entries that fail to write stay buffered
+    for the next flush; the buffer is flushed on shutdown as well.
+    """
 
+    def __init__(self):
+        self.pending = []
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, admin_id: int, action: str, booking_id: int = None, details: str = ""):
+        self.pending.append((datetime.now().isoformat(timespec="seconds"), admin_id, action, booking_id, details))
+        if len(self.pending) >= AUDIT_BATCH_SIZE:
+            self._full.set()
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            try:
+                async with db_write() as db:
+                    await db.executemany(
+                        "INSERT INTO audit_log (at, admin_id, action, booking_id, details) VALUES (?, ?, ?, ?, ?)",
+                        batch
+                    )
+            except Exception as e:
+                print(f"Audit log: could not write {len(batch)} entries, will retry: {e}")
+                self.pending = batch + self.pending
+                return 0
+            return len(batch)
+
+    async def flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=AUDIT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
 
-@dp.callback_query(lambda c: c.data.startswith("cal_set_"))
-async def cal_set_months(call: types.CallbackQuery):
-    try:
-        parts = call.data.replace("cal_set_", "").split("_")
-        months = int(parts[0])
-        admin_mode = bool(int(parts[1])) if len(parts) > 1 else False
-        markup = await build_calendar(months=months, admin_mode=admin_mode)
+
+audit = AuditLog()
+
+
+# set after a transaction queued notifications so the sender does not wait for its next poll
+_outbox_wakeup = asyncio.Event()
+
+
+async def enqueue_notification(db, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None,
+                               review_batch: str = None):
+    """
+    Queue a message for `chat_id` inside the caller's db_write() transaction, so
+    it is stored if and only if the change it describes is committed. Call
+    wake_outbox() after the transaction. `review_batch` marks a review digest
+    (see send_review_digest()).
+    """
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+    await db.execute(
+        "INSERT INTO outbox (chat_id, text, reply_markup, next_attempt_at, created_at, review_batch) VALUES (?, ?, ?, ?, ?, ?)",
+        (chat_id, text, markup, datetime.now().timestamp(), datetime.now().isoformat(), review_batch)
+    )
+
+
+def wake_outbox():
+    _outbox_wakeup.set()
+
+
+async def _outbox_deliver(row, sem):
+    msg_id, chat_id, text, markup, attempts = row
+    reply_markup = InlineKeyboardMarkup.model_validate_json(markup) if markup else None
+    async with sem:
         try:
-            await call.message.edit_text("📅 Выберите дату:", reply_markup=markup)
+            await send_limiter.acquire()
+            await bot.send_message(chat_id, text, reply_markup=reply_markup)
+            return msg_id, "sent", attempts, None
+        except TelegramForbiddenError as e:
+            # blocked by the user: retrying will not help
+            return msg_id, "blocked", attempts + 1, str(e)
+        except TelegramBadRequest as e:
+            # chat gone: retrying will not help
+            return msg_id, "failed", attempts + 1, str(e)
         except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error editing message in cal_set_months: {e}")
-        await call.answer()
-    except Exception as e:
-        if "message is not modified" in str(e).lower():
-            # ignore harmless Telegram 'message is not modified' errors
-            pass
-        else:
-            print(f"Error in cal_set_months: {e}")
-        await call.answer()
+            return msg_id, "retry", attempts + 1, str(e)
 
 
-@dp.callback_query(lambda c: c.data.startswith("cal_month_"))
-async def cal_month_nav(call: types.CallbackQuery):
-    try:
-        parts = call.data.replace("cal_month_", "").split("_")
-        year = int(parts[0])
-        month = int(parts[1])
-        months = int(parts[2])
-        admin_mode = bool(int(parts[3])) if len(parts) > 3 else False
-        markup = await build_calendar(year=year, month=month, months=months, admin_mode=admin_mode)
+async def drain_outbox(limit: int = 100) -> int:
+    """Send one batch of due notifications; returns how many were picked up."""
+    now = datetime.now().timestamp()
+    async with db_connect() as db:
+        cursor = await db.execute(
+            "SELECT id, chat_id, text, reply_markup, attempts, review_batch FROM outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (now, limit)
+        )
+        rows = await cursor.fetchall()
+    if not rows:
+        return 0
+
+    sem = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+    results = await asyncio.gather(*(_outbox_deliver(row[:5], sem) for row in rows))
+
+    # record the whole batch in one transaction
+    chat_ids = {row[0]: row[1] for row in rows}
+    review_batches = {row[0]: row[5] for row in rows if row[5]}
+    async with db_write() as db:
+        for msg_id, outcome, attempts, error in results:
+            if outcome == "blocked":
+                await db.execute("INSERT OR IGNORE INTO blocked_users (user_id) VALUES (?)", (chat_ids[msg_id],))
+            if outcome == "sent":
+                await db.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+            elif outcome in ("failed", "blocked") or attempts >= OUTBOX_MAX_ATTEMPTS:
+                print(f"Outbox: giving up on message {msg_id}: {error}")
+                await db.execute("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?", (attempts, error, msg_id))
+            else:
+                retry_at = datetime.now().timestamp() + min(3600, 5 * 2 ** attempts)
+                await db.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (attempts, retry_at, error, msg_id)
+                )
+        # deliveries first, so a copy that failed next to a delivered one does not put its batch back
+        for msg_id, outcome, attempts, error in sorted(results, key=lambda r: r[1] != "sent"):
+            if msg_id in review_batches:
+                await _settle_review_batch(db, review_batches[msg_id], outcome == "sent")
+    return len(rows)
+
+
+async def outbox_sender():
+    """Background task delivering queued notifications with bounded concurrency and retries."""
+    while True:
+        _outbox_wakeup.clear()
         try:
-            await call.message.edit_text("📅 Выберите дату:", reply_markup=markup)
+            if await drain_outbox():
+                continue
         except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error editing message in cal_month_nav: {e}")
-        await call.answer()
-    except Exception as e:
-        if "message is not modified" in str(e).lower():
+            print(f"Error in outbox sender: {e}")
+        try:
+            await asyncio.wait_for(_outbox_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
             pass
-        else:
-            print(f"Error in cal_month_nav: {e}")
-        await call.answer()
 
-
-@dp.callback_query(lambda c: c.data.startswith("choose_month_"))
-async def choose_month(call: types.CallbackQuery):
+def _backup_copy(src_path: str, dest_path: str, pages: int) -> str:
+    # runs in a thread; copying a few pages per step releases the read lock
+    # between steps so commits in time_selected are never held up for long
+    src = sqlite3.connect(src_path, timeout=DB_BUSY_TIMEOUT)
+    dst = sqlite3.connect(dest_path)
     try:
-        parts = call.data.replace("choose_month_", "").split("_")
-        year = int(parts[0])
-        admin_mode = bool(int(parts[1])) if len(parts) > 1 else False
-        # build a grid of months for the year
-        buttons = []
-        row = []
-        for m in range(1, 13):
-            row.append(InlineKeyboardButton(text=f"{m}", callback_data=f"goto_month_{year}_{m}_{int(admin_mode)}"))
-            if len(row) == 4:
-                buttons.append(row)
-                row = []
-        if row:
-            buttons.append(row)
+        src.backup(dst, pages=pages, sleep=0.01)
+        return dst.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
 
-        # year navigation
-        buttons.append([
-            InlineKeyboardButton(text="◀️", callback_data=f"choose_month_{year-1}_{int(admin_mode)}"),
-            InlineKeyboardButton(text=f"{year}", callback_data="noop"),
-            InlineKeyboardButton(text="▶️", callback_data=f"choose_month_{year+1}_{int(admin_mode)}")
-        ])
 
+def _rotate_backups(directory: str, prefix: str, keep: int):
+    files = sorted(f for f in os.listdir(directory) if f.startswith(prefix) and f.endswith(".db"))
+    for name in files[:-keep] if keep > 0 else []:
         try:
-            await call.message.edit_text(f"Выберите месяц: {year}", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
-        except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error editing message in choose_month: {e}")
-        await call.answer()
-    except Exception as e:
-        if "message is not modified" in str(e).lower():
-            pass
-        else:
-            print(f"Error in choose_month: {e}")
-        await call.answer() 
+            os.remove(os.path.join(directory, name))
+        except OSError as e:
+            print(f"Could not remove old backup {name}: {e}")
 
 
-@dp.callback_query(lambda c: c.data.startswith("goto_month_"))
-async def goto_month(call: types.CallbackQuery):
-    try:
-        parts = call.data.replace("goto_month_", "").split("_")
-        year = int(parts[0])
-        month = int(parts[1])
-        admin_mode = bool(int(parts[2])) if len(parts) > 2 else False
-        markup = await build_calendar(year=year, month=month, months=1, admin_mode=admin_mode)
+_backup_lock = asyncio.Lock()
+
+
+async def backup_database(directory: str = None, keep: int = None):
+    """
+    Take an online backup of DB_PATH with SQLite's backup API, verify it with
+    PRAGMA integrity_check and keep the newest `keep` copies.
+    Returns (path, integrity_result); a backup that fails the check is deleted.
+    """
+    directory = directory or BACKUP_DIR
+    keep = BACKUP_KEEP if keep is None else keep
+    prefix = os.path.splitext(os.path.basename(DB_PATH))[0] + "-"
+    os.makedirs(directory, exist_ok=True)
+    async with _backup_lock:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        final_path = os.path.join(directory, f"{prefix}{stamp}.db")
+        tmp_path = final_path + ".partial"
+        try:
+            result = await asyncio.to_thread(_backup_copy, DB_PATH, tmp_path, BACKUP_PAGES_PER_STEP)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if result != "ok":
+            os.remove(tmp_path)
+            print(f"Backup failed integrity check: {result}")
+            return None, result
+        os.replace(tmp_path, final_path)
+        _rotate_backups(directory, prefix, keep)
+    return final_path, result
+
+
+async def backup_scheduler():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)
         try:
-            await call.message.edit_text("📅 Выберите дату:", reply_markup=markup)
+            path, result = await backup_database()
+            if path:
+                print(f"Backup written: {path}")
         except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error editing message in goto_month: {e}")
-        await call.answer()
-    except Exception as e:
-        if "message is not modified" in str(e).lower():
-            pass
-        else:
-            print(f"Error in goto_month: {e}")
-        await call.answer()
+            print(f"Error in scheduled backup: {e}")
 
 
-@dp.callback_query(lambda c: c.data.startswith("cal_day_"))
-async def cal_day_select(call: types.CallbackQuery):
-    print(f"cal_day_select invoked: {call.data} by {getattr(call.from_user, 'id', None)}")
-    try:
-        payload = call.data.replace("cal_day_", "")
-        date_str, booking_id_str = payload.rsplit("_", 1)
-        booking_id = int(booking_id_str)
+# bookings.date is DD.MM.YYYY (older rows may be ISO); this turns it into a comparable ISO string
+BOOKING_DATE_ISO_SQL = "CASE WHEN date LIKE '__.__.____' THEN substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2) ELSE date END"
 
-        # check blocked
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT 1 FROM blocked_dates WHERE date = ?", (date_str,))
-            if await cursor.fetchone():
-                await call.answer("Эта дата заблокирована", show_alert=True)
-                return
 
-        if booking_id == 0:
-            await call.message.answer(f"Вы выбрали дату: {date_str}\nВыберите время:", reply_markup=time_keyboard(date_str))
-        else:
-            async with aiosqlite.connect(DB_PATH) as db:
-                cursor = await db.execute("SELECT user_id, name FROM bookings WHERE id = ?", (booking_id,))
-                row = await cursor.fetchone()
-                if row:
-                    user_id, name = row
-                    await db.execute("UPDATE bookings SET date = ? WHERE id = ?", (date_str, booking_id))
-                    await db.commit()
-                    await call.message.answer(f"✅ Обновлено: {name} → {date_str}")
+async def _archive_batch(select_sql: str, params, live: str, archive: str, columns: str) -> int:
+    async with db_write() as db:
+        cursor = await db.execute(select_sql, params)
+        ids = [r[0] for r in await cursor.fetchall()]
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        await db.execute(
+            f"INSERT OR REPLACE INTO {archive} ({columns}, archived_at) SELECT {columns}, ? FROM {live} WHERE id IN ({marks})",
+            [datetime.now().isoformat(), *ids]
+        )
+        await db.execute(f"DELETE FROM {live} WHERE id IN ({marks})", ids)
+    return len(ids)
+
+
+async def archive_old_records(cutoff_days: int = None, batch_size: int = None):
+    """
+    Move bookings older than `cutoff_days` and moderated reviews other than
+    the newest REVIEWS_KEEP_LIVE approved ones into the archive tables, `batch_size` rows per
+    transaction so the bot's own writes interleave. Returns (bookings, reviews) moved.
+    """
+    cutoff_days = ARCHIVE_AFTER_DAYS if cutoff_days is None else cutoff_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    cutoff = (datetime.now().date() - timedelta(days=cutoff_days)).isoformat()
+
+    moved_bookings = 0
+    while True:
+        n = await _archive_batch(
+            f"SELECT id FROM bookings WHERE {BOOKING_DATE_ISO_SQL} < ? ORDER BY id LIMIT ?", (cutoff, batch_size),
+            "bookings", "bookings_archive", "id, user_id, name, date, time, comment"
+        )
+        moved_bookings += n
+        if n < batch_size:
+            break
+        await asyncio.sleep(0)
+
+    moved_reviews = 0
+    while True:
+        n = await _archive_batch(
+            "SELECT id FROM reviews WHERE status != 'pending' AND id NOT IN "
+            "(SELECT id FROM reviews WHERE status = 'approved' ORDER BY id DESC LIMIT ?) ORDER BY id LIMIT ?",
+            (REVIEWS_KEEP_LIVE, batch_size),
+            "reviews", "reviews_archive", "id, user_id, name, text, created_at, status"
+        )
+        moved_reviews += n
+        if n < batch_size:
+            break
+        await asyncio.sleep(0)
+
+    if booking_store:
+        booking_store.forget_archived(datetime.fromisoformat(cutoff).date(), REVIEWS_KEEP_LIVE)
+    return moved_bookings, moved_reviews
+
+
+async def archive_scheduler():
+    while True:
+        try:
+            bookings, reviews = await archive_old_records()
+            if bookings or reviews:
+                print(f"Archived {bookings} bookings and {reviews} reviews")
+        except Exception as e:
+            print(f"Error in archival job: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+class RateLimiter:
+    """Spaces out acquire() calls to at most `rate` per second across all callers."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_at = 0.0
+
+    async def acquire(self):
+        now = monotonic()
+        wait = self._next_at - now
+        self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# one budget for every bulk sender of this process, so broadcasts running side
+# by side and the outbox together stay under BROADCAST_RATE
+send_limiter = RateLimiter(BROADCAST_RATE)
+
+
+async def broadcast_recipients(after_user_id: int, since: str = None, limit: int = None):
+    """
+    One chunk of distinct past clients with user_id > `after_user_id`, in
+    user_id order (keyset pagination over idx_bookings_user). Archived bookings
+    count as visits; users who blocked the bot are left out. `since` is an ISO
+    date: only users with a booking on or after it.
+    """
+    # each arm walks its user_id index from the keyset; SQLite merges the two
+    # ordered streams into distinct ids and stops at LIMIT, so a chunk never
+    # groups the rows of users beyond it
+    where = "user_id > ? AND user_id NOT IN (SELECT user_id FROM blocked_users)"
+    if since:
+        where += f" AND {BOOKING_DATE_ISO_SQL} >= ?"
+    arm = [after_user_id] + ([since] if since else [])
+    async with db_connect() as db:
+        cursor = await db.execute(
+            f"SELECT user_id FROM bookings WHERE {where} "
+            f"UNION SELECT user_id FROM bookings_archive WHERE {where} "
+            "ORDER BY user_id LIMIT ?",
+            arm + arm + [limit or BROADCAST_CHUNK]
+        )
+        return [r[0] for r in await cursor.fetchall()]
+
+
+async def _broadcast_send(user_id: int, text: str, sem: asyncio.Semaphore):
+    async with sem:
+        await send_limiter.acquire()
+        try:
+            await bot.send_message(user_id, text)
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"
+        except Exception as e:
+            # RetryMiddleware already waited out flood limits and retried 5xx errors; a network
+            # error is not retried, since the message may have arrived
+            print(f"Broadcast: could not message {user_id}: {e}")
+            return "failed"
+
+
+# broadcast ids with a runner in this process
+_broadcast_runners = set()
+
+
+async def run_broadcast(broadcast_id: int):
+    """
+    Send a broadcast chunk by chunk, recording progress after each chunk, so a
+    restart resumes after the last recorded user (at most one chunk is sent twice).
+    """
+    if broadcast_id in _broadcast_runners:
+        return
+    _broadcast_runners.add(broadcast_id)
+    try:
+        async with db_connect() as db:
+            cursor = await db.execute("SELECT admin_id, text, since, last_user_id FROM broadcasts WHERE id = ?", (broadcast_id,))
+            admin_id, text, since, last_user_id = await cursor.fetchone()
+        sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        while True:
+            async with db_connect() as db:
+                cursor = await db.execute("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,))
+                if (await cursor.fetchone())[0] != "running":
+                    return
+            chunk = await broadcast_recipients(last_user_id, since)
+            if not chunk:
+                break
+            outcomes = await asyncio.gather(*(_broadcast_send(u, text, sem) for u in chunk))
+            last_user_id = chunk[-1]
+            async with db_write() as db:
+                for user_id, outcome in zip(chunk, outcomes):
+                    if outcome == "blocked":
+                        await db.execute("INSERT OR IGNORE INTO blocked_users (user_id) VALUES (?)", (user_id,))
+                await db.execute(
+                    "UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ? WHERE id = ?",
+                    (last_user_id, outcomes.count("sent"), len(outcomes) - outcomes.count("sent"), broadcast_id)
+                )
+        async with db_write() as db:
+            await db.execute("UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?", (broadcast_id,))
+            cursor = await db.execute("SELECT sent, failed FROM broadcasts WHERE id = ?", (broadcast_id,))
+            sent, failed = await cursor.fetchone()
+            await enqueue_notification(db, admin_id, f"📣 Рассылка #{broadcast_id} завершена: доставлено {sent}, не доставлено {failed}")
+        wake_outbox()
+    except Exception as e:
+        print(f"Error in broadcast {broadcast_id}: {e}")
+    finally:
+        _broadcast_runners.discard(broadcast_id)
+
+
+async def resume_broadcasts():
+    """Pick up broadcasts interrupted by a restart."""
+    async with db_connect() as db:
+        cursor = await db.execute("SELECT id FROM broadcasts WHERE status = 'running'")
+        ids = [r[0] for r in await cursor.fetchall()]
+    for broadcast_id in ids:
+        print(f"Resuming broadcast {broadcast_id}")
+        spawn_background(run_broadcast(broadcast_id))
+
+
+import calendar
+
+# fixed time slots — you can change these
+TIME_SLOTS = ["10:00", "11:00", "12:00", "14:00", "15:00", "16:00"]
+# maximum bookings per day
+DAILY_CAPACITY = 2
+# "full calendar" is navigable this many months ahead, one month rendered at a time
+FULL_CALENDAR_MONTHS = 12
+# how many slots "Ближайшее свободное время" offers
+NEAREST_SLOTS_COUNT = 6
+# "Мои записи" shows this many bookings (upcoming first)
+MY_BOOKINGS_LIMIT = 10
+# the public "Отзывы" page shows this many approved reviews
+REVIEWS_PAGE_SIZE = 10
+# a review is cut to this many characters in a moderation digest
+REVIEW_DIGEST_TEXT_LIMIT = 300
+# seconds a cached month of availability is trusted (other workers may have written meanwhile)
+AVAILABILITY_TTL = float(os.getenv("AVAILABILITY_TTL", "60"))
+
+# (year, month) -> (loaded_at, {date_iso: bookings}); schedule (blocked/closed days) lives in `schedule`
+_availability_cache = {}
+# bumped by invalidate_availability() so a load that raced with a write is not cached
+_availability_generation = 0
+
+
+def invalidate_availability():
+    """Call after any change to bookings."""
+    global _availability_generation
+    _availability_generation += 1
+    _availability_cache.clear()
+
+
+def shift_month(year: int, month: int, delta: int):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+async def _load_month(db, year: int, month: int, bookings: bool = True):
+    """
+    Taken seats per day of one month: bookings (unless `bookings` is False,
+    when memory has them) plus slots held by open waitlist offers.
+    """
+    days = calendar.monthrange(year, month)[1]
+    # bookings store date as DD.MM.YYYY; IN lists keep the lookups on idx_bookings_date / idx_waitlist_offers
+    displays = [f"{d:02d}.{month:02d}.{year}" for d in range(1, days + 1)]
+    marks = ",".join("?" * days)
+    # an offer keeps its slot taken until it is accepted, declined or expired by the sweeper
+    query = f"SELECT date FROM waitlist WHERE status = 'offered' AND date IN ({marks})"
+    if bookings:
+        query = f"SELECT date FROM bookings WHERE date IN ({marks}) UNION ALL " + query
+    cursor = await db.execute(
+        f"SELECT date, COUNT(*) FROM ({query}) GROUP BY date",
+        displays * (2 if bookings else 1)
+    )
+    counts = {}
+    for date_display, cnt in await cursor.fetchall():
+        dd, mm, yyyy = date_display.split(".")
+        counts[f"{yyyy}-{mm}-{dd}"] = cnt
+    return counts
+
+
+async def month_availability(year: int, month: int):
+    """
+    Taken seats per day of one month ({date_iso: n}), from cache when fresh.
+    With the memory store only the waitlist offers are cached; bookings come from memory.
+    """
+    entry = _availability_cache.get((year, month))
+    if entry and monotonic() - entry[0] < AVAILABILITY_TTL:
+        counts = entry[1]
+    else:
+        generation = _availability_generation
+        async with db_connect() as db:
+            counts = await _load_month(db, year, month, bookings=not booking_store)
+        if generation == _availability_generation:
+            _availability_cache[(year, month)] = (monotonic(), counts)
+    if booking_store:
+        booked = booking_store.month_counts(year, month)
+        for day, n in counts.items():
+            booked[day] = booked.get(day, 0) + n
+        return booked
+    return counts
+
+
+async def prefetch_availability(months):
+    """Warm the cache for the months the user is likely to page to next."""
+    for year, month in months:
+        if (year, month) in _availability_cache:
+            continue
+        try:
+            await month_availability(year, month)
+        except Exception as e:
+            print(f"Error prefetching {month}.{year}: {e}")
+
+
+# days ahead the schedule is compiled into per-day slot masks
+SCHEDULE_HORIZON_DAYS = 31 * (FULL_CALENDAR_MONTHS + 1)
+
+
+@dataclass(frozen=True)
+class ScheduleRule:
+    """
+    A recurring change to the working hours: `action` "close" removes the
+    slots in `slot_mask` on matching days, "open" adds them back. Rules apply
+    in ascending `priority`, so a later one is an exception to an earlier one.
+    A day matches if it lies in [start, end] (None = open-ended), its weekday
+    is in `weekdays` (empty = any) and it falls in every `every_weeks`-th week
+    counted from the week of `start`.
+    """
+    id: int
+    action: str
+    weekdays: frozenset
+    slot_mask: int
+    start: object = None
+    end: object = None
+    every_weeks: int = 1
+    priority: int = 0
+
+    def matches(self, d) -> bool:
+        if self.start and d < self.start or self.end and d > self.end:
+            return False
+        if self.weekdays and d.weekday() not in self.weekdays:
+            return False
+        if self.every_weeks > 1:
+            anchor = self.start or datetime(1970, 1, 5).date()  # a Monday
+            weeks = ((d - timedelta(days=d.weekday())) - (anchor - timedelta(days=anchor.weekday()))).days // 7
+            return weeks % self.every_weeks == 0
+        return True
+
+
+@dataclass(frozen=True)
+class ScheduleSnapshot:
+    """
+    Immutable schedule configuration read by the hot paths without any I/O.
+    Admin toggles never mutate it: they publish a copy with `version` + 1, so
+    the version doubles as a cache key for anything rendered from it.
+
+    Closed weekdays, rules and blocked days are compiled into `masks`: one
+    byte per day from `start`, bit i set when slots[i] is open that day.
+    """
+    version: int
+    closed_weekdays: frozenset  # 0 = Monday
+    blocked: frozenset          # datetime.date of single blocked days (range blocks are stored per day)
+    slots: tuple
+    capacity: int
+    rules: tuple = ()           # ScheduleRule, sorted by priority
+    start: object = None
+    masks: bytes = b""
+
+    def compile_day(self, d) -> int:
+        # blocked days beat everything; rules refine the weekly pattern
+        if d in self.blocked:
+            return 0
+        mask = 0 if d.weekday() in self.closed_weekdays else (1 << len(self.slots)) - 1
+        for rule in self.rules:
+            if rule.matches(d):
+                mask = mask | rule.slot_mask if rule.action == "open" else mask & ~rule.slot_mask
+        return mask
+
+    def slot_mask(self, d) -> int:
+        """Open slots of day `d` as a bitmask; one lookup inside the compiled horizon."""
+        if self.start is not None:
+            i = (d - self.start).days
+            if 0 <= i < len(self.masks):
+                return self.masks[i]
+        return self.compile_day(d)
+
+    def is_closed(self, d) -> bool:
+        return self.slot_mask(d) == 0
+
+    def is_open(self, d, time: str) -> bool:
+        return time in self.slots and self.slot_mask(d) >> self.slots.index(time) & 1 == 1
+
+    def open_slots(self, d):
+        mask = self.slot_mask(d)
+        return [t for i, t in enumerate(self.slots) if mask >> i & 1]
+
+
+schedule = ScheduleSnapshot(0, frozenset(), frozenset(), tuple(TIME_SLOTS), DAILY_CAPACITY)
+# when the snapshot was last compared with the DB (other workers may have toggled meanwhile)
+_schedule_checked_at = None
+
+
+def publish_schedule(affected=None, **changes) -> ScheduleSnapshot:
+    """
+    Swap in a new snapshot with `changes` applied and the version bumped.
+    `affected(day)` names the days the change can touch; only those masks are
+    recompiled. Without it (or on a new day) the whole horizon is compiled.
+    """
+    global schedule
+    draft = replace(schedule, **changes)
+    today = datetime.now().date()
+    if affected is None or draft.start != today:
+        masks = bytes(draft.compile_day(today + timedelta(days=i)) for i in range(SCHEDULE_HORIZON_DAYS))
+    else:
+        masks = bytearray(draft.masks)
+        for i in range(len(masks)):
+            d = today + timedelta(days=i)
+            if affected(d):
+                masks[i] = draft.compile_day(d)
+        masks = bytes(masks)
+    schedule = replace(draft, version=schedule.version + 1, start=today, masks=masks)
+    return schedule
+
+
+def rule_from_row(row, all_slots=None) -> ScheduleRule:
+    """A schedule_rules row; the slot mask is relative to `all_slots` (default: the snapshot's)."""
+    rule_id, action, weekdays, slots, start, end, every_weeks, priority = row
+    all_slots = list(all_slots or schedule.slots)
+    mask = 0
+    for t in (slots.split(",") if slots else all_slots):
+        if t in all_slots:
+            mask |= 1 << all_slots.index(t)
+    return ScheduleRule(
+        rule_id, action,
+        frozenset(int(w) for w in weekdays.split(",")) if weekdays else frozenset(),
+        mask,
+        datetime.fromisoformat(start).date() if start else None,
+        datetime.fromisoformat(end).date() if end else None,
+        every_weeks or 1, priority or 0
+    )
+
+
+def parse_slots_setting(value: str) -> tuple:
+    # at most 8 slots: per-day masks are single bytes
+    slots = tuple(datetime.strptime(t.strip(), "%H:%M").strftime("%H:%M") for t in value.split(",") if t.strip())
+    if not 0 < len(slots) <= 8 or len(set(slots)) != len(slots):
+        raise ValueError(value)
+    return tuple(sorted(slots))
+
+
+def parse_capacity_setting(value: str) -> int:
+    capacity = int(value)
+    if capacity < 1:
+        raise ValueError(value)
+    return capacity
+
+
+DEFAULT_CONTACT = "📞 Контакты администратора:\n@simbviska\nID: 1076207542"
+
+# settings admins can change at runtime with /set: key -> (parser, default, description)
+SETTINGS = {
+    "slots": (parse_slots_setting, ",".join(TIME_SLOTS), "время записи через запятую, до 8"),
+    "capacity": (parse_capacity_setting, str(DAILY_CAPACITY), "записей в день"),
+    "contact": (str, DEFAULT_CONTACT, "текст «📞 Связаться»"),
+}
+
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    """
+    Admins and settings from the DB, swapped as a whole on reload so readers
+    never see half of a change. Slots and capacity live in the schedule
+    snapshot (read through load_schedule) since the calendar keys on it.
+    """
+    admins: frozenset
+    contact: str
+    values: dict  # raw overrides from the settings table
+
+
+config = RuntimeConfig(frozenset(ADMIN_IDS), DEFAULT_CONTACT, {})
+
+
+async def read_settings(db) -> dict:
+    try:
+        cursor = await db.execute("SELECT key, value FROM settings")
+        return dict(await cursor.fetchall())
+    except sqlite3.OperationalError:
+        # a DB that init_db has not migrated yet
+        return {}
+
+
+def setting(values: dict, key: str):
+    """Parsed value of `key`; a stored value that no longer parses falls back to the default."""
+    parser, default, _ = SETTINGS[key]
+    if key in values:
+        try:
+            return parser(values[key])
+        except ValueError:
+            print(f"Ignoring invalid setting {key}={values[key]!r}")
+    return parser(default)
+
+
+async def load_config() -> RuntimeConfig:
+    """Re-read admins and settings from the DB (ADMIN_IDS stay admins regardless)."""
+    global config
+    async with db_connect() as db:
+        values = await read_settings(db)
+        try:
+            cursor = await db.execute("SELECT user_id FROM admins")
+            extra = frozenset(r[0] for r in await cursor.fetchall())
+        except sqlite3.OperationalError:
+            extra = frozenset()
+    config = RuntimeConfig(frozenset(ADMIN_IDS) | extra, setting(values, "contact"), values)
+    await load_schedule()
+    return config
+
+
+async def reload_config() -> bool:
+    """
+    Reload in every process. A sharded worker cannot reach its siblings, so it
+    signals the ingress, which reloads and passes SIGHUP on to all workers;
+    returns False in that case since the reload happens asynchronously.
+    """
+    if WORKERS > 1 and multiprocessing.parent_process() is not None:
+        os.kill(os.getppid(), signal.SIGHUP)
+        return False
+    await load_config()
+    return True
+
+
+def install_reload_signal(forward_to=()):
+    """SIGHUP reloads admins and settings without restarting polling."""
+    if not hasattr(signal, "SIGHUP"):
+        return
+
+    def on_sighup():
+        print("SIGHUP: reloading admins and settings")
+        for pid in forward_to:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+        spawn_background(load_config())
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+
+
+async def load_schedule() -> ScheduleSnapshot:
+    """Read the schedule from the DB; the version only moves if something changed."""
+    global _schedule_checked_at
+    async with db_connect() as db:
+        values = await read_settings(db)
+        slots = setting(values, "slots")
+        capacity = setting(values, "capacity")
+        cursor = await db.execute("SELECT weekday FROM closed_weekdays")
+        closed = frozenset(r[0] for r in await cursor.fetchall())
+        cursor = await db.execute("SELECT date FROM blocked_dates")
+        blocked = frozenset(datetime.fromisoformat(r[0]).date() for r in await cursor.fetchall())
+        try:
+            cursor = await db.execute(
+                "SELECT id, action, weekdays, slots, start_date, end_date, every_weeks, priority "
+                "FROM schedule_rules ORDER BY priority, id"
+            )
+            rules = tuple(rule_from_row(r, slots) for r in await cursor.fetchall())
+        except sqlite3.OperationalError:
+            # a DB that init_db has not migrated yet
+            rules = ()
+    _schedule_checked_at = monotonic()
+    if (schedule.version == 0 or closed != schedule.closed_weekdays or blocked != schedule.blocked
+            or rules != schedule.rules or slots != schedule.slots or capacity != schedule.capacity):
+        publish_schedule(closed_weekdays=closed, blocked=blocked, rules=rules, slots=slots, capacity=capacity)
+    return schedule
+
+
+async def ensure_schedule() -> ScheduleSnapshot:
+    """
+    The current snapshot. Loaded on first use; with several workers it is
+    re-checked after AVAILABILITY_TTL so another worker's toggles show up.
+    """
+    if schedule.version == 0 or (WORKERS > 1 and monotonic() - _schedule_checked_at > AVAILABILITY_TTL):
+        await load_schedule()
+    elif schedule.start != datetime.now().date():
+        # a new day: move the compiled horizon along
+        publish_schedule()
+    return schedule
+
+
+def parse_booking_date(value: str):
+    """Bookings store DD.MM.YYYY; a few older paths wrote ISO dates."""
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return datetime.fromisoformat(value).date()
+
+
+class OccupancyMap:
+    """
+    Compact in-memory view of what can still be booked over the next
+    `horizon_days`, used to answer "nearest free slot" without touching SQLite.
+
+    Per day it keeps a bitmask of taken slots (bit i = slots[i]) and the
+    number of bookings, each in a bytearray indexed by days since `start`;
+    blocked and closed days come from the schedule snapshot. Handlers keep it
+    current with book()/unbook(); it is rebuilt from the DB daily and after
+    AVAILABILITY_TTL so writes of other workers show up.
+    """
+
+    def __init__(self, horizon_days: int = 30 * FULL_CALENDAR_MONTHS + 31):
+        self.horizon_days = horizon_days
+        self._set_slots(tuple(TIME_SLOTS))
+        self.start = None
+        self.loaded_at = None
+        self.taken = bytearray(horizon_days)
+        self.counts = bytearray(horizon_days)
+
+    def _set_slots(self, slots: tuple):
+        self.slots = slots
+        self.full_mask = (1 << len(slots)) - 1
+        self._slot_bit = {t: 1 << i for i, t in enumerate(slots)}
+
+    def _index(self, d):
+        if self.start is None:
+            return None
+        i = (d - self.start).days
+        return i if 0 <= i < self.horizon_days else None
+
+    async def load(self):
+        # bit positions follow the snapshot's slot list, which /set can change
+        current = await ensure_schedule()
+        slot_bit = {t: 1 << i for i, t in enumerate(current.slots)}
+        start = datetime.now().date()
+        taken = bytearray(self.horizon_days)
+        counts = bytearray(self.horizon_days)
+        days = [start + timedelta(days=i) for i in range(self.horizon_days)]
+        displays = [d.strftime("%d.%m.%Y") for d in days]
+        marks = ",".join("?" * len(displays))
+        async with db_connect() as db:
+            # open waitlist offers keep their slot taken; expire_waitlist_offers()
+            # and waitlist_decline unbook it again when it is released
+            cursor = await db.execute(
+                f"SELECT date, offered_time FROM waitlist WHERE status = 'offered' AND date IN ({marks})", displays
+            )
+            rows = await cursor.fetchall()
+            if booking_store:
+                rows += [(b[3], b[4]) for d in days for b in booking_store.day(d)]
+            else:
+                cursor = await db.execute(f"SELECT date, time FROM bookings WHERE date IN ({marks})", displays)
+                rows += await cursor.fetchall()
+        for date_display, time in rows:
+            i = (parse_booking_date(date_display) - start).days
+            counts[i] = min(255, counts[i] + 1)
+            taken[i] |= slot_bit.get(time, 0)
+        self._set_slots(current.slots)
+        self.start, self.taken, self.counts = start, taken, counts
+        self.loaded_at = monotonic()
+
+    async def ensure_current(self):
+        if (self.start != datetime.now().date()
+                or self.slots != schedule.slots
+                or self.loaded_at is None
+                or monotonic() - self.loaded_at > AVAILABILITY_TTL):
+            await self.load()
+
+    def book(self, d, time: str):
+        i = self._index(d)
+        if i is not None:
+            self.counts[i] = min(255, self.counts[i] + 1)
+            self.taken[i] |= self._slot_bit.get(time, 0)
+
+    def unbook(self, d, time: str):
+        i = self._index(d)
+        if i is not None:
+            self.counts[i] = max(0, self.counts[i] - 1)
+            self.taken[i] &= ~self._slot_bit.get(time, 0) & 0xFF
+
+    def unavailable_mask(self, i: int) -> int:
+        """Bitmask of slots that cannot be booked on day `i`."""
+        current = schedule
+        if self.counts[i] >= current.capacity:
+            return self.full_mask
+        return self.taken[i] | (self.full_mask & ~current.slot_mask(self.start + timedelta(days=i)))
+
+    def nearest_free(self, count: int, now: datetime = None, held=None):
+        """
+        The first `count` bookable (date, time) pairs from `now` on. `held(d)`
+        lists what other users hold on day `d`, as free_slots() takes it.
+        """
+        now = now or datetime.now()
+        first = self._index(now.date())
+        if first is None:
+            return []
+        found = []
+        for i in range(first, self.horizon_days):
+            if self.unavailable_mask(i) == self.full_mask:
+                continue
+            d = self.start + timedelta(days=i)
+            for t in self.free_slots(d, now, held(d) if held else ()):
+                found.append((d, t))
+                if len(found) == count:
+                    return found
+        return found
+
+    def free_slots(self, d, now: datetime = None, held=()):
+        """
+        Bookable times on day `d`, or None if `d` is outside the map. `held`
+        lists times other users hold (None = a seat of the day, any time).
+        """
+        i = self._index(d)
+        if i is None:
+            return None
+        now = now or datetime.now()
+        if d < now.date() or self.counts[i] + len(held) >= schedule.capacity:
+            return []
+        mask = self.unavailable_mask(i)
+        now_time = now.strftime("%H:%M") if d == now.date() else ""
+        return [t for bit, t in enumerate(self.slots) if not mask >> bit & 1 and t > now_time and t not in held]
+
+    def next_bookable(self, d, step: int = 1, now: datetime = None):
+        """The closest day after (step=1) or before (step=-1) `d` with a free slot."""
+        d = d + timedelta(days=step)
+        while self._index(d) is not None:
+            if self.free_slots(d, now):
+                return d
+            d = d + timedelta(days=step)
+        return None
+
+
+occupancy = OccupancyMap()
+
+
+async def join_waitlist(user_id: int, name: str, date_display: str):
+    """Queue the user for a full date. Returns their position (1 = next in line)."""
+    async with db_write() as db:
+        cursor = await db.execute(
+            "SELECT joined_at FROM waitlist WHERE user_id = ? AND date = ? AND status IN ('waiting', 'offered')",
+            (user_id, date_display)
+        )
+        row = await cursor.fetchone()
+        joined_at = row[0] if row else datetime.now().timestamp()
+        if not row:
+            await db.execute(
+                "INSERT INTO waitlist (user_id, name, date, joined_at) VALUES (?, ?, ?, ?)",
+                (user_id, name, date_display, joined_at)
+            )
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM waitlist WHERE date = ? AND status = 'waiting' AND joined_at <= ?",
+            (date_display, joined_at)
+        )
+        return (await cursor.fetchone())[0]
+
+
+async def promote_waitlist(db, date_display: str, time: str) -> bool:
+    """
+    Offer a freed slot to the first user waiting for that date, inside the
+    caller's write transaction. The slot is held for WAITLIST_HOLD_MINUTES;
+    the offer goes out through the outbox. Returns True if someone got it.
+    """
+    cursor = await db.execute(
+        "SELECT id, user_id FROM waitlist WHERE date = ? AND status = 'waiting' ORDER BY joined_at LIMIT 1",
+        (date_display,)
+    )
+    row = await cursor.fetchone()
+    if not row:
+        return False
+    entry_id, user_id = row
+    expires_at = datetime.now() + timedelta(minutes=WAITLIST_HOLD_MINUTES)
+    await db.execute(
+        "UPDATE waitlist SET status = 'offered', offered_time = ?, offer_expires_at = ? WHERE id = ?",
+        (time, expires_at.timestamp(), entry_id)
+    )
+    if booking_store:
+        # runs inside a journal op: a failed commit reloads the offers with the rest
+        booking_store.offers[entry_id] = (user_id, date_display, time, expires_at.timestamp())
+    kb = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Записаться", callback_data=f"wl_accept_{entry_id}"),
+        InlineKeyboardButton(text="Отказаться", callback_data=f"wl_decline_{entry_id}")
+    ]])
+    await enqueue_notification(
+        db, user_id,
+        f"🔔 Освободилось время {date_display} {time}.\nОно закреплено за вами до {expires_at.strftime('%H:%M')}.",
+        reply_markup=kb
+    )
+    return True
+
+
+async def held_slots(db, date_display: str, user_id: int):
+    """
+    Times on that date held for other users by unexpired waitlist offers and
+    booking-flow holds (None = a seat of the day without a specific time).
+    """
+    now = datetime.now().timestamp()
+    cursor = await db.execute(
+        "SELECT offered_time FROM waitlist WHERE date = ? AND status = 'offered' AND offer_expires_at > ? AND user_id != ? "
+        "UNION ALL SELECT time FROM slot_holds WHERE date = ? AND expires_at > ? AND user_id != ?",
+        (date_display, now, user_id, date_display, now, user_id)
+    )
+    return [r[0] for r in await cursor.fetchall()]
+
+
+def held_in_memory(d, user_id: int):
+    """held_slots() for MEMORY_STORE mode: offers from the store, holds from slot_holds."""
+    return booking_store.offered_times(d.strftime("%d.%m.%Y"), user_id) + slot_holds.held(d, exclude_user=user_id)
+
+
+async def journal_or_write(op):
+    """Run `op(db)` as a memory store journal op, or in its own write transaction without the store."""
+    if booking_store:
+        return await booking_store.journal.submit(op)
+    async with db_write() as db:
+        return await op(db)
+
+
+async def expire_waitlist_offers() -> int:
+    """Pass expired offers on to the next user in line; free the slot if nobody waits."""
+    released = []
+
+    async def op(db):
+        cursor = await db.execute(
+            "SELECT id, date, offered_time FROM waitlist WHERE status = 'offered' AND offer_expires_at <= ?",
+            (datetime.now().timestamp(),)
+        )
+        expired = await cursor.fetchall()
+        for entry_id, date_display, time in expired:
+            await db.execute("UPDATE waitlist SET status = 'expired' WHERE id = ?", (entry_id,))
+            if booking_store:
+                booking_store.offers.pop(entry_id, None)
+            if not await promote_waitlist(db, date_display, time):
+                released.append((date_display, time))
+        return expired
+
+    expired = await journal_or_write(op)
+    for date_display, time in released:
+        occupancy.unbook(parse_booking_date(date_display), time)
+    if expired:
+        invalidate_availability()
+        wake_outbox()
+    return len(expired)
+
+
+class SlotHolds:
+    """
+    Short leases that keep a day's seat (or one deep-linked time) for a user
+    between opening the time picker and tapping a time. One hold per user;
+    a new hold replaces the old one. Kept in dicts for rendering and mirrored
+    to the slot_holds table, which the booking transaction checks. Expiry is
+    driven by a heap of (expires_at, user_id); replaced holds leave stale heap
+    entries that are skipped when popped.
+    """
+
+    def __init__(self):
+        self.by_user = {}   # user_id -> (date, time or None, expires_at)
+        self.by_date = {}   # date -> {user_id: time or None}
+        self._heap = []
+        self._wakeup = asyncio.Event()
+
+    def held(self, d, exclude_user: int = None):
+        """Held times on day `d` (None = any time), other than `exclude_user`'s."""
+        users = self.by_date.get(d)
+        if not users:
+            return []
+        return [t for user_id, t in users.items() if user_id != exclude_user]
+
+    def _add(self, user_id: int, d, time, expires_at: float):
+        self._forget(user_id)
+        self.by_user[user_id] = (d, time, expires_at)
+        self.by_date.setdefault(d, {})[user_id] = time
+        heapq.heappush(self._heap, (expires_at, user_id))
+        if self._heap[0][1] == user_id:
+            self._wakeup.set()
+
+    def _forget(self, user_id: int):
+        entry = self.by_user.pop(user_id, None)
+        if entry:
+            users = self.by_date.get(entry[0], {})
+            users.pop(user_id, None)
+            if not users:
+                self.by_date.pop(entry[0], None)
+
+    async def hold(self, user_id: int, d, time: str = None):
+        expires_at = datetime.now().timestamp() + SLOT_HOLD_SECONDS
+        self._add(user_id, d, time, expires_at)
+        async with db_write() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO slot_holds (user_id, date, time, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, d.strftime("%d.%m.%Y"), time, expires_at)
+            )
+
+    def consume(self, user_id: int):
+        """Drop the user's hold from memory; call after deleting its row in the booking transaction."""
+        self._forget(user_id)
+
+    async def load(self):
+        self.by_user, self.by_date, self._heap = {}, {}, []
+        async with db_connect() as db:
+            cursor = await db.execute(
+                "SELECT user_id, date, time, expires_at FROM slot_holds WHERE expires_at > ?",
+                (datetime.now().timestamp(),)
+            )
+            for user_id, date_display, time, expires_at in await cursor.fetchall():
+                self._add(user_id, parse_booking_date(date_display), time, expires_at)
+
+    def _pop_expired(self, now: float) -> int:
+        expired = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, user_id = heapq.heappop(self._heap)
+            entry = self.by_user.get(user_id)
+            if entry and entry[2] == expires_at:
+                self._forget(user_id)
+                expired += 1
+        return expired
+
+    async def sweeper(self):
+        """Release holds as they expire, sleeping until the earliest one is due."""
+        while True:
+            try:
+                now = datetime.now().timestamp()
+                if self._pop_expired(now):
+                    async with db_write() as db:
+                        await db.execute("DELETE FROM slot_holds WHERE expires_at <= ?", (now,))
+            except Exception as e:
+                print(f"Error in slot hold sweeper: {e}")
+            self._wakeup.clear()
+            timeout = max(0.0, self._heap[0][0] - datetime.now().timestamp()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+slot_holds = SlotHolds()
+
+
+class WriteJournal:
+    """
+    Group commit for the memory store: writers submit an `op(db)` coroutine
+    function and await it; ops that arrive within JOURNAL_GROUP_WINDOW_MS of
+    each other share one write transaction, each inside its own savepoint so a
+    failing op does not take the others down. A write is acknowledged only
+    after its transaction committed.
+    """
+
+    def __init__(self, on_failure=None):
+        self.on_failure = on_failure
+        self._queue = []
+        self._wakeup = asyncio.Event()
+        self.commits = 0
+        # seconds before a failed resync is retried, doubling up to 30
+        self.resync_delay = 1.0
+
+    def submit(self, op):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((op, future))
+        self._wakeup.set()
+        return future
+
+    async def flush(self):
+        """Wait until everything submitted so far is committed (ops commit in order)."""
+        if self._queue:
+            async def barrier(db):
+                return None
+
+            await self.submit(barrier)
+
+    async def _commit(self, batch):
+        results = []
+        failed = False
+        async with db_write() as db:
+            for op, _ in batch:
+                await db.execute("SAVEPOINT journal_op")
+                try:
+                    results.append((True, await op(db)))
+                    await db.execute("RELEASE journal_op")
+                except Exception as e:
+                    await db.execute("ROLLBACK TO journal_op")
+                    await db.execute("RELEASE journal_op")
+                    results.append((False, e))
+                    failed = True
+        self.commits += 1
+        return results, failed
+
+    async def run(self):
+        stale = False  # memory missed a resync: retry it after resync_delay
+        delay = self.resync_delay
+        while True:
+            if stale:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            if JOURNAL_GROUP_WINDOW_MS > 0:
+                await asyncio.sleep(JOURNAL_GROUP_WINDOW_MS / 1000)
+            resync = stale
+            settled = []
+            while True:
+                if self._queue:
+                    batch, self._queue = self._queue, []
                     try:
-                        await bot.send_message(user_id, f"📅 Ваша запись перенесена на {date_str}")
-                    except:
-                        pass
+                        results, failed = await self._commit(batch)
+                    except Exception as e:
+                        results, failed = [(False, e)] * len(batch), True
+                    settled.append((batch, results))
+                    resync = (resync or failed) and self.on_failure is not None
+                if resync and not self._queue:
+                    # memory already applied the failed writes; resync it with the DB
+                    # only once every write queued after them is committed too
+                    print("Journal: a write failed, reloading the memory store")
+                    try:
+                        await self.on_failure()
+                    except Exception as e:
+                        # answer the writers anyway (what failed raises, what committed
+                        # is durable) and try the reload again later
+                        print(f"Journal: reloading the memory store failed, retrying in {delay:g}s: {e}")
+                        stale, delay, resync = True, min(delay * 2, 30), False
+                    else:
+                        stale, delay = False, self.resync_delay
+                        # writes queued during the reload changed the memory it replaced:
+                        # commit them and reload again
+                        resync = bool(self._queue)
+                if not resync:
+                    # writers see memory consistent with what they were told
+                    for batch, results in settled:
+                        self._settle(batch, results)
+                    settled = []
+                if not self._queue and not resync:
+                    break
+
+    @staticmethod
+    def _settle(batch, results):
+        for (_, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+class BookingStore:
+    """
+    All live bookings and reviews in memory, indexed by id, by day and by
+    user, for MEMORY_STORE mode. Writes change memory synchronously (so a
+    check and the write that depends on it cannot interleave with another
+    coroutine) and then wait for the journal to commit the same change.
+    Only valid with a single process: other writers would not be seen.
+    """
+
+    def __init__(self):
+        self.journal = WriteJournal(on_failure=self.load)
+        self.bookings = {}  # id -> (id, user_id, name, date, time, comment)
+        self.by_day = {}    # datetime.date -> {id}
+        self.by_user = {}   # user_id -> {id}
+        self.reviews = []   # (id, user_id, name, text, created_at, status), oldest first
+        # open waitlist offers: entry id -> (user_id, date, time, expires_at); a
+        # handful at a time, so lookups scan them
+        self.offers = {}
+        self._next_id = 1
+        self._next_review_id = 1
+
+    async def load(self):
+        async with db_connect() as db:
+            cursor = await db.execute("SELECT id, user_id, name, date, time, comment FROM bookings")
+            booking_rows = await cursor.fetchall()
+            cursor = await db.execute("SELECT id, user_id, name, text, created_at, status FROM reviews ORDER BY id")
+            review_rows = await cursor.fetchall()
+            cursor = await db.execute(
+                "SELECT id, user_id, date, offered_time, offer_expires_at FROM waitlist WHERE status = 'offered'"
+            )
+            offer_rows = await cursor.fetchall()
+            # AUTOINCREMENT never reuses ids, not even of archived rows
+            cursor = await db.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN ('bookings', 'reviews')")
+            seq = dict(await cursor.fetchall())
+        self.bookings, self.by_day, self.by_user = {}, {}, {}
+        for row in booking_rows:
+            self._index(tuple(row))
+        self.reviews = [tuple(r) for r in review_rows]
+        self.offers = {r[0]: tuple(r[1:]) for r in offer_rows}
+        self._next_id = max([seq.get("bookings", 0)] + list(self.bookings)) + 1
+        self._next_review_id = max([seq.get("reviews", 0)] + [r[0] for r in self.reviews]) + 1
+        print(f"Memory store: {len(self.bookings)} bookings, {len(self.reviews)} reviews")
+
+    def _index(self, row):
+        self.bookings[row[0]] = row
+        self.by_day.setdefault(parse_booking_date(row[3]), set()).add(row[0])
+        self.by_user.setdefault(row[1], set()).add(row[0])
+
+    def _unindex(self, booking_id: int):
+        row = self.bookings.pop(booking_id)
+        d = parse_booking_date(row[3])
+        self.by_day[d].discard(booking_id)
+        if not self.by_day[d]:
+            del self.by_day[d]
+        self.by_user[row[1]].discard(booking_id)
+        if not self.by_user[row[1]]:
+            del self.by_user[row[1]]
+        return row
+
+    # reads
+
+    def get(self, booking_id: int):
+        return self.bookings.get(booking_id)
+
+    def rows(self):
+        return [self.bookings[i] for i in sorted(self.bookings)]
+
+    def day(self, d):
+        return [self.bookings[i] for i in self.by_day.get(d, ())]
+
+    def month_counts(self, year: int, month: int):
+        counts = {}
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            n = len(self.by_day.get(datetime(year, month, day).date(), ()))
+            if n:
+                counts[f"{year}-{month:02d}-{day:02d}"] = n
+        return counts
+
+    def user_rows(self, user_id: int):
+        return [self.bookings[i] for i in self.by_user.get(user_id, ())]
+
+    def check_slot(self, d, time: str, held, capacity: int, exclude: int = None):
+        """The same checks as check_slot_sql, against memory."""
+        taken = [row[4] for row in self.day(d) if row[0] != exclude]
+        if len(taken) + len(held) >= capacity:
+            return "На эту дату уже записано максимальное количество людей"
+        if time in held:
+            return "Это время временно закреплено за другим клиентом"
+        if time in taken:
+            return "Это время уже занято"
+        return None
+
+    def offer(self, entry_id: int, user_id: int):
+        """The user's open offer as _waitlist_offer() reads it: (date, time, expires_at, status) or None."""
+        offer = self.offers.get(entry_id)
+        if not offer or offer[0] != user_id:
+            return None
+        return offer[1:] + ("offered",)
+
+    def offered_times(self, date_display: str, user_id: int):
+        """Times on that date held by other users' unexpired offers."""
+        now = datetime.now().timestamp()
+        return [o[2] for o in self.offers.values() if o[1] == date_display and o[3] > now and o[0] != user_id]
+
+    def drop_offers(self, user_id: int, date_display: str):
+        for entry_id in [i for i, o in self.offers.items() if o[0] == user_id and o[1] == date_display]:
+            del self.offers[entry_id]
+
+    def pending_comment(self, user_id: int):
+        """Newest booking of the user still waiting for a comment."""
+        ids = [i for i in self.by_user.get(user_id, ()) if self.bookings[i][5] is None]
+        return max(ids) if ids else None
+
+    # writes: memory first, then the journal
+
+    async def add(self, user_id: int, name: str, date_display: str, time: str, then=None):
+        booking_id = self._next_id
+        self._next_id += 1
+        self._index((booking_id, user_id, name, date_display, time, None))
+
+        async def op(db):
+            await db.execute(
+                "INSERT INTO bookings (id, user_id, name, date, time, comment) VALUES (?, ?, ?, ?, ?, ?)",
+                (booking_id, user_id, name, date_display, time, None)
+            )
+            if then:
+                await then(db)
+
+        await self.journal.submit(op)
+        return booking_id
+
+    async def remove(self, booking_id: int, then=None):
+        """Delete a booking; returns the result of `then(db)`."""
+        self._unindex(booking_id)
+
+        async def op(db):
+            await db.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+            return await then(db) if then else None
+
+        return await self.journal.submit(op)
+
+    async def move(self, booking_id: int, date_display: str, then=None, time: str = None):
+        row = self._unindex(booking_id)
+        time = time or row[4]
+        self._index(row[:3] + (date_display, time) + row[5:])
+
+        async def op(db):
+            await db.execute("UPDATE bookings SET date = ?, time = ? WHERE id = ?", (date_display, time, booking_id))
+            return await then(db) if then else None
+
+        return await self.journal.submit(op)
+
+    async def set_comment(self, booking_id: int, comment: str):
+        row = self.bookings[booking_id]
+        self.bookings[booking_id] = row[:5] + (comment,)
+
+        async def op(db):
+            await db.execute("UPDATE bookings SET comment = ? WHERE id = ?", (comment, booking_id))
+
+        await self.journal.submit(op)
+
+    async def add_review(self, user_id: int, name: str, text: str, created_at: str):
+        review_id = self._next_review_id
+        self._next_review_id += 1
+        self.reviews.append((review_id, user_id, name, text, created_at, "pending"))
+
+        async def op(db):
+            await db.execute(
+                "INSERT INTO reviews (id, user_id, name, text, created_at, status) VALUES (?, ?, ?, ?, ?, 'pending')",
+                (review_id, user_id, name, text, created_at)
+            )
+
+        await self.journal.submit(op)
+
+    def approved_reviews(self, limit: int):
+        """(name, text, created_at) of the newest approved reviews, newest first."""
+        rows = []
+        for r in reversed(self.reviews):
+            if len(rows) == limit:
+                break
+            if r[5] == "approved":
+                rows.append(r[2:5])
+        return rows
+
+    async def moderate_reviews(self, first: int, last: int, status: str):
+        ids = []
+        for i, r in enumerate(self.reviews):
+            if first <= r[0] <= last and r[5] == "pending":
+                self.reviews[i] = r[:5] + (status,)
+                ids.append(r[0])
+        if not ids:
+            return ids
+
+        async def op(db):
+            await db.execute(
+                f"UPDATE reviews SET status = ? WHERE id IN ({','.join('?' * len(ids))})", (status, *ids)
+            )
+
+        await self.journal.submit(op)
+        return ids
+
+    def forget_archived(self, cutoff, reviews_kept: int):
+        """Drop what archive_old_records just moved out of the live tables."""
+        for d in [d for d in self.by_day if d < cutoff]:
+            for booking_id in list(self.by_day.get(d, ())):
+                self._unindex(booking_id)
+        approved = [r[0] for r in self.reviews if r[5] == "approved"]
+        kept = set(approved[-reviews_kept:]) if reviews_kept else set()
+        self.reviews = [r for r in self.reviews if r[5] == "pending" or r[0] in kept]
+
+
+booking_store = BookingStore() if MEMORY_STORE and WORKERS == 1 else None
+if MEMORY_STORE and WORKERS > 1:
+    print("MEMORY_STORE needs WORKERS=1; using SQLite directly")
+
+
+async def waitlist_sweeper():
+    while True:
+        try:
+            await expire_waitlist_offers()
+        except Exception as e:
+            print(f"Error in waitlist sweeper: {e}")
+        await asyncio.sleep(WAITLIST_SWEEP_INTERVAL)
+
+
+async def build_calendar(year: int = None, month: int = None, months: int = 2, booking_id: int = 0, admin_mode: bool = False, horizon: int = None, user_id: int = None):
+    """
+    Build an inline keyboard calendar that can render multiple sequential months when `months` > 1.
+    - dates outside allowed range are disabled
+    - dates with >=2 bookings are marked as full and disabled
+    - dates with 1 booking show (1/2)
+    - seats other users hold in the booking flow count as taken, but a date full
+      only because of them shows ⏳ and stays selectable (holds expire in minutes);
+      `user_id`'s own hold is not counted
+    - admin_mode=True will show blocked dates and allow toggling and includes admin controls in the same keyboard
+    - horizon > months gives a windowed calendar: `months` are rendered, ◀️/▶️ page within `horizon` months
+    """
+    today = datetime.now().date()
+    if year is None or month is None:
+        year = today.year
+        month = today.month
+
+    horizon = max(horizon or months, months)
+    min_date = today
+    max_date = today + timedelta(days=30 * horizon)
+
+    keyboard = []
+
+    # blocked dates and closed weekdays (recurring non-working days)
+    current = await ensure_schedule()
+    capacity = current.capacity
+
+    # render sequential months
+    for offset in range(months):
+        cur_year, cur_month = shift_month(year, month, offset)
+        counts = await month_availability(cur_year, cur_month)
+
+        # month header
+        header_row = [InlineKeyboardButton(text=f"{calendar.month_name[cur_month]} {cur_year}", callback_data="noop")]
+        keyboard.append(header_row)
+
+        cal_matrix = calendar.monthcalendar(cur_year, cur_month)
+        # Weekday headers (only once per month)
+        weekday_names = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
+        keyboard.append([InlineKeyboardButton(text=wd, callback_data="noop") for wd in weekday_names])
+
+        for week in cal_matrix:
+            row = []
+            for day in week:
+                if day == 0:
+                    row.append(InlineKeyboardButton(text=" ", callback_data="noop"))
                 else:
-                    await call.message.answer("❌ Запись не найдена")
+                    d = datetime(cur_year, cur_month, day).date()
+                    if d < min_date or d > max_date:
+                        row.append(InlineKeyboardButton(text=str(day), callback_data="cal_disabled"))
+                    else:
+                        # check blocked (single-date blocks)
+                        blocked = d in current.blocked
+                        # closed weekday or closed all day by a schedule rule
+                        week_closed = current.is_closed(d)
+                        # check booking count, including seats others hold in the booking flow
+                        booked = counts.get(d.isoformat(), 0)
+                        cnt = booked + len(slot_holds.held(d, exclude_user=user_id))
+
+                        # Represent closed weekdays as blocked for users
+                        if admin_mode:
+                            text = f"{d.day}"
+                            if blocked or week_closed:
+                                text = f"⛔{d.day}"
+                                cb = f"toggle_block_{d.isoformat()}"
+                            else:
+                                if cnt >= capacity:
+                                    text = f"🔴{d.day}"
+                                elif cnt > 0:
+                                    text = f"{d.day} ({cnt}/{capacity})"
+                                cb = f"toggle_block_{d.isoformat()}"
+                            row.append(InlineKeyboardButton(text=text, callback_data=cb))
+                        else:
+                            if blocked or week_closed:
+                                row.append(InlineKeyboardButton(text=f"⛔{d.day}", callback_data="cal_blocked"))
+                            else:
+                                if booked >= capacity:
+                                    row.append(InlineKeyboardButton(text=f"🔴{d.day}", callback_data=f"wl_join_{d.isoformat()}" if booking_id == 0 else "cal_disabled"))
+                                elif cnt >= capacity:
+                                    # only holds fill it; the waitlist is not promoted when they expire
+                                    row.append(InlineKeyboardButton(text=f"⏳{d.day}", callback_data=f"cal_day_{d.isoformat()}_{booking_id}"))
+                                elif cnt > 0:
+                                    cb = f"cal_day_{d.isoformat()}_{booking_id}"
+                                    row.append(InlineKeyboardButton(text=f"{d.day} ({cnt}/{capacity})", callback_data=cb))
+                                else:
+                                    cb = f"cal_day_{d.isoformat()}_{booking_id}"
+                                    row.append(InlineKeyboardButton(text=str(d.day), callback_data=cb))
+            keyboard.append(row)
+
+    # Navigation row for the first month (keeps previous behaviour)
+    prev_year, prev_month = shift_month(year, month, -1)
+    next_year, next_month = shift_month(cur_year, cur_month, 1)
+    windowed = horizon > months
+    # a windowed calendar does not page outside [this month, horizon]
+    has_prev = not windowed or (prev_year, prev_month) >= (today.year, today.month)
+    has_next = not windowed or datetime(next_year, next_month, 1).date() <= max_date
+
+    nav_row = []
+    nav_row.append(InlineKeyboardButton(text="◀️" if has_prev else " ", callback_data=f"cal_month_{prev_year}_{prev_month}_{months}_{int(admin_mode)}_{horizon}" if has_prev else "noop"))
+    nav_row.append(InlineKeyboardButton(text=f"{calendar.month_name[month]} {year}", callback_data=f"choose_month_{year}_{int(admin_mode)}_{horizon}"))
+    nav_row.append(InlineKeyboardButton(text="▶️" if has_next else " ", callback_data=f"cal_month_{next_year}_{next_month}_{months}_{int(admin_mode)}_{horizon}" if has_next else "noop"))
+
+    keyboard.append(nav_row)
+
+    # Months range selector + choose month
+    keyboard.append([
+        InlineKeyboardButton(text="Выбрать месяц", callback_data=f"choose_month_{year}_{int(admin_mode)}_{horizon}"),
+        InlineKeyboardButton(text="1 мес", callback_data=f"cal_set_1_{int(admin_mode)}"),
+        InlineKeyboardButton(text="2 мес", callback_data=f"cal_set_2_{int(admin_mode)}")
+    ])
+
+    # If admin mode, add admin controls directly in the same keyboard (single message)
+    if admin_mode:
+        keyboard.append([
+            InlineKeyboardButton(text="⚠️ Блокировать диапазон", callback_data="admin_block_range"),
+            InlineKeyboardButton(text="⛔ Очистить блокировки", callback_data="admin_clear_blocks")
+        ])
+        keyboard.append([InlineKeyboardButton(text="Назад", callback_data="admin")])
+
+    # warm the neighbouring months so the next ◀️/▶️ tap is served from memory
+    neighbours = []
+    if has_prev:
+        neighbours.append((prev_year, prev_month))
+    if has_next:
+        neighbours.append((next_year, next_month))
+    spawn_background(prefetch_availability(neighbours))
+
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@dp.callback_query(lambda c: c.data.startswith("cal_set_"))
+async def cal_set_months(call: types.CallbackQuery):
+    try:
+        parts = call.data.replace("cal_set_", "").split("_")
+        months = int(parts[0])
+        admin_mode = bool(int(parts[1])) if len(parts) > 1 else False
+        markup = await build_calendar(months=months, admin_mode=admin_mode, user_id=call.from_user.id)
+        await edit_or_answer(call.message, "📅 Выберите дату:", reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in cal_set_months: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data.startswith("cal_month_"))
+async def cal_month_nav(call: types.CallbackQuery):
+    try:
+        parts = call.data.replace("cal_month_", "").split("_")
+        year = int(parts[0])
+        month = int(parts[1])
+        months = int(parts[2])
+        admin_mode = bool(int(parts[3])) if len(parts) > 3 else False
+        horizon = int(parts[4]) if len(parts) > 4 else None
+        markup = await build_calendar(year=year, month=month, months=months, admin_mode=admin_mode, horizon=horizon, user_id=call.from_user.id)
+        await edit_or_answer(call.message, "📅 Выберите дату:", reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in cal_month_nav: {e}")
+        await call.answer()
+
+
+def month_picker(year: int, admin_mode: bool = False, horizon: int = FULL_CALENDAR_MONTHS):
+    # build a grid of months for the year
+    buttons = []
+    row = []
+    for m in range(1, 13):
+        row.append(InlineKeyboardButton(text=f"{m}", callback_data=f"goto_month_{year}_{m}_{int(admin_mode)}_{horizon}"))
+        if len(row) == 4:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+
+    # year navigation
+    buttons.append([
+        InlineKeyboardButton(text="◀️", callback_data=f"choose_month_{year-1}_{int(admin_mode)}_{horizon}"),
+        InlineKeyboardButton(text=f"{year}", callback_data="noop"),
+        InlineKeyboardButton(text="▶️", callback_data=f"choose_month_{year+1}_{int(admin_mode)}_{horizon}")
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@dp.callback_query(lambda c: c.data.startswith("choose_month_"))
+async def choose_month(call: types.CallbackQuery):
+    try:
+        parts = call.data.replace("choose_month_", "").split("_")
+        year = int(parts[0])
+        admin_mode = bool(int(parts[1])) if len(parts) > 1 else False
+        horizon = int(parts[2]) if len(parts) > 2 else FULL_CALENDAR_MONTHS
+        await edit_or_answer(call.message, f"Выберите месяц: {year}", reply_markup=month_picker(year, admin_mode, horizon))
+        await call.answer()
+    except Exception as e:
+        print(f"Error in choose_month: {e}")
+        await call.answer() 
+
+
+@dp.callback_query(lambda c: c.data.startswith("goto_month_"))
+async def goto_month(call: types.CallbackQuery):
+    try:
+        parts = call.data.replace("goto_month_", "").split("_")
+        year = int(parts[0])
+        month = int(parts[1])
+        admin_mode = bool(int(parts[2])) if len(parts) > 2 else False
+        horizon = int(parts[3]) if len(parts) > 3 else FULL_CALENDAR_MONTHS
+        markup = await build_calendar(year=year, month=month, months=1, admin_mode=admin_mode, horizon=horizon, user_id=call.from_user.id)
+        await edit_or_answer(call.message, "📅 Выберите дату:", reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in goto_month: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data.startswith("cal_day_"))
+async def cal_day_select(call: types.CallbackQuery):
+    print(f"cal_day_select invoked: {call.data} by {getattr(call.from_user, 'id', None)}")
+    try:
+        payload = call.data.replace("cal_day_", "")
+        date_str, booking_id_str = payload.rsplit("_", 1)
+        booking_id = int(booking_id_str)
+
+        # check blocked
+        current = await ensure_schedule()
+        if datetime.fromisoformat(date_str).date() in current.blocked:
+            await call.answer("Эта дата заблокирована", show_alert=True)
+            return
+
+        if booking_id == 0:
+            # the calendar message turns into the slot picker for that day
+            text, markup = await slot_picker(datetime.fromisoformat(date_str).date(), call.from_user.id)
+            await edit_or_answer(call.message, text, reply_markup=markup)
+        else:
+            # moving an existing booking is an admin action
+            if not is_admin(call.from_user.id):
+                await call.answer("❌ Доступ запрещён")
+                return
+            # bookings store date as DD.MM.YYYY
+            date_display = datetime.fromisoformat(date_str).strftime("%d.%m.%Y")
+            row, _ = await move_booking(booking_id, date_display, notice=f"📅 Ваша запись перенесена на {date_display}")
+            if row:
+                audit.record(call.from_user.id, "move", booking_id, f"{row[2]} {row[3]} → {date_display}")
+                await call.message.answer(f"✅ Обновлено: {row[2]} → {date_display}")
+            else:
+                await call.message.answer("❌ Запись не найдена")
+        await call.answer()
+    except Exception as e:
+        print(f"Error in cal_day_select: {e}")
+        await call.answer("❌ Ошибка")
+
+
+@dp.callback_query(lambda c: c.data == "cal_disabled")
+async def cal_disabled(call: types.CallbackQuery):
+    await call.answer("Нельзя выбрать эту дату", show_alert=True)
+
+
+@dp.callback_query(lambda c: c.data == "cal_blocked")
+async def cal_blocked(call: types.CallbackQuery):
+    await call.answer("Дата недоступна по расписанию", show_alert=True)
+
+
+@dp.callback_query(lambda c: c.data.startswith("wl_join_"))
+async def waitlist_join(call: types.CallbackQuery):
+    try:
+        d = datetime.fromisoformat(call.data.replace("wl_join_", "")).date()
+        if d < datetime.now().date() or schedule.is_closed(d):
+            await call.answer("Нельзя выбрать эту дату", show_alert=True)
+            return
+        position = await join_waitlist(call.from_user.id, call.from_user.first_name, d.strftime("%d.%m.%Y"))
+        await call.answer(
+            f"🔔 Вы в листе ожидания на {d.strftime('%d.%m.%Y')} (место {position}). "
+            f"Если время освободится, я напишу вам и закреплю его на {WAITLIST_HOLD_MINUTES:g} мин.",
+            show_alert=True
+        )
+    except Exception as e:
+        print(f"Error in waitlist_join: {e}")
+        await call.answer("❌ Ошибка")
+
+
+class OfferGone(Exception):
+    """The waitlist offer was used, declined or expired before it could be claimed."""
+
+
+async def _waitlist_offer(db, entry_id: int, user_id: int):
+    cursor = await db.execute(
+        "SELECT date, offered_time, offer_expires_at, status FROM waitlist WHERE id = ? AND user_id = ?",
+        (entry_id, user_id)
+    )
+    return await cursor.fetchone()
+
+
+def _offer_error(row):
+    if not row or row[3] != "offered":
+        return "Предложение уже недействительно"
+    if row[2] <= datetime.now().timestamp():
+        return "Время закрепления истекло"
+    return None
+
+
+async def _claim_offer(db, entry_id: int):
+    """Turn a still valid offer into a booking's, in the transaction that inserts the booking."""
+    cursor = await db.execute(
+        "UPDATE waitlist SET status = 'booked' WHERE id = ? AND status = 'offered' AND offer_expires_at > ?",
+        (entry_id, datetime.now().timestamp())
+    )
+    if cursor.rowcount != 1:
+        raise OfferGone()
+    if booking_store:
+        booking_store.offers.pop(entry_id, None)
+
+
+@dp.callback_query(lambda c: c.data.startswith("wl_accept_"))
+async def waitlist_accept(call: types.CallbackQuery):
+    try:
+        entry_id = int(call.data.replace("wl_accept_", ""))
+        user_id = call.from_user.id
+        date_display = time = None
+        if booking_store:
+            # memory answers the check; claiming the offer and the insert are one journal op
+            row = booking_store.offer(entry_id, user_id)
+            error = _offer_error(row)
+            if not error:
+                date_display, time = row[0], row[1]
+                if any(b[4] == time for b in booking_store.day(parse_booking_date(date_display))):
+                    error = "Это время уже занято"
+            if not error:
+                try:
+                    await booking_store.add(
+                        user_id, call.from_user.first_name, date_display, time,
+                        then=lambda db: _claim_offer(db, entry_id)
+                    )
+                except OfferGone:
+                    error = "Предложение уже недействительно"
+        else:
+            async with db_write() as db:
+                row = await _waitlist_offer(db, entry_id, user_id)
+                error = _offer_error(row)
+                if not error:
+                    date_display, time = row[0], row[1]
+                    cursor = await db.execute("SELECT 1 FROM bookings WHERE date = ? AND time = ?", (date_display, time))
+                    if await cursor.fetchone() is not None:
+                        error = "Это время уже занято"
+                if not error:
+                    # the offer was checked under the write lock, so the claim succeeds
+                    await _claim_offer(db, entry_id)
+                    await db.execute(
+                        "INSERT INTO bookings (user_id, name, date, time, comment) VALUES (?, ?, ?, ?, ?)",
+                        (user_id, call.from_user.first_name, date_display, time, None)
+                    )
+
+        if error:
+            await call.answer(error, show_alert=True)
+            return
+        # the occupancy map kept the slot taken while it was held
+        invalidate_availability()
+        await edit_or_answer(call.message, f"✅ Вы записаны на {date_display} в {time}.\nНапишите комментарий к записи или отправьте /skip, чтобы пропустить.")
+        await notify_admins(f"📌 Новая запись (лист ожидания):\n👤 {call.from_user.first_name}\n📅 {date_display} {time}")
+        await call.answer()
+    except Exception as e:
+        print(f"Error in waitlist_accept: {e}")
+        await call.answer("❌ Ошибка")
+
+
+@dp.callback_query(lambda c: c.data.startswith("wl_decline_"))
+async def waitlist_decline(call: types.CallbackQuery):
+    try:
+        entry_id = int(call.data.replace("wl_decline_", ""))
+        released = None
+
+        async def op(db):
+            nonlocal released
+            cursor = await db.execute(
+                "SELECT date, offered_time FROM waitlist WHERE id = ? AND user_id = ? AND status = 'offered'",
+                (entry_id, call.from_user.id)
+            )
+            row = await cursor.fetchone()
+            if row:
+                await db.execute("UPDATE waitlist SET status = 'declined' WHERE id = ?", (entry_id,))
+                if booking_store:
+                    booking_store.offers.pop(entry_id, None)
+                if not await promote_waitlist(db, row[0], row[1]):
+                    released = row
+            return row
+
+        row = await journal_or_write(op)
+        if released:
+            occupancy.unbook(parse_booking_date(released[0]), released[1])
+            invalidate_availability()
+        if row:
+            wake_outbox()
+        await edit_or_answer(call.message, "Хорошо, время передано следующему в очереди.")
+        await call.answer()
+    except Exception as e:
+        print(f"Error in waitlist_decline: {e}")
+        await call.answer("❌ Ошибка")
+
+
+def time_keyboard(date: str):
+    buttons = []
+    for t in schedule.open_slots(datetime.fromisoformat(date).date()):
+        buttons.append([InlineKeyboardButton(text=t, callback_data=f"time_{date}_{t}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def admin_keyboard():
+    # make date management more prominent at the top
+    buttons = [
+        [InlineKeyboardButton(text="🛑 Управление датами", callback_data="admin_dates")],
+        [InlineKeyboardButton(text="📆 Управление днями недели", callback_data="admin_weekdays")],
+        [InlineKeyboardButton(text="📋 Просмотреть все записи", callback_data="admin_view")],
+        [InlineKeyboardButton(text="❌ Отменить запись", callback_data="admin_cancel")],
+        [InlineKeyboardButton(text="✏️ Изменить дату записи", callback_data="admin_edit")],
+        [InlineKeyboardButton(text="📝 Отзывы", callback_data="admin_reviews")],
+        [InlineKeyboardButton(text="🗄 Архив записей", callback_data="admin_archive")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+
+def main_keyboard():
+    buttons = [
+        [InlineKeyboardButton(text="📋 Мои записи", callback_data="my_bookings")],
+        [InlineKeyboardButton(text="📞 Связаться", callback_data="contact")],
+        [InlineKeyboardButton(text="🛠 Мои работы", callback_data="mywork")],
+        [InlineKeyboardButton(text="💬 Отзывы", callback_data="reviews")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def bookable_slots(d, user_id: int = None):
+    """Free times on day `d` for `user_id`; call occupancy.ensure_current() first."""
+    held = slot_holds.held(d, exclude_user=user_id)
+    slots = occupancy.free_slots(d, held=held)
+    if slots is None:
+        # beyond the in-memory horizon: let the booking transaction decide
+        slots = [] if d < datetime.now().date() else [t for t in schedule.open_slots(d) if t not in held]
+    return slots
+
+
+async def slot_picker(d, user_id: int = None, move_id: int = 0):
+    """
+    Combined date + time picker for one message: ◀️/▶️ jump between bookable
+    days, the slots below book directly. Opening it holds a seat of the day
+    for `user_id` for SLOT_HOLD_SECONDS. With `move_id` the slots move that
+    booking instead (no hold: the booking already has a seat). Returns (text, markup).
+    """
+    await occupancy.ensure_current()
+    slots = bookable_slots(d, user_id)
+    if slots and user_id and not move_id:
+        await slot_holds.hold(user_id, d)
+    pick = f"mvpick_{move_id}_" if move_id else "pick_"
+    prev_day = occupancy.next_bookable(d, -1)
+    next_day = occupancy.next_bookable(d, 1)
+
+    weekday_names = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+    buttons = [[
+        InlineKeyboardButton(text="◀️" if prev_day else " ", callback_data=f"{pick}{prev_day.isoformat()}" if prev_day else "noop"),
+        InlineKeyboardButton(text=f"{weekday_names[d.weekday()]} {d.strftime('%d.%m')}", callback_data="noop" if move_id else "range_full"),
+        InlineKeyboardButton(text="▶️" if next_day else " ", callback_data=f"{pick}{next_day.isoformat()}" if next_day else "noop"),
+    ]]
+    row = []
+    for t in slots:
+        row.append(InlineKeyboardButton(text=t, callback_data=f"mvto_{move_id}_{d.isoformat()}_{t}" if move_id else f"time_{d.isoformat()}_{t}"))
+        if len(row) == 3:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    if move_id:
+        buttons.append([InlineKeyboardButton(text="⬅️ Мои записи", callback_data="my_bookings")])
+    else:
+        if not slots and d >= datetime.now().date() and not schedule.is_closed(d):
+            buttons.append([InlineKeyboardButton(text="🔔 В лист ожидания", callback_data=f"wl_join_{d.isoformat()}")])
+        buttons.append([InlineKeyboardButton(text="📅 Открыть календарь", callback_data="range_full")])
+
+    if slots:
+        text = f"📅 {d.strftime('%d.%m.%Y')}\nВыберите время:"
+    else:
+        text = f"📅 {d.strftime('%d.%m.%Y')}\nНа этот день свободного времени нет."
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def parse_deep_link(payload: str):
+    """
+    `book_2030-12-31` or `book_2030-12-31_1000` (Telegram allows only [A-Za-z0-9_-]
+    in start payloads, so the time has no colon). Returns (date, time or None) or None.
+    """
+    if not payload or not payload.startswith("book_"):
+        return None
+    parts = payload[len("book_"):].split("_")
+    try:
+        d = datetime.strptime(parts[0].replace("-", ""), "%Y%m%d").date()
+        t = None
+        if len(parts) > 1:
+            t = datetime.strptime(parts[1].replace("-", ""), "%H%M").strftime("%H:%M")
+    except ValueError:
+        return None
+    if len(parts) > 2:
+        return None
+    return d, t
+
+
+async def start_booking_link(message: types.Message, d, t):
+    if t and t in bookable_slots(d, message.from_user.id):
+        # one tap left: confirming goes straight to time_selected
+        await slot_holds.hold(message.from_user.id, d, t)
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"✅ Записаться на {d.strftime('%d.%m.%Y')} {t}", callback_data=f"time_{d.isoformat()}_{t}")],
+            [InlineKeyboardButton(text="Другое время", callback_data=f"pick_{d.isoformat()}")]
+        ])
+        await message.answer("Подтвердите запись:", reply_markup=kb)
+        return
+    if d < datetime.now().date():
+        d = datetime.now().date()
+    text, markup = await slot_picker(d, message.from_user.id)
+    if t:
+        text = f"Время {t} недоступно.\n" + text
+    await message.answer(text, reply_markup=markup)
+
+
+@dp.message(Command("start"))
+async def start(message: types.Message, command: CommandObject = None):
+    try:
+        link = parse_deep_link(command.args if command else None)
+        if link:
+            await occupancy.ensure_current()
+            await start_booking_link(message, *link)
+            return
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🕐 Ближайшее свободное время", callback_data="nearest_slots")],
+            [InlineKeyboardButton(text="Полный календарь", callback_data="range_full")],
+            [InlineKeyboardButton(text="На 1 месяц", callback_data="range_1"), InlineKeyboardButton(text="На 2 месяца", callback_data="range_2")]
+        ])
+        await message.answer("📅 Выберите диапазон дат:", reply_markup=kb)
+        await message.answer("Быстрые команды:", reply_markup=main_keyboard())
+    except Exception as e:
+        print(f"Error in start command: {e}")
+        await message.answer("❌ Произошла ошибка")
+
+
+@dp.callback_query(lambda c: c.data.startswith("range_"))
+async def range_selected(call: types.CallbackQuery):
+    print(f"range_selected invoked: {call.data} by {getattr(call.from_user, 'id', None)}")
+    try:
+        key = call.data.replace("range_", "")
+        horizon = None
+        if key == "full":
+            # full calendar: one month on screen, paging across the whole horizon
+            months = 1
+            horizon = FULL_CALENDAR_MONTHS
+        else:
+            try:
+                months = int(key)
+            except ValueError:
+                print(f"Invalid range value: {key}")
+                await call.answer()
+                return
+
+        markup = await build_calendar(months=months, booking_id=0, horizon=horizon, user_id=call.from_user.id)
+        await edit_or_answer(call.message, "📅 Выберите дату:", reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in range_selected: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data == "nearest_slots")
+async def nearest_slots(call: types.CallbackQuery):
+    try:
+        await occupancy.ensure_current()
+        user_id = call.from_user.id
+        slots = occupancy.nearest_free(NEAREST_SLOTS_COUNT, held=lambda d: slot_holds.held(d, exclude_user=user_id))
+        if not slots:
+            await call.answer("Свободного времени пока нет", show_alert=True)
+            return
+
+        weekday_names = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+        buttons = []
+        for d, t in slots:
+            buttons.append([InlineKeyboardButton(
+                text=f"{weekday_names[d.weekday()]} {d.strftime('%d.%m')} {t}",
+                callback_data=f"time_{d.isoformat()}_{t}"
+            )])
+        buttons.append([InlineKeyboardButton(text="📅 Открыть календарь", callback_data="range_full")])
+        await edit_or_answer(call.message, "🕐 Ближайшее свободное время:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+        await call.answer()
+    except Exception as e:
+        print(f"Error in nearest_slots: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data.startswith("pick_"))
+async def pick_day(call: types.CallbackQuery):
+    try:
+        d = datetime.fromisoformat(call.data.replace("pick_", "")).date()
+        text, markup = await slot_picker(d, call.from_user.id)
+        await edit_or_answer(call.message, text, reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in pick_day: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data.startswith("date_"))
+async def date_selected(call: types.CallbackQuery):
+    try:
+        date = call.data.replace("date_", "")
+        # ask user to choose time after date
+        await call.message.answer(f"Вы выбрали дату: {date}\nВыберите время:", reply_markup=time_keyboard(date))
+        await call.answer()
+    except Exception as e:
+        print(f"Error in date_selected: {e}")
+        await call.message.answer("❌ Ошибка")
+        await call.answer()
+
+
+async def after_booking(db, user_id: int, date_display: str):
+    """Bookkeeping in the booking's transaction once a user has booked a day."""
+    # booked on their own: leave the waitlist of that date
+    await db.execute(
+        "UPDATE waitlist SET status = 'booked' WHERE user_id = ? AND date = ? AND status IN ('waiting', 'offered')",
+        (user_id, date_display)
+    )
+    if booking_store:
+        booking_store.drop_offers(user_id, date_display)
+    # the hold has done its job
+    await db.execute("DELETE FROM slot_holds WHERE user_id = ?", (user_id,))
+
+
+async def _freed_slot_effects(db, row, notice: str):
+    if notice:
+        await enqueue_notification(db, row[1], notice.format(date=row[3], time=row[4]))
+    # the freed slot goes to the first user on that day's waitlist
+    return await promote_waitlist(db, parse_booking_date(row[3]).strftime("%d.%m.%Y"), row[4])
+
+
+async def cancel_booking(booking_id: int, notice: str = None):
+    """
+    Delete a booking. In the same transaction the user gets `notice` (may use
+    {date} and {time} of the booking) through the outbox and the freed slot is
+    offered to the waitlist. Returns
+    (row (id, user_id, name, date, time, comment) or None, promoted).
+    """
+    promoted = False
+    if booking_store:
+        row = booking_store.get(booking_id)
+        if row:
+            promoted = await booking_store.remove(booking_id, then=lambda db: _freed_slot_effects(db, row, notice))
+    else:
+        async with db_write() as db:
+            cursor = await db.execute("SELECT id, user_id, name, date, time, comment FROM bookings WHERE id = ?", (booking_id,))
+            row = await cursor.fetchone()
+            if row:
+                await db.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+                promoted = await _freed_slot_effects(db, row, notice)
+    if not row:
+        return None, False
+    invalidate_availability()
+    # a slot offered to the waitlist stays taken while the offer is held
+    if not promoted:
+        occupancy.unbook(parse_booking_date(row[3]), row[4])
+    wake_outbox()
+    return row, promoted
+
+
+async def move_booking(booking_id: int, date_display: str, notice: str = None):
+    """Move a booking to another day (DD.MM.YYYY); like cancel_booking for the old slot."""
+    promoted = False
+    if booking_store:
+        row = booking_store.get(booking_id)
+        if row:
+            promoted = await booking_store.move(booking_id, date_display, then=lambda db: _freed_slot_effects(db, row, notice))
+    else:
+        async with db_write() as db:
+            cursor = await db.execute("SELECT id, user_id, name, date, time, comment FROM bookings WHERE id = ?", (booking_id,))
+            row = await cursor.fetchone()
+            if row:
+                await db.execute("UPDATE bookings SET date = ? WHERE id = ?", (date_display, booking_id))
+                promoted = await _freed_slot_effects(db, row, notice)
+    if not row:
+        return None, False
+    _after_move(row, date_display, row[4], promoted)
+    return row, promoted
+
+
+def _after_move(row, date_display: str, time: str, promoted: bool):
+    invalidate_availability()
+    if not promoted:
+        occupancy.unbook(parse_booking_date(row[3]), row[4])
+    occupancy.book(parse_booking_date(date_display), time)
+    wake_outbox()
+
+
+async def check_slot_sql(db, date_display: str, time: str, held, capacity: int, exclude: int = None):
+    """
+    Reservation checks for `time` on `date_display` inside the caller's write
+    transaction; `exclude` is a booking being moved. Returns an error or None.
+    """
+    cursor = await db.execute("SELECT COUNT(*) FROM bookings WHERE date = ? AND id IS NOT ?", (date_display, exclude))
+    cnt = (await cursor.fetchone())[0]
+    # slots freed by a cancellation are held for the waitlist for a while
+    if cnt + len(held) >= capacity:
+        return "На эту дату уже записано максимальное количество людей"
+    if time in held:
+        return "Это время временно закреплено за другим клиентом"
+    cursor = await db.execute("SELECT 1 FROM bookings WHERE date = ? AND time = ? AND id IS NOT ?", (date_display, time, exclude))
+    if await cursor.fetchone():
+        return "Это время уже занято"
+    return None
+
+
+async def reschedule_booking(booking_id: int, user_id: int, d, time: str):
+    """
+    Move `user_id`'s own booking to `time` on day `d`. The new slot passes the
+    same checks as a new booking, atomically with the move; the old slot goes
+    to the waitlist. Returns (old row or None, error or None).
+    """
+    current = await ensure_schedule()
+    if d < datetime.now().date() or not current.is_open(d, time):
+        return None, "Это время недоступно"
+    date_display = d.strftime("%d.%m.%Y")
+    error = None
+    promoted = False
+    if booking_store:
+        row = booking_store.get(booking_id)
+        if not row or row[1] != user_id:
+            return None, "Запись не найдена"
+        if parse_booking_date(row[3]) == d and row[4] == time:
+            return None, "Вы уже записаны на это время"
+        held = held_in_memory(d, user_id)
+        error = booking_store.check_slot(d, time, held, current.capacity, exclude=booking_id)
+        if not error:
+            promoted = await booking_store.move(booking_id, date_display, time=time, then=lambda db: _freed_slot_effects(db, row, None))
+    else:
+        async with db_write() as db:
+            cursor = await db.execute(
+                "SELECT id, user_id, name, date, time, comment FROM bookings WHERE id = ? AND user_id = ?",
+                (booking_id, user_id)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return None, "Запись не найдена"
+            if parse_booking_date(row[3]) == d and row[4] == time:
+                return None, "Вы уже записаны на это время"
+            held = await held_slots(db, date_display, user_id)
+            error = await check_slot_sql(db, date_display, time, held, current.capacity, exclude=booking_id)
+            if not error:
+                await db.execute("UPDATE bookings SET date = ?, time = ? WHERE id = ?", (date_display, time, booking_id))
+                promoted = await _freed_slot_effects(db, row, None)
+    if error:
+        return None, error
+    _after_move(row, date_display, time, promoted)
+    return row, None
+
+
+@dp.callback_query(lambda c: c.data.startswith("time_"))
+async def time_selected(call: types.CallbackQuery):
+    try:
+        payload = call.data.replace("time_", "")
+        # payload = "{date_iso}_{time}"
+        parts = payload.rsplit("_", 1)
+        date_iso = parts[0]
+        time = parts[1]
+
+        # blocked dates and closed weekdays come from the schedule snapshot
+        error = None
+        current = await ensure_schedule()
+        d = datetime.fromisoformat(date_iso).date()
+        if not current.is_open(d, time):
+            if d in current.blocked:
+                error = "Эта дата заблокирована"
+            elif current.is_closed(d):
+                error = "В этот день я не работаю"
+            else:
+                error = "Это время недоступно"
+        if error:
+            await call.answer(error, show_alert=True)
+            return
+
+        # bookings store date as DD.MM.YYYY
+        date_display = d.strftime("%d.%m.%Y")
+        user_id = call.from_user.id
+        if booking_store:
+            # memory answers the checks; the journal persists the booking
+            held = held_in_memory(d, user_id)
+            error = booking_store.check_slot(d, time, held, current.capacity)
+            if not error:
+                await booking_store.add(
+                    user_id, call.from_user.first_name, date_display, time,
+                    then=lambda db: after_booking(db, user_id, date_display)
+                )
+        else:
+            # the counts and the insert share one write transaction so two workers
+            # cannot both take the last slot
+            async with db_write() as db:
+                held = await held_slots(db, date_display, user_id)
+                error = await check_slot_sql(db, date_display, time, held, current.capacity)
+                if not error:
+                    await db.execute(
+                        "INSERT INTO bookings (user_id, name, date, time, comment) VALUES (?, ?, ?, ?, ?)",
+                        (user_id, call.from_user.first_name, date_display, time, None)
+                    )
+                    await after_booking(db, user_id, date_display)
+
+        if error:
+            await call.answer(error, show_alert=True)
+            return
+        slot_holds.consume(call.from_user.id)
+        invalidate_availability()
+        occupancy.book(d, time)
+
+        await edit_or_answer(call.message, f"✅ Вы записаны на {date_display} в {time}.\nНапишите комментарий к записи или отправьте /skip, чтобы пропустить.")
+        # notify admins
+        await notify_admins(f"📌 Новая запись:\n👤 {call.from_user.first_name}\n📅 {date_display} {time}")
         await call.answer()
     except Exception as e:
-        print(f"Error in cal_day_select: {e}")
+        print(f"Error in time_selected: {e}")
+        await call.message.answer("❌ Ошибка при сохранении записи")
+        await call.answer()
+
+
+async def user_bookings(user_id: int, limit: int = MY_BOOKINGS_LIMIT):
+    """
+    (id, date, time, comment, upcoming) of the user's bookings: upcoming ones
+    soonest first, then the most recent past ones. Served by idx_bookings_user.
+    """
+    today = datetime.now().date()
+    if booking_store:
+        rows = [(r[0], r[3], r[4], r[5], parse_booking_date(r[3])) for r in booking_store.user_rows(user_id)]
+        upcoming = sorted((r for r in rows if r[4] >= today), key=lambda r: (r[4], r[2]))
+        past = sorted((r for r in rows if r[4] < today), key=lambda r: (r[4], r[2]), reverse=True)
+        return [r[:4] + (r[4] >= today,) for r in (upcoming + past)[:limit]]
+    async with db_connect() as db:
+        cursor = await db.execute(
+            f"SELECT id, date, time, comment, iso >= ? FROM ("
+            f"  SELECT id, date, time, comment, {BOOKING_DATE_ISO_SQL} AS iso FROM bookings WHERE user_id = ?"
+            f") ORDER BY iso < ?, CASE WHEN iso >= ? THEN iso || time END, iso || time DESC LIMIT ?",
+            (today.isoformat(), user_id, today.isoformat(), today.isoformat(), limit)
+        )
+        return [r[:4] + (bool(r[4]),) for r in await cursor.fetchall()]
+
+
+async def my_bookings_view(user_id: int):
+    rows = await user_bookings(user_id)
+    if not rows:
+        return "У вас пока нет записей.", InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🕐 Записаться", callback_data="nearest_slots")]
+        ])
+    lines = ["📋 Ваши записи:\n"]
+    buttons = []
+    for booking_id, date, time, comment, upcoming in rows:
+        line = f"{'📅' if upcoming else '✔️'} {date} {time}"
+        if comment:
+            line += f" — {comment}"
+        lines.append(line)
+        if upcoming:
+            buttons.append([
+                InlineKeyboardButton(text=f"✏️ Перенести {date[:5]} {time}", callback_data=f"mymove_{booking_id}"),
+                InlineKeyboardButton(text="❌ Отменить", callback_data=f"mycancel_{booking_id}")
+            ])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+
+@dp.message(Command("my"))
+async def my_bookings_cmd(message: types.Message):
+    try:
+        text, markup = await my_bookings_view(message.from_user.id)
+        await message.answer(text, reply_markup=markup)
+    except Exception as e:
+        print(f"Error in my_bookings_cmd: {e}")
+        await message.answer("❌ Ошибка")
+
+
+@dp.callback_query(lambda c: c.data == "my_bookings")
+async def my_bookings(call: types.CallbackQuery):
+    try:
+        text, markup = await my_bookings_view(call.from_user.id)
+        await edit_or_answer(call.message, text, reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in my_bookings: {e}")
         await call.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data == "cal_disabled")
-async def cal_disabled(call: types.CallbackQuery):
-    await call.answer("Нельзя выбрать эту дату", show_alert=True)
+async def own_upcoming_booking(booking_id: int, user_id: int):
+    """The booking row if it belongs to `user_id` and has not passed yet, else None."""
+    if booking_store:
+        row = booking_store.get(booking_id)
+    else:
+        async with db_connect() as db:
+            cursor = await db.execute("SELECT id, user_id, name, date, time, comment FROM bookings WHERE id = ?", (booking_id,))
+            row = await cursor.fetchone()
+    if not row or row[1] != user_id or parse_booking_date(row[3]) < datetime.now().date():
+        return None
+    return row
 
 
-@dp.callback_query(lambda c: c.data == "cal_blocked")
-async def cal_blocked(call: types.CallbackQuery):
-    await call.answer("Дата недоступна по расписанию", show_alert=True)
+@dp.callback_query(lambda c: c.data.startswith("mycancel_"))
+async def my_cancel(call: types.CallbackQuery):
+    try:
+        booking_id = int(call.data.replace("mycancel_", ""))
+        row = await own_upcoming_booking(booking_id, call.from_user.id)
+        if not row:
+            await call.answer("Запись не найдена", show_alert=True)
+            return
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="✅ Да, отменить", callback_data=f"mycancelok_{booking_id}"),
+            InlineKeyboardButton(text="Нет", callback_data="my_bookings")
+        ]])
+        await edit_or_answer(call.message, f"Отменить запись на {row[3]} в {row[4]}?", reply_markup=kb)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in my_cancel: {e}")
+        await call.answer("❌ Ошибка")
 
 
-def time_keyboard(date: str):
-    # fixed time slots — you can change these
-    times = ["10:00", "11:00", "12:00", "14:00", "15:00", "16:00"]
-    buttons = []
-    for t in times:
-        buttons.append([InlineKeyboardButton(text=t, callback_data=f"time_{date}_{t}")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+@dp.callback_query(lambda c: c.data.startswith("mycancelok_"))
+async def my_cancel_confirm(call: types.CallbackQuery):
+    try:
+        booking_id = int(call.data.replace("mycancelok_", ""))
+        if not await own_upcoming_booking(booking_id, call.from_user.id):
+            await call.answer("Запись не найдена", show_alert=True)
+            return
+        row, _ = await cancel_booking(booking_id)
+        if row:
+            await call.answer(f"Запись на {row[3]} {row[4]} отменена")
+            await notify_admins(f"🚫 Клиент отменил запись:\n👤 {row[2]}\n📅 {row[3]} {row[4]}")
+        else:
+            await call.answer("Запись не найдена", show_alert=True)
+        text, markup = await my_bookings_view(call.from_user.id)
+        await edit_or_answer(call.message, text, reply_markup=markup)
+    except Exception as e:
+        print(f"Error in my_cancel_confirm: {e}")
+        await call.answer("❌ Ошибка")
 
 
-def admin_keyboard():
-    # make date management more prominent at the top
+@dp.callback_query(lambda c: c.data.startswith("mymove_") or c.data.startswith("mvpick_"))
+async def my_move_pick(call: types.CallbackQuery):
+    try:
+        if call.data.startswith("mymove_"):
+            booking_id, d = int(call.data.replace("mymove_", "")), None
+        else:
+            booking_id_str, date_iso = call.data.replace("mvpick_", "").split("_", 1)
+            booking_id, d = int(booking_id_str), datetime.fromisoformat(date_iso).date()
+        row = await own_upcoming_booking(booking_id, call.from_user.id)
+        if not row:
+            await call.answer("Запись не найдена", show_alert=True)
+            return
+        if d is None:
+            # start from the booked day (or the next day with a free slot)
+            await occupancy.ensure_current()
+            booked = parse_booking_date(row[3])
+            d = booked if bookable_slots(booked, call.from_user.id) else occupancy.next_bookable(booked, 1) or booked
+        text, markup = await slot_picker(d, call.from_user.id, move_id=booking_id)
+        await edit_or_answer(call.message, f"✏️ Перенос записи {row[3]} {row[4]}\n" + text, reply_markup=markup)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in my_move_pick: {e}")
+        await call.answer("❌ Ошибка")
+
+
+@dp.callback_query(lambda c: c.data.startswith("mvto_"))
+async def my_move_to(call: types.CallbackQuery):
+    try:
+        booking_id_str, date_iso, time = call.data.replace("mvto_", "").split("_", 2)
+        d = datetime.fromisoformat(date_iso).date()
+        row, error = await reschedule_booking(int(booking_id_str), call.from_user.id, d, time)
+        if error:
+            await call.answer(error, show_alert=True)
+            return
+        date_display = d.strftime("%d.%m.%Y")
+        await edit_or_answer(call.message, f"✅ Запись перенесена: {row[3]} {row[4]} → {date_display} {time}")
+        await notify_admins(f"✏️ Клиент перенёс запись:\n👤 {row[2]}\n📅 {row[3]} {row[4]} → {date_display} {time}")
+        await call.answer()
+    except Exception as e:
+        print(f"Error in my_move_to: {e}")
+        await call.answer("❌ Ошибка")
+
+
+@dp.callback_query(lambda c: c.data == "contact")
+async def contact_info(call: types.CallbackQuery):
+    try:
+        await call.message.answer(config.contact)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in contact_info: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data == "mywork")
+async def my_work(call: types.CallbackQuery):
+    try:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📱 Instagram", url="https://www.instagram.com/vii.nail_?igsh=MThlZDM4OWt0M2FzdQ%3D%3D&utm_source=qr")],
+            [InlineKeyboardButton(text="💬 Telegram", url="https://t.me/vii_nails_art")]
+        ])
+        await call.message.answer("🛠 Мои работы и отзывы:", reply_markup=keyboard)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in my_work: {e}")
+        await call.answer()
+
+
+# (loaded_at, page text); the public page changes only when a review is approved
+_reviews_page = None
+# bumped by invalidate_reviews() so a load that raced with a moderation is not cached
+_reviews_generation = 0
+
+REVIEW_STATUS_MARKS = {"pending": "🕓", "approved": "✅", "rejected": "❌"}
+
+
+def invalidate_reviews():
+    """Call after a review is approved or rejected."""
+    global _reviews_page, _reviews_generation
+    _reviews_generation += 1
+    _reviews_page = None
+
+
+def format_reviews_page(rows) -> str:
+    if not rows:
+        return "Пока нет отзывов."
+    text = "💬 Отзывы:\n\n"
+    for name, text_rev, created in rows:
+        text += f"👤 {name}: {text_rev} ({created})\n\n"
+    return text
+
+
+async def reviews_page() -> str:
+    """The public page of approved reviews, from cache when fresh (other workers may have moderated meanwhile)."""
+    global _reviews_page
+    if booking_store:
+        return format_reviews_page(booking_store.approved_reviews(REVIEWS_PAGE_SIZE))
+    if _reviews_page and monotonic() - _reviews_page[0] < REVIEWS_TTL:
+        return _reviews_page[1]
+    generation = _reviews_generation
+    async with db_connect() as db:
+        cursor = await db.execute(
+            "SELECT name, text, created_at FROM reviews WHERE status = 'approved' ORDER BY id DESC LIMIT ?",
+            (REVIEWS_PAGE_SIZE,)
+        )
+        page = format_reviews_page(await cursor.fetchall())
+    if generation == _reviews_generation:
+        _reviews_page = (monotonic(), page)
+    return page
+
+
+def review_digest(rows):
+    """
+    One moderation message for reviews `rows` (id, name, text, created_at,
+    status), ids ascending: a ✅/❌ pair per pending review and "approve all".
+    Buttons carry the digest's id range so a tap can redraw the whole message.
+    """
+    first, last = rows[0][0], rows[-1][0]
+    pending = [r for r in rows if r[4] == "pending"]
+    text = "📝 Новые отзывы на модерации:\n\n" if pending else "📝 Отзывы разобраны:\n\n"
+    for r_id, name, text_rev, created, status in rows:
+        if len(text_rev) > REVIEW_DIGEST_TEXT_LIMIT:
+            text_rev = text_rev[:REVIEW_DIGEST_TEXT_LIMIT] + "…"
+        text += f"{REVIEW_STATUS_MARKS.get(status, '')} #{r_id} 👤 {name}: {text_rev}\n\n"
     buttons = [
-        [InlineKeyboardButton(text="🛑 Управление датами", callback_data="admin_dates")],
-        [InlineKeyboardButton(text="📆 Управление днями недели", callback_data="admin_weekdays")],
-        [InlineKeyboardButton(text="📋 Просмотреть все записи", callback_data="admin_view")],
-        [InlineKeyboardButton(text="❌ Отменить запись", callback_data="admin_cancel")],
-        [InlineKeyboardButton(text="✏️ Изменить дату записи", callback_data="admin_edit")],
-        [InlineKeyboardButton(text="📝 Отзывы", callback_data="admin_reviews")]
+        [
+            InlineKeyboardButton(text=f"✅ #{r[0]}", callback_data=f"revok_{first}_{last}_{r[0]}"),
+            InlineKeyboardButton(text=f"❌ #{r[0]}", callback_data=f"revno_{first}_{last}_{r[0]}"),
+        ]
+        for r in pending
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    if len(pending) > 1:
+        buttons.append([InlineKeyboardButton(text="✅ Одобрить все", callback_data=f"revok_{first}_{last}_0")])
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+
+async def send_review_digest() -> int:
+    """
+    Queue one digest of up to REVIEW_DIGEST_SIZE new pending reviews for every
+    admin, in the transaction that marks them as queued. The outbox marks them
+    as sent once an admin got the digest, or puts them back for the next digest
+    if no admin did. Returns how many reviews it covered.
+    """
+    if not config.admins:
+        # nobody to tell: keep them for when an admin is configured
+        return 0
+    async with db_write() as db:
+        cursor = await db.execute(
+            "SELECT id, name, text, created_at, status FROM reviews "
+            "WHERE status = 'pending' AND digest_sent = 0 ORDER BY id LIMIT ?",
+            (REVIEW_DIGEST_SIZE,)
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            return 0
+        text, markup = review_digest(rows)
+        batch = ",".join(str(r[0]) for r in rows)
+        for admin_id in sorted(config.admins):
+            await enqueue_notification(db, admin_id, text, reply_markup=markup, review_batch=batch)
+        await db.execute(
+            f"UPDATE reviews SET digest_sent = 2 WHERE id IN ({','.join('?' * len(rows))})", [r[0] for r in rows]
+        )
+    wake_outbox()
+    return len(rows)
+
+
+async def _settle_review_batch(db, batch: str, delivered: bool):
+    """
+    Called by drain_outbox() for a digest message: the first delivery marks
+    the reviews as sent; when the last copy failed without one, they go back
+    to waiting. Sent messages are deleted from the outbox, so a queued batch
+    with no pending copy left was not delivered to anyone.
+    """
+    ids = batch.split(",")
+    marks = ",".join("?" * len(ids))
+    if delivered:
+        await db.execute(f"UPDATE reviews SET digest_sent = 1 WHERE id IN ({marks}) AND digest_sent = 2", ids)
+        return
+    cursor = await db.execute("SELECT 1 FROM outbox WHERE review_batch = ? AND status = 'pending' LIMIT 1", (batch,))
+    if not await cursor.fetchone():
+        await db.execute(f"UPDATE reviews SET digest_sent = 0 WHERE id IN ({marks}) AND digest_sent = 2", ids)
+
+
+async def review_digest_sender():
+    while True:
+        await asyncio.sleep(REVIEW_DIGEST_INTERVAL)
+        try:
+            # a review campaign can leave more than one digest's worth waiting
+            while await send_review_digest() == REVIEW_DIGEST_SIZE:
+                pass
+        except Exception as e:
+            print(f"Error sending review digest: {e}")
+
+
+async def review_rows(first: int, last: int = None, pending_only: bool = False):
+    """Reviews from id `first` (to `last`) for a digest, at most REVIEW_DIGEST_SIZE."""
+    query = "SELECT id, name, text, created_at, status FROM reviews WHERE id >= ?"
+    params = [first]
+    if last is not None:
+        query += " AND id <= ?"
+        params.append(last)
+    if pending_only:
+        query += " AND status = 'pending'"
+    async with db_connect() as db:
+        cursor = await db.execute(query + " ORDER BY id LIMIT ?", (*params, REVIEW_DIGEST_SIZE))
+        return await cursor.fetchall()
+
+
+async def moderate_reviews(first: int, last: int, status: str):
+    """Set `status` on the still pending reviews with ids first..last; returns their ids."""
+    if booking_store:
+        ids = await booking_store.moderate_reviews(first, last, status)
+    else:
+        async with db_write() as db:
+            cursor = await db.execute(
+                "SELECT id FROM reviews WHERE id BETWEEN ? AND ? AND status = 'pending'", (first, last)
+            )
+            ids = [r[0] for r in await cursor.fetchall()]
+            if ids:
+                await db.execute(
+                    f"UPDATE reviews SET status = ? WHERE id IN ({','.join('?' * len(ids))})", (status, *ids)
+                )
+    if ids:
+        invalidate_reviews()
+    return ids
+
+
+@dp.callback_query(lambda c: c.data == "reviews")
+async def show_reviews(call: types.CallbackQuery):
+    try:
+        text = await reviews_page()
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Оставить отзыв", callback_data="leave_review")]])
+        await call.message.answer(text, reply_markup=kb)
+        await call.answer()
+    except Exception as e:
+        print(f"Error in show_reviews: {e}")
+        await call.answer()
+
+
+@dp.callback_query(lambda c: c.data == "leave_review")
+async def leave_review_cb(call: types.CallbackQuery):
+    try:
+        pending_reviews.add(call.from_user.id)
+        await call.message.answer("Напишите, пожалуйста, ваш отзыв в сообщении.")
+        await call.answer()
+    except Exception as e:
+        print(f"Error in leave_review_cb: {e}")
+        await call.answer()
+
+
+@dp.message(Command("review"))
+async def review_cmd(message: types.Message):
+    pending_reviews.add(message.from_user.id)
+    await message.reply("Напишите, пожалуйста, ваш отзыв в сообщении.")
+
+
+@dp.message(Command("admin"))
+async def admin_panel(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+
+    kb = admin_keyboard()
+    # log keyboard rows for debugging (admins only)
+    try:
+        keys = []
+        for row in kb.inline_keyboard:
+            keys.append([b.text for b in row])
+        print(f"Admin keyboard sent to {message.from_user.id}: {keys}")
+    except Exception as e:
+        print(f"Error dumping admin keyboard: {e}")
+
+    await message.answer("🔧 Панель администратора", reply_markup=kb)
+    # fallback in case client hides buttons: provide command hint
+    await message.answer("Если вы не видите кнопку '🛑 Управление датами', введите /admin_dates")
+
+
+
+async def all_bookings():
+    """(id, name, date, time, comment) of every live booking."""
+    if booking_store:
+        return [(r[0], r[2], r[3], r[4], r[5]) for r in booking_store.rows()]
+    async with db_connect() as db:
+        cursor = await db.execute("SELECT id, name, date, time, comment FROM bookings")
+        return await cursor.fetchall()
+
+
+@dp.callback_query(lambda c: c.data == "admin_view")
+async def admin_view_all(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
+    try:
+        rows = await all_bookings()
+
+        if not rows:
+            await call.message.answer("Записей пока нет.")
+            return
+
+        text = "📋 Все записи:\n\n"
+        for row_id, name, date, time, comment in rows:
+            text += f"ID: {row_id}\n👤 {name}\n📅 {date} {time}\nКомментарий: {comment if comment else '-'}\n\n"
+
+        await call.message.answer(text)
+    except Exception as e:
+        print(f"Error in admin_view_all: {e}")
+        await call.message.answer("❌ Ошибка при получении записей")
 
 
+async def query_archive(query: str = "", limit: int = 50):
+    """Archived bookings matching a date (DD.MM.YYYY), a month (MM.YYYY) or a name; newest first."""
+    query = query.strip()
+    if not query:
+        where, params = "", ()
+    elif len(query) == 10 and query.count(".") == 2:
+        where, params = "WHERE date = ?", (query,)
+    elif len(query) == 7 and query.count(".") == 1:
+        where, params = "WHERE date LIKE ?", (f"%.{query}",)
+    else:
+        where, params = "WHERE name LIKE ?", (f"%{query}%",)
+    async with db_connect() as db:
+        cursor = await db.execute(
+            f"SELECT id, name, date, time, comment FROM bookings_archive {where} "
+            f"ORDER BY {BOOKING_DATE_ISO_SQL} DESC, id DESC LIMIT ?",
+            (*params, limit)
+        )
+        return await cursor.fetchall()
+
+
+def format_archive(rows) -> str:
+    if not rows:
+        return "В архиве ничего не найдено."
+    text = "🗄 Архив записей:\n\n"
+    for row_id, name, date, time, comment in rows:
+        text += f"ID: {row_id}\n👤 {name}\n📅 {date} {time}\nКомментарий: {comment if comment else '-'}\n\n"
+    return text
+
+
+@dp.callback_query(lambda c: c.data == "admin_archive")
+async def admin_archive(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
+    try:
+        rows = await query_archive(limit=30)
+        await call.message.answer(format_archive(rows) + "Поиск: /archive ДД.ММ.ГГГГ, /archive ММ.ГГГГ или /archive имя")
+        await call.answer()
+    except Exception as e:
+        print(f"Error in admin_archive: {e}")
+        await call.message.answer("❌ Ошибка при получении архива")
+
+
+@dp.message(Command("archive"))
+async def archive_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
 
-def main_keyboard():
-    buttons = [
-        [InlineKeyboardButton(text="📞 Связаться", callback_data="contact")],
-        [InlineKeyboardButton(text="🛠 Мои работы", callback_data="mywork")],
-        [InlineKeyboardButton(text="💬 Отзывы", callback_data="reviews")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    try:
+        query = message.text.split(maxsplit=1)[1] if len(message.text.split(maxsplit=1)) > 1 else ""
+        rows = await query_archive(query)
+        await message.answer(format_archive(rows))
+    except Exception as e:
+        print(f"Error in archive_cmd: {e}")
+        await message.answer("❌ Ошибка при получении архива")
+
+
+async def query_audit(admin_id: int = None, booking_id: int = None, since: str = None, until: str = None, limit: int = 30):
+    """Audit entries, newest first, filtered by admin, booking and/or an ISO date range (inclusive)."""
+    # the current process's unwritten entries should show up too
+    await audit.flush()
+    where, params = [], []
+    if admin_id is not None:
+        where.append("admin_id = ?")
+        params.append(admin_id)
+    if booking_id is not None:
+        where.append("booking_id = ?")
+        params.append(booking_id)
+    if since:
+        where.append("at >= ?")
+        params.append(since)
+    if until:
+        # `at` has seconds; everything on the `until` day sorts below the next day
+        where.append("at < ?")
+        params.append((datetime.fromisoformat(until) + timedelta(days=1)).date().isoformat())
+    async with db_connect() as db:
+        cursor = await db.execute(
+            f"SELECT at, admin_id, action, booking_id, details FROM audit_log "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY at DESC, id DESC LIMIT ?",
+            (*params, limit)
+        )
+        return await cursor.fetchall()
+
+
+def parse_audit_query(args: str) -> dict:
+    """`admin ID`, `booking ID`, `DD.MM.YYYY` or `DD.MM.YYYY DD.MM.YYYY`; raises ValueError."""
+    parts = args.split()
+    if not parts:
+        return {}
+    if parts[0] in ("admin", "booking") and len(parts) == 2:
+        return {f"{parts[0]}_id": int(parts[1])}
+    if len(parts) <= 2:
+        days = [datetime.strptime(p, "%d.%m.%Y").date().isoformat() for p in parts]
+        return {"since": days[0], "until": days[-1]}
+    raise ValueError(args)
+
+
+def format_audit(rows) -> str:
+    if not rows:
+        return "Журнал пуст."
+    lines = ["📜 Журнал действий:\n"]
+    for at, admin_id, action, booking_id, details in rows:
+        line = f"{at.replace('T', ' ')} · {admin_id} · {action}"
+        if booking_id is not None:
+            line += f" #{booking_id}"
+        if details:
+            line += f" · {details}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@dp.message(Command("audit"))
+async def audit_cmd(message: types.Message, command: CommandObject = None):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
 
+    try:
+        filters = parse_audit_query(command.args or "" if command else "")
+    except ValueError:
+        await message.answer("Использование: /audit, /audit admin ID, /audit booking ID, /audit ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]")
+        return
 
-@dp.message(Command("start"))
-async def start(message: types.Message):
     try:
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Полный календарь", callback_data="range_full")],
-            [InlineKeyboardButton(text="На 1 месяц", callback_data="range_1"), InlineKeyboardButton(text="На 2 месяца", callback_data="range_2")]
-        ])
-        await message.answer("📅 Выберите диапазон дат:", reply_markup=kb)
-        await message.answer("Быстрые команды:", reply_markup=main_keyboard())
+        await message.answer(format_audit(await query_audit(**filters)))
     except Exception as e:
-        print(f"Error in start command: {e}")
-        await message.answer("❌ Произошла ошибка")
+        print(f"Error in audit_cmd: {e}")
+        await message.answer("❌ Ошибка при чтении журнала")
 
 
-@dp.callback_query(lambda c: c.data.startswith("range_"))
-async def range_selected(call: types.CallbackQuery):
-    print(f"range_selected invoked: {call.data} by {getattr(call.from_user, 'id', None)}")
+@dp.callback_query(lambda c: c.data == "admin_reviews")
+async def admin_show_reviews(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
     try:
-        key = call.data.replace("range_", "")
-        if key == "full":
-            months = 12
+        if booking_store:
+            rows = [(r[0],) + r[2:] for r in reversed(booking_store.reviews[-50:])]
         else:
-            try:
-                months = int(key)
-            except ValueError:
-                print(f"Invalid range value: {key}")
-                await call.answer()
-                return
+            async with db_connect() as db:
+                cursor = await db.execute("SELECT id, name, text, created_at, status FROM reviews ORDER BY id DESC LIMIT 50")
+                rows = await cursor.fetchall()
 
-        markup = await build_calendar(months=months, booking_id=0)
-        try:
-            await call.message.answer("📅 Выберите дату:", reply_markup=markup)
-        except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error sending calendar in range_selected: {e}")
-        await call.answer()
+        if not rows:
+            await call.message.answer("Отзывы отсутствуют.")
+            return
+
+        text = "📝 Все отзывы:\n\n"
+        for r_id, name, text_rev, created, status in rows:
+            text += f"{REVIEW_STATUS_MARKS.get(status, '')} ID:{r_id} 👤 {name}: {text_rev} ({created})\n\n"
+
+        kb = None
+        if any(r[4] == "pending" for r in rows):
+            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🕓 На модерации", callback_data="admin_reviews_pending")]])
+        await call.message.answer(text, reply_markup=kb)
     except Exception as e:
-        print(f"Error in range_selected: {e}")
-        await call.answer()
+        print(f"Error in admin_show_reviews: {e}")
+        await call.message.answer("❌ Ошибка при получении отзывов")
 
 
-@dp.callback_query(lambda c: c.data == "range_full")
-async def range_full(call: types.CallbackQuery):
+@dp.callback_query(lambda c: c.data == "admin_reviews_pending")
+async def admin_pending_reviews(call: types.CallbackQuery):
+    """The oldest pending reviews as a digest, whether or not one was sent for them already."""
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
     try:
-        # full calendar view: allow 12 months ahead
-        markup = await build_calendar(months=12, booking_id=0)
-        try:
-            await call.message.answer("📅 Выберите дату:", reply_markup=markup)
-        except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error in range_full: {e}")
+        rows = await review_rows(0, pending_only=True)
+        if not rows:
+            await call.message.answer("Нет отзывов на модерации.")
+        else:
+            text, markup = review_digest(rows)
+            await call.message.answer(text, reply_markup=markup)
         await call.answer()
     except Exception as e:
-        print(f"Error in range_full: {e}")
-        await call.answer()
+        print(f"Error in admin_pending_reviews: {e}")
+        await call.answer("❌ Ошибка")
 
 
+@dp.callback_query(lambda c: c.data.startswith(("revok_", "revno_")))
+async def moderate_review_cb(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
 
-@dp.callback_query(lambda c: c.data.startswith("date_"))
-async def date_selected(call: types.CallbackQuery):
     try:
-        date = call.data.replace("date_", "")
-        # ask user to choose time after date
-        await call.message.answer(f"Вы выбрали дату: {date}\nВыберите время:", reply_markup=time_keyboard(date))
-        await call.answer()
+        action, first, last, review_id = call.data.split("_")
+        first, last, review_id = int(first), int(last), int(review_id)
+        status = "approved" if action == "revok" else "rejected"
+        # 0 is "approve all" of the digest
+        ids = await moderate_reviews(review_id or first, review_id or last, status)
+        if ids:
+            audit.record(call.from_user.id, "approve_review" if status == "approved" else "reject_review",
+                         details=", ".join(f"#{i}" for i in ids))
+            await call.answer(("✅ Одобрено" if status == "approved" else "❌ Отклонено") + f": {len(ids)}")
+        else:
+            await call.answer("Уже разобрано другим администратором")
+        rows = await review_rows(first, last)
+        if rows:
+            text, markup = review_digest(rows)
+            await edit_or_answer(call.message, text, reply_markup=markup)
     except Exception as e:
-        print(f"Error in date_selected: {e}")
-        await call.message.answer("❌ Ошибка")
-        await call.answer()
+        print(f"Error in moderate_review_cb: {e}")
+        await call.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data.startswith("time_"))
-async def time_selected(call: types.CallbackQuery):
+@dp.callback_query(lambda c: c.data == "admin_cancel")
+async def admin_cancel_booking(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
     try:
-        payload = call.data.replace("time_", "")
-        # payload = "{date_iso}_{time}"
-        parts = payload.rsplit("_", 1)
-        date_iso = parts[0]
-        time = parts[1]
+        rows = await all_bookings()
 
-        # check blocked and counts
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT 1 FROM blocked_dates WHERE date = ?", (date_iso,))
-            if await cursor.fetchone():
-                await call.answer("Эта дата заблокирована", show_alert=True)
-                return
+        if not rows:
+            await call.message.answer("Нет записей для отмены.")
+            return
 
-            # check recurring closed weekdays
-            wd = datetime.fromisoformat(date_iso).weekday()
-            cursor = await db.execute("SELECT 1 FROM closed_weekdays WHERE weekday = ?", (wd,))
-            if await cursor.fetchone():
-                await call.answer("В этот день я не работаю", show_alert=True)
-                return
+        buttons = []
+        for row_id, name, date, time, comment in rows:
+            buttons.append([InlineKeyboardButton(
+                text=f"Отменить: {name} ({date} {time})",
+                callback_data=f"cancel_id_{row_id}"
+            )])
+        
+        await call.message.answer("Выберите запись для отмены:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    except Exception as e:
+        print(f"Error in admin_cancel_booking: {e}")
+        await call.message.answer("❌ Error loading bookings")
 
-            # bookings store date as DD.MM.YYYY
-            date_display = datetime.fromisoformat(date_iso).strftime("%d.%m.%Y")
-            cursor = await db.execute("SELECT COUNT(*) FROM bookings WHERE date = ?", (date_display,))
-            cnt = (await cursor.fetchone())[0]
-            if cnt >= 2:
-                await call.answer("На эту дату уже записано максимальное количество людей", show_alert=True)
-                return
+@dp.callback_query(lambda c: c.data.startswith("cancel_id_"))
+async def confirm_cancel(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
 
-            # check if this time is already taken on that date
-            cursor = await db.execute("SELECT 1 FROM bookings WHERE date = ? AND time = ?", (date_display, time))
-            if await cursor.fetchone():
-                await call.answer("Это время уже занято", show_alert=True)
-                return
+    try:
+        booking_id = int(call.data.replace("cancel_id_", ""))
+        
+        row, _ = await cancel_booking(booking_id, notice="⚠️ Ваша запись на {date} {time} была отменена администратором")
 
-            await db.execute(
-                "INSERT INTO bookings (user_id, name, date, time, comment) VALUES (?, ?, ?, ?, ?)",
-                (call.from_user.id, call.from_user.first_name, date_display, time, None)
-            )
-            await db.commit()
+        if row:
+            audit.record(call.from_user.id, "cancel", booking_id, f"{row[2]} {row[3]} {row[4]}")
+            await call.message.answer(f"✅ Отменено: {row[2]} ({row[3]} {row[4]})")
+        else:
+            await call.message.answer("❌ Запись не найдена")
+    except Exception as e:
+        print(f"Error in confirm_cancel: {e}")
+        await call.message.answer("❌ Error cancelling booking")
 
-        await call.message.answer(f"✅ Вы записаны на {date_display} в {time}.\nНапишите комментарий к записи или отправьте /skip, чтобы пропустить.")
-        # notify admins
-        if ADMIN_IDS:
-            for admin_id in ADMIN_IDS:
-                try:
-                    await bot.send_message(admin_id, f"📌 Новая запись:\n👤 {call.from_user.first_name}\n📅 {date_display} {time}")
-                except:
-                    pass
-        await call.answer()
+@dp.callback_query(lambda c: c.data == "admin_edit")
+async def admin_edit_booking(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
+    try:
+        rows = await all_bookings()
+
+        if not rows:
+            await call.message.answer("Нет записей для изменения.")
+            return
+
+        buttons = []
+        for row_id, name, date, time, comment in rows:
+            buttons.append([InlineKeyboardButton(
+                text=f"Изменить: {name} ({date} {time})",
+                callback_data=f"edit_id_{row_id}"
+            )])
+        
+        await call.message.answer("Выберите запись для изменения:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
     except Exception as e:
-        print(f"Error in time_selected: {e}")
-        await call.message.answer("❌ Ошибка при сохранении записи")
-        await call.answer()
+        print(f"Error in admin_edit_booking: {e}")
+        await call.message.answer("❌ Error loading bookings")
 
 
-@dp.callback_query(lambda c: c.data == "contact")
-async def contact_info(call: types.CallbackQuery):
+@dp.callback_query(lambda c: c.data == "admin_dates")
+async def admin_dates(call: types.CallbackQuery):
+    if not is_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещён")
+        return
+
     try:
-        await call.message.answer("📞 Контакты администратора:\n@simbviska\nID: 1076207542")
+        print(f"admin_dates callback invoked by {call.from_user.id}")
+        markup = await build_calendar(months=1, admin_mode=True)
+        await edit_or_answer(call.message, "Выберите дату для блокировки/разблокировки:", reply_markup=markup)
         await call.answer()
     except Exception as e:
-        print(f"Error in contact_info: {e}")
-        await call.answer()
+        print(f"Error in admin_dates: {e}")
+        await call.message.answer("❌ Error loading dates")
 
 
-@dp.callback_query(lambda c: c.data == "mywork")
-async def my_work(call: types.CallbackQuery):
+@dp.message(Command("broadcast"))
+async def broadcast_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+
     try:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📱 Instagram", url="https://www.instagram.com/vii.nail_?igsh=MThlZDM4OWt0M2FzdQ%3D%3D&utm_source=qr")],
-            [InlineKeyboardButton(text="💬 Telegram", url="https://t.me/vii_nails_art")]
-        ])
-        await call.message.answer("🛠 Мои работы и отзывы:", reply_markup=keyboard)
-        await call.answer()
+        parts = message.text.split(maxsplit=2)
+        since = None
+        if len(parts) > 1:
+            try:
+                # optional first argument: only clients who visited on or after this date
+                since = datetime.strptime(parts[1], "%d.%m.%Y").date().isoformat()
+                text = parts[2] if len(parts) > 2 else ""
+            except ValueError:
+                text = message.text.split(maxsplit=1)[1]
+        else:
+            text = ""
+        if not text.strip():
+            await message.answer(
+                "Использование:\n/broadcast текст — всем клиентам\n"
+                "/broadcast ДД.ММ.ГГГГ текст — клиентам, чья последняя запись не раньше этой даты\n"
+                "/broadcast_status — ход рассылок, /broadcast_stop ID — остановить"
+            )
+            return
+
+        async with db_write() as db:
+            cursor = await db.execute(
+                "INSERT INTO broadcasts (admin_id, text, since) VALUES (?, ?, ?)",
+                (message.from_user.id, text, since)
+            )
+            broadcast_id = cursor.lastrowid
+        spawn_background(run_broadcast(broadcast_id))
+        await message.answer(f"📣 Рассылка #{broadcast_id} запущена. Ход: /broadcast_status")
     except Exception as e:
-        print(f"Error in my_work: {e}")
-        await call.answer()
+        print(f"Error in broadcast_cmd: {e}")
+        await message.answer("❌ Ошибка при запуске рассылки")
 
 
-@dp.callback_query(lambda c: c.data == "reviews")
-async def show_reviews(call: types.CallbackQuery):
+@dp.message(Command("broadcast_status"))
+async def broadcast_status_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT name, text, created_at FROM reviews ORDER BY id DESC LIMIT 10")
+        async with db_connect() as db:
+            cursor = await db.execute("SELECT id, status, sent, failed, created_at FROM broadcasts ORDER BY id DESC LIMIT 5")
             rows = await cursor.fetchall()
-
-        text = "💬 Отзывы:\n\n"
         if not rows:
-            text = "Пока нет отзывов."
-        else:
-            for name, text_rev, created in rows:
-                text += f"👤 {name}: {text_rev} ({created})\n\n"
-
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Оставить отзыв", callback_data="leave_review")]])
-        await call.message.answer(text, reply_markup=kb)
-        await call.answer()
+            await message.answer("Рассылок пока не было.")
+            return
+        text = "📣 Рассылки:\n\n"
+        for broadcast_id, status, sent, failed, created_at in rows:
+            text += f"#{broadcast_id} ({created_at}): {status}, доставлено {sent}, не доставлено {failed}\n"
+        await message.answer(text)
     except Exception as e:
-        print(f"Error in show_reviews: {e}")
-        await call.answer()
+        print(f"Error in broadcast_status_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data == "leave_review")
-async def leave_review_cb(call: types.CallbackQuery):
+@dp.message(Command("broadcast_stop"))
+async def broadcast_stop_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+
     try:
-        pending_reviews.add(call.from_user.id)
-        await call.message.answer("Напишите, пожалуйста, ваш отзыв в сообщении.")
-        await call.answer()
+        broadcast_id = int(message.text.split(maxsplit=1)[1])
+        async with db_write() as db:
+            cursor = await db.execute("UPDATE broadcasts SET status = 'cancelled' WHERE id = ? AND status = 'running'", (broadcast_id,))
+            stopped = cursor.rowcount
+        await message.answer(f"⏹ Рассылка #{broadcast_id} остановлена" if stopped else "Рассылка не найдена или уже завершена")
+    except (IndexError, ValueError):
+        await message.answer("Использование: /broadcast_stop ID")
     except Exception as e:
-        print(f"Error in leave_review_cb: {e}")
-        await call.answer()
+        print(f"Error in broadcast_stop_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.message(Command("review"))
-async def review_cmd(message: types.Message):
-    pending_reviews.add(message.from_user.id)
-    await message.reply("Напишите, пожалуйста, ваш отзыв в сообщении.")
+@dp.message(Command("health"))
+async def health_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+
+    try:
+        async with db_connect() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")
+            outbox_pending = (await cursor.fetchone())[0]
+        lag = loop_monitor.percentiles()
+        uptime = monotonic() - loop_monitor.started_at if loop_monitor.started_at else 0
+        text = f"🩺 Состояние{f' «{TENANT_NAME}»' if TENANT_NAME else ''} (pid {os.getpid()}, работает {uptime / 3600:.1f} ч)\n\n"
+        if lag:
+            text += f"Задержка цикла, мс: p50 {lag['p50']:.1f} · p95 {lag['p95']:.1f} · p99 {lag['p99']:.1f} · max {lag['max']:.1f}\n"
+        else:
+            text += "Задержка цикла: нет данных\n"
+        text += f"Блокировок цикла > {LOOP_LAG_THRESHOLD_MS:g} мс: {loop_monitor.stalls}\n"
+        avg = 1000 * update_stats.busy_seconds / update_stats.updates if update_stats.updates else 0
+        text += f"Обновлений: {update_stats.updates}, с ошибкой: {update_stats.errors}, в среднем {avg:.1f} мс\n"
+        text += f"Фоновых задач: {len(background_tasks)}\n"
+        text += f"Уведомлений в очереди: {outbox_pending}\n"
+        text += f"Удерживаемых мест: {len(slot_holds.by_user)}"
+        await message.answer(text)
+    except Exception as e:
+        print(f"Error in health_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.message(Command("admin"))
-async def admin_panel(message: types.Message):
+@dp.message(Command("backup"))
+async def backup_cmd(message: types.Message):
     if not is_admin(message.from_user.id):
         await message.answer("❌ Доступ запрещён")
         return
 
-    kb = admin_keyboard()
-    # log keyboard rows for debugging (admins only)
     try:
-        keys = []
-        for row in kb.inline_keyboard:
-            keys.append([b.text for b in row])
-        print(f"Admin keyboard sent to {message.from_user.id}: {keys}")
+        await message.answer("⏳ Создаю резервную копию...")
+        path, result = await backup_database()
+        if path:
+            size_kb = os.path.getsize(path) / 1024
+            await message.answer(f"✅ Резервная копия создана: {os.path.basename(path)} ({size_kb:.0f} КБ), проверка целостности: {result}")
+        else:
+            await message.answer(f"❌ Резервная копия не прошла проверку целостности: {result}")
     except Exception as e:
-        print(f"Error dumping admin keyboard: {e}")
+        print(f"Error in backup_cmd: {e}")
+        await message.answer("❌ Ошибка при создании резервной копии")
 
-    await message.answer("🔧 Панель администратора", reply_markup=kb)
-    # fallback in case client hides buttons: provide command hint
-    await message.answer("Если вы не видите кнопку '🛑 Управление датами', введите /admin_dates")
 
+@dp.message(Command("admins"))
+async def admins_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+
+    try:
+        lines = [f"{a} (ADMIN_IDS)" if a in ADMIN_IDS else str(a) for a in sorted(config.admins)]
+        await message.answer("👑 Администраторы:\n" + "\n".join(lines) + "\n\nДобавить: /admin_add ID\nУдалить: /admin_del ID")
+    except Exception as e:
+        print(f"Error in admins_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data == "admin_view")
-async def admin_view_all(call: types.CallbackQuery):
-    if not is_admin(call.from_user.id):
-        await call.answer("❌ Доступ запрещён")
+@dp.message(Command("admin_add", "admin_del"))
+async def admin_change_cmd(message: types.Message, command: CommandObject = None):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
         return
 
+    adding = command.command == "admin_add"
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT id, name, date, time, comment FROM bookings")
-            rows = await cursor.fetchall()
-
-        if not rows:
-            await call.message.answer("Записей пока нет.")
-            return
-
-        text = "📋 Все записи:\n\n"
-        for row_id, name, date, time, comment in rows:
-            text += f"ID: {row_id}\n👤 {name}\n📅 {date} {time}\nКомментарий: {comment if comment else '-'}\n\n"
+        user_id = int(command.args)
+    except (TypeError, ValueError):
+        await message.answer(f"Использование: /{command.command} ID")
+        return
+    if not adding and user_id in ADMIN_IDS:
+        await message.answer("Этот администратор задан в ADMIN_IDS и удаляется только там")
+        return
 
-        await call.message.answer(text)
+    try:
+        async with db_write() as db:
+            if adding:
+                await db.execute(
+                    "INSERT OR IGNORE INTO admins (user_id, added_by, added_at) VALUES (?, ?, ?)",
+                    (user_id, message.from_user.id, datetime.now().isoformat())
+                )
+            else:
+                await db.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+        audit.record(message.from_user.id, command.command, details=str(user_id))
+        applied = await reload_config()
+        text = f"✅ {user_id} добавлен в администраторы" if adding else f"🗑 {user_id} больше не администратор"
+        await message.answer(text if applied else text + " (применяется во всех процессах)")
     except Exception as e:
-        print(f"Error in admin_view_all: {e}")
-        await call.message.answer("❌ Ошибка при получении записей")
+        print(f"Error in admin_change_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data == "admin_reviews")
-async def admin_show_reviews(call: types.CallbackQuery):
-    if not is_admin(call.from_user.id):
-        await call.answer("❌ Доступ запрещён")
+@dp.message(Command("set"))
+async def set_cmd(message: types.Message, command: CommandObject = None):
+    """`/set` lists settings, `/set key value` changes one, `/set key` restores the default."""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
         return
 
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT id, name, text, created_at FROM reviews ORDER BY id DESC LIMIT 50")
-            rows = await cursor.fetchall()
+    args = (command.args or "").strip() if command else ""
+    if not args:
+        lines = []
+        for key, (_, default, description) in SETTINGS.items():
+            value = config.values.get(key, default)
+            lines.append(f"{key} = {value}{'' if key in config.values else ' (по умолчанию)'}\n   {description}")
+        await message.answer("⚙️ Настройки:\n\n" + "\n".join(lines) + "\n\nИзменить: /set ключ значение\nСбросить: /set ключ")
+        return
 
-        if not rows:
-            await call.message.answer("Отзывы отсутствуют.")
+    key, _, value = args.partition(" ")
+    value = value.strip()
+    if key not in SETTINGS:
+        await message.answer(f"Неизвестная настройка. Доступны: {', '.join(SETTINGS)}")
+        return
+    if value:
+        try:
+            SETTINGS[key][0](value)
+        except ValueError:
+            await message.answer(f"❌ Недопустимое значение для {key}")
             return
 
-        text = "📝 Все отзывы:\n\n"
-        for r_id, name, text_rev, created in rows:
-            text += f"ID:{r_id} 👤 {name}: {text_rev} ({created})\n\n"
-
-        await call.message.answer(text)
+    try:
+        async with db_write() as db:
+            if value:
+                await db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+            else:
+                await db.execute("DELETE FROM settings WHERE key = ?", (key,))
+        audit.record(message.from_user.id, "set", details=f"{key}={value}" if value else f"{key} (default)")
+        applied = await reload_config()
+        text = f"✅ {key} = {value}" if value else f"✅ {key}: значение по умолчанию"
+        await message.answer(text if applied else text + " (применяется во всех процессах)")
     except Exception as e:
-        print(f"Error in admin_show_reviews: {e}")
-        await call.message.answer("❌ Ошибка при получении отзывов")
+        print(f"Error in set_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data == "admin_cancel")
-async def admin_cancel_booking(call: types.CallbackQuery):
-    if not is_admin(call.from_user.id):
-        await call.answer("❌ Доступ запрещён")
+@dp.message(Command("reload"))
+async def reload_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
         return
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT id, name, date, time FROM bookings")
-            rows = await cursor.fetchall()
+        applied = await reload_config()
+        await message.answer("✅ Администраторы и настройки перечитаны" if applied else "⏳ Перечитываю настройки во всех процессах")
+    except Exception as e:
+        print(f"Error in reload_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
-        if not rows:
-            await call.message.answer("Нет записей для отмены.")
-            return
 
-        buttons = []
-        for row_id, name, date, time in rows:
-            buttons.append([InlineKeyboardButton(
-                text=f"Отменить: {name} ({date} {time})",
-                callback_data=f"cancel_id_{row_id}"
-            )])
-        
-        await call.message.answer("Выберите запись для отмены:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
-    except Exception as e:
-        print(f"Error in admin_cancel_booking: {e}")
-        await call.message.answer("❌ Error loading bookings")
+RULE_WEEKDAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
-@dp.callback_query(lambda c: c.data.startswith("cancel_id_"))
-async def confirm_cancel(call: types.CallbackQuery):
-    if not is_admin(call.from_user.id):
-        await call.answer("❌ Доступ запрещён")
+
+def parse_rule_args(args: str) -> dict:
+    """
+    Parse `/rule_add close|open [days=1,3] [every=2] [from=DD.MM.YYYY] [to=DD.MM.YYYY]
+    [slots=14:00,15:00] [prio=10]` (days: 1 = Monday) into schedule_rules columns.
+    Raises ValueError on anything malformed.
+    """
+    parts = args.split()
+    if not parts or parts[0] not in ("close", "open"):
+        raise ValueError("action")
+    row = {"action": parts[0], "weekdays": "", "slots": "", "start_date": None,
+           "end_date": None, "every_weeks": 1, "priority": 0}
+    for part in parts[1:]:
+        key, _, value = part.partition("=")
+        if key == "days":
+            days = sorted({int(x) - 1 for x in value.split(",")})
+            if not all(0 <= x <= 6 for x in days):
+                raise ValueError(part)
+            row["weekdays"] = ",".join(map(str, days))
+        elif key == "slots":
+            slots = value.split(",")
+            if not all(t in schedule.slots for t in slots):
+                raise ValueError(part)
+            row["slots"] = ",".join(slots)
+        elif key in ("from", "to"):
+            row["start_date" if key == "from" else "end_date"] = datetime.strptime(value, "%d.%m.%Y").date().isoformat()
+        elif key == "every":
+            row["every_weeks"] = int(value)
+            if row["every_weeks"] < 1:
+                raise ValueError(part)
+        elif key == "prio":
+            row["priority"] = int(value)
+        else:
+            raise ValueError(part)
+    return row
+
+
+def format_rule(rule: ScheduleRule) -> str:
+    text = f"#{rule.id} {'🟢 открыть' if rule.action == 'open' else '⛔ закрыть'}"
+    if rule.weekdays:
+        text += " " + ",".join(RULE_WEEKDAY_NAMES[w] for w in sorted(rule.weekdays))
+    else:
+        text += " все дни"
+    if rule.every_weeks > 1:
+        text += f", раз в {rule.every_weeks} нед."
+    if rule.slot_mask != (1 << len(schedule.slots)) - 1:
+        text += ", " + ",".join(t for i, t in enumerate(schedule.slots) if rule.slot_mask >> i & 1)
+    if rule.start or rule.end:
+        text += f", {rule.start.strftime('%d.%m.%Y') if rule.start else '…'}–{rule.end.strftime('%d.%m.%Y') if rule.end else '…'}"
+    return text + f" (приоритет {rule.priority})"
+
+
+@dp.message(Command("rules"))
+async def rules_cmd(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
         return
 
     try:
-        booking_id = int(call.data.replace("cancel_id_", ""))
-        
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT user_id, name, date, time FROM bookings WHERE id = ?", (booking_id,))
-            row = await cursor.fetchone()
-            
-            if row:
-                user_id, name, date, time = row
-                await db.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-                await db.commit()
-                
-                await call.message.answer(f"✅ Отменено: {name} ({date} {time})")
-                
-                # Notify user
-                try:
-                    await bot.send_message(user_id, f"⚠️ Ваша запись на {date} {time} была отменена администратором")
-                except:
-                    pass
-            else:
-                await call.message.answer("❌ Запись не найдена")
+        current = await ensure_schedule()
+        if not current.rules:
+            await message.answer("Правил расписания нет.\n\nДобавить: /rule_add close|open days=1,3 every=2 from=DD.MM.YYYY to=DD.MM.YYYY slots=14:00,15:00 prio=10")
+            return
+        await message.answer("📐 Правила расписания:\n\n" + "\n".join(format_rule(r) for r in current.rules) + "\n\nУдалить: /rule_del ID")
     except Exception as e:
-        print(f"Error in confirm_cancel: {e}")
-        await call.message.answer("❌ Error cancelling booking")
+        print(f"Error in rules_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
-@dp.callback_query(lambda c: c.data == "admin_edit")
-async def admin_edit_booking(call: types.CallbackQuery):
-    if not is_admin(call.from_user.id):
-        await call.answer("❌ Доступ запрещён")
+
+@dp.message(Command("rule_add"))
+async def rule_add_cmd(message: types.Message, command: CommandObject = None):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
         return
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT id, name, date, time, comment FROM bookings")
-            rows = await cursor.fetchall()
-
-        if not rows:
-            await call.message.answer("Нет записей для изменения.")
-            return
+        row = parse_rule_args(command.args or "" if command else "")
+    except ValueError:
+        await message.answer("Использование: /rule_add close|open [days=1,3] [every=2] [from=DD.MM.YYYY] [to=DD.MM.YYYY] [slots=14:00,15:00] [prio=10]")
+        return
 
-        buttons = []
-        for row_id, name, date, time, comment in rows:
-            buttons.append([InlineKeyboardButton(
-                text=f"Изменить: {name} ({date} {time})",
-                callback_data=f"edit_id_{row_id}"
-            )])
-        
-        await call.message.answer("Выберите запись для изменения:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    try:
+        async with db_write() as db:
+            cursor = await db.execute(
+                "INSERT INTO schedule_rules (action, weekdays, slots, start_date, end_date, every_weeks, priority) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row["action"], row["weekdays"], row["slots"], row["start_date"], row["end_date"], row["every_weeks"], row["priority"])
+            )
+            rule = rule_from_row((cursor.lastrowid, row["action"], row["weekdays"], row["slots"],
+                                  row["start_date"], row["end_date"], row["every_weeks"], row["priority"]))
+        await ensure_schedule()
+        # a reload in ensure_schedule() may have read the new rule from the DB already
+        if all(r.id != rule.id for r in schedule.rules):
+            rules = tuple(sorted(schedule.rules + (rule,), key=lambda r: (r.priority, r.id)))
+            # only the days this rule matches can change
+            publish_schedule(affected=rule.matches, rules=rules)
+        audit.record(message.from_user.id, "rule_add", details=format_rule(rule))
+        await message.answer(f"✅ Правило добавлено:\n{format_rule(rule)}")
     except Exception as e:
-        print(f"Error in admin_edit_booking: {e}")
-        await call.message.answer("❌ Error loading bookings")
+        print(f"Error in rule_add_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
-@dp.callback_query(lambda c: c.data == "admin_dates")
-async def admin_dates(call: types.CallbackQuery):
-    if not is_admin(call.from_user.id):
-        await call.answer("❌ Доступ запрещён")
+@dp.message(Command("rule_del"))
+async def rule_del_cmd(message: types.Message, command: CommandObject = None):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
         return
 
     try:
-        print(f"admin_dates callback invoked by {call.from_user.id}")
-        markup = await build_calendar(months=1, admin_mode=True)
-        await call.message.answer("Выберите дату для блокировки/разблокировки:", reply_markup=markup)
-        await call.answer()
+        rule_id = int(command.args) if command and command.args else None
+    except ValueError:
+        rule_id = None
+    if rule_id is None:
+        await message.answer("Использование: /rule_del ID")
+        return
+
+    try:
+        async with db_write() as db:
+            cursor = await db.execute("DELETE FROM schedule_rules WHERE id = ?", (rule_id,))
+            deleted = cursor.rowcount
+        await ensure_schedule()
+        rule = next((r for r in schedule.rules if r.id == rule_id), None)
+        if rule:
+            publish_schedule(affected=rule.matches, rules=tuple(r for r in schedule.rules if r is not rule))
+        if deleted:
+            audit.record(message.from_user.id, "rule_del", details=format_rule(rule) if rule else f"#{rule_id}")
+        await message.answer(f"🗑 Правило #{rule_id} удалено" if deleted else "Правило не найдено")
     except Exception as e:
-        print(f"Error in admin_dates: {e}")
-        await call.message.answer("❌ Error loading dates")
+        print(f"Error in rule_del_cmd: {e}")
+        await message.answer("❌ Ошибка")
 
 
 @dp.message(Command("admin_dates"))
@@ -765,6 +4120,34 @@ async def admin_dates_cmd(message: types.Message):
         await message.answer("❌ Error loading dates")
 
 
+# schedule version -> rendered weekday toggles
+_weekdays_keyboard_cache = {}
+
+
+def weekdays_keyboard(current: ScheduleSnapshot):
+    """Weekday toggles with their status, rendered once per schedule version."""
+    markup = _weekdays_keyboard_cache.get(current.version)
+    if markup:
+        return markup
+    days = ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+    buttons = []
+    row = []
+    for i, d in enumerate(days):
+        mark = "⛔" if i in current.closed_weekdays else "✅"
+        row.append(InlineKeyboardButton(text=f"{mark} {d}", callback_data=f"toggle_weekday_{i}"))
+        if len(row) == 4:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+
+    buttons.append([InlineKeyboardButton(text="Назад", callback_data="admin_back")])
+    markup = InlineKeyboardMarkup(inline_keyboard=buttons)
+    _weekdays_keyboard_cache.clear()
+    _weekdays_keyboard_cache[current.version] = markup
+    return markup
+
+
 @dp.callback_query(lambda c: c.data == "admin_weekdays")
 async def admin_weekdays(call: types.CallbackQuery):
     if not is_admin(call.from_user.id):
@@ -772,26 +4155,8 @@ async def admin_weekdays(call: types.CallbackQuery):
         return
 
     try:
-        # show weekdays and their status
-        days = ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT weekday FROM closed_weekdays")
-            rows = await cursor.fetchall()
-            closed = {r[0] for r in rows}
-
-        buttons = []
-        row = []
-        for i, d in enumerate(days):
-            mark = "⛔" if i in closed else "✅"
-            row.append(InlineKeyboardButton(text=f"{mark} {d}", callback_data=f"toggle_weekday_{i}"))
-            if len(row) == 4:
-                buttons.append(row)
-                row = []
-        if row:
-            buttons.append(row)
-
-        buttons.append([InlineKeyboardButton(text="Назад", callback_data="admin_back")])
-        await call.message.answer("Управление рабочими днями: нажмите, чтобы переключить", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+        current = await ensure_schedule()
+        await edit_or_answer(call.message, "Управление рабочими днями: нажмите, чтобы переключить", reply_markup=weekdays_keyboard(current))
         await call.answer()
     except Exception as e:
         print(f"Error in admin_weekdays: {e}")
@@ -808,10 +4173,9 @@ async def select_new_date(call: types.CallbackQuery):
     # default to 1 month range for admin edits
     markup = await build_calendar(months=1, booking_id=booking_id)
     try:
-        await call.message.answer("Выберите новую дату:", reply_markup=markup)
+        await edit_or_answer(call.message, "Выберите новую дату:", reply_markup=markup)
     except Exception as e:
-        if "message is not modified" not in str(e).lower():
-            print(f"Error sending edit calendar: {e}")
+        print(f"Error sending edit calendar: {e}")
     await call.answer()
 
 @dp.callback_query(lambda c: c.data.startswith("new_date_"))
@@ -825,24 +4189,12 @@ async def confirm_edit(call: types.CallbackQuery):
         booking_id = int(parts[0])
         new_date = parts[1]
         
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT user_id, name FROM bookings WHERE id = ?", (booking_id,))
-            row = await cursor.fetchone()
-            
-            if row:
-                user_id, name = row
-                await db.execute("UPDATE bookings SET date = ? WHERE id = ?", (new_date, booking_id))
-                await db.commit()
-                
-                await call.message.answer(f"✅ Обновлено: {name} → {new_date}")
-                
-                # Notify user
-                try:
-                    await bot.send_message(user_id, f"📅 Ваша запись перенесена на {new_date}")
-                except:
-                    pass
-            else:
-                await call.message.answer("❌ Запись не найдена")
+        row, _ = await move_booking(booking_id, new_date, notice=f"📅 Ваша запись перенесена на {new_date}")
+        if row:
+            audit.record(call.from_user.id, "move", booking_id, f"{row[2]} {row[3]} → {new_date}")
+            await call.message.answer(f"✅ Обновлено: {row[2]} → {new_date}")
+        else:
+            await call.message.answer("❌ Запись не найдена")
     except Exception as e:
         print(f"Error in confirm_edit: {e}")
         await call.message.answer("❌ Ошибка при обновлении записи")
@@ -901,7 +4253,7 @@ async def toggle_block(call: types.CallbackQuery):
             # create all dates between s and e inclusive
             d = s
             inserted = 0
-            async with aiosqlite.connect(DB_PATH) as db:
+            async with db_write() as db:
                 while d <= e:
                     try:
                         await db.execute("INSERT OR IGNORE INTO blocked_dates (date) VALUES (?)", (d.isoformat(),))
@@ -909,35 +4261,42 @@ async def toggle_block(call: types.CallbackQuery):
                     except Exception as ex:
                         print(f"Error inserting blocked date {d}: {ex}")
                     d = d + timedelta(days=1)
-                await db.commit()
+            await ensure_schedule()
+            publish_schedule(
+                affected=lambda x: s <= x <= e,
+                blocked=schedule.blocked | {s + timedelta(days=i) for i in range((e - s).days + 1)}
+            )
             pending_range.pop(call.from_user.id, None)
+            audit.record(call.from_user.id, "block_range", details=f"{s.isoformat()}..{e.isoformat()}")
             await call.answer(f"⛔ Заблокировано {inserted} дат")
             # refresh calendar
             try:
                 now = datetime.now()
                 markup = await build_calendar(months=1, year=now.year, month=now.month, admin_mode=True)
-                await call.message.edit_text("Выберите дату для блокировки/разблокировки:", reply_markup=markup)
+                await edit_or_answer(call.message, "Выберите дату для блокировки/разблокировки:", reply_markup=markup)
             except Exception as ex:
                 print(f"Error refreshing calendar after range block: {ex}")
             return
 
         # regular toggle single date
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with db_write() as db:
             cursor = await db.execute("SELECT 1 FROM blocked_dates WHERE date = ?", (date_iso,))
-            if await cursor.fetchone():
+            unblocked = await cursor.fetchone() is not None
+            if unblocked:
                 await db.execute("DELETE FROM blocked_dates WHERE date = ?", (date_iso,))
-                await db.commit()
-                await call.answer("✅ Дата разблокирована")
             else:
                 await db.execute("INSERT INTO blocked_dates (date) VALUES (?)", (date_iso,))
-                await db.commit()
-                await call.answer("⛔ Дата заблокирована")
+        await ensure_schedule()
+        day = datetime.fromisoformat(date_iso).date()
+        publish_schedule(affected=lambda x: x == day, blocked=schedule.blocked - {day} if unblocked else schedule.blocked | {day})
+        audit.record(call.from_user.id, "unblock" if unblocked else "block", details=date_iso)
+        await call.answer("✅ Дата разблокирована" if unblocked else "⛔ Дата заблокирована")
 
         # refresh calendar message preserving current month/year if possible
         try:
             now = datetime.now()
             markup = await build_calendar(months=1, year=now.year, month=now.month, admin_mode=True)
-            await call.message.edit_text("Выберите дату для блокировки/разблокировки:", reply_markup=markup)
+            await edit_or_answer(call.message, "Выберите дату для блокировки/разблокировки:", reply_markup=markup)
         except Exception as ex:
             print(f"Error refreshing calendar after toggle: {ex}")
     except Exception as e:
@@ -956,20 +4315,21 @@ async def admin_clear_blocks(call: types.CallbackQuery):
         return
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with db_write() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM blocked_dates")
             cnt = (await cursor.fetchone())[0]
             await db.execute("DELETE FROM blocked_dates")
-            await db.commit()
+        await ensure_schedule()
+        publish_schedule(affected=schedule.blocked.__contains__, blocked=frozenset())
+        audit.record(call.from_user.id, "clear_blocks", details=f"{cnt} dates")
         await call.answer(f"✅ Удалено {cnt} блокировок")
         # refresh calendar
         try:
             now = datetime.now()
             markup = await build_calendar(months=1, year=now.year, month=now.month, admin_mode=True)
-            await call.message.edit_text("Выберите дату для блокировки/разблокировки:", reply_markup=markup)
+            await edit_or_answer(call.message, "Выберите дату для блокировки/разблокировки:", reply_markup=markup)
         except Exception as e:
-            if "message is not modified" not in str(e).lower():
-                print(f"Error refreshing calendar after clear blocks: {e}")
+            print(f"Error refreshing calendar after clear blocks: {e}")
     except Exception as e:
         print(f"Error in admin_clear_blocks: {e}")
         await call.answer("❌ Ошибка при очистке блокировок")
@@ -983,16 +4343,18 @@ async def toggle_weekday(call: types.CallbackQuery):
 
     try:
         wd = int(call.data.replace("toggle_weekday_", ""))
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with db_write() as db:
             cursor = await db.execute("SELECT 1 FROM closed_weekdays WHERE weekday = ?", (wd,))
-            if await cursor.fetchone():
+            reopened = await cursor.fetchone() is not None
+            if reopened:
                 await db.execute("DELETE FROM closed_weekdays WHERE weekday = ?", (wd,))
-                await db.commit()
-                await call.answer("✅ День недели отмечен как рабочий")
             else:
                 await db.execute("INSERT INTO closed_weekdays (weekday) VALUES (?)", (wd,))
-                await db.commit()
-                await call.answer("⛔ День недели отмечен как нерабочий")
+        await ensure_schedule()
+        closed = schedule.closed_weekdays - {wd} if reopened else schedule.closed_weekdays | {wd}
+        publish_schedule(affected=lambda x: x.weekday() == wd, closed_weekdays=closed)
+        audit.record(call.from_user.id, "open_weekday" if reopened else "close_weekday", details=RULE_WEEKDAY_NAMES[wd])
+        await call.answer("✅ День недели отмечен как рабочий" if reopened else "⛔ День недели отмечен как нерабочий")
 
         # refresh weekdays UI
         await admin_weekdays(call)
@@ -1001,6 +4363,38 @@ async def toggle_weekday(call: types.CallbackQuery):
         await call.answer("❌ Ошибка")
 
 
+async def set_pending_comment(user_id: int, comment: str):
+    """Attach `comment` to the user's newest booking still waiting for one; returns its id or None."""
+    if booking_store:
+        booking_id = booking_store.pending_comment(user_id)
+        if booking_id:
+            await booking_store.set_comment(booking_id, comment)
+        return booking_id
+    async with db_write() as db:
+        cursor = await db.execute(
+            "SELECT id FROM bookings WHERE user_id = ? AND comment IS NULL ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        )
+        row = await cursor.fetchone()
+        if row:
+            await db.execute("UPDATE bookings SET comment = ? WHERE id = ?", (comment, row[0]))
+    return row[0] if row else None
+
+
+@dp.message(Command("skip"))
+async def skip_comment(message: types.Message):
+    try:
+        row = await set_pending_comment(message.from_user.id, "")
+        if not row:
+            await message.reply("Нет ожидающих комментариев.")
+            return
+
+        await message.reply("Комментарий пропущен. Ваша запись подтверждена.")
+    except Exception as e:
+        print(f"Error in skip_comment: {e}")
+        await message.reply("❌ Ошибка")
+
+
 @dp.message()
 async def handle_comment(message: types.Message):
     # ignore commands
@@ -1010,22 +4404,18 @@ async def handle_comment(message: types.Message):
     # If user is leaving a review
     if message.from_user.id in pending_reviews:
         try:
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    "INSERT INTO reviews (user_id, name, text, created_at) VALUES (?, ?, ?, ?)",
-                    (message.from_user.id, message.from_user.first_name, message.text.strip(), datetime.now().isoformat())
-                )
-                await db.commit()
+            if booking_store:
+                await booking_store.add_review(message.from_user.id, message.from_user.first_name, message.text.strip(), datetime.now().isoformat())
+            else:
+                async with db_write() as db:
+                    await db.execute(
+                        "INSERT INTO reviews (user_id, name, text, created_at, status) VALUES (?, ?, ?, ?, 'pending')",
+                        (message.from_user.id, message.from_user.first_name, message.text.strip(), datetime.now().isoformat())
+                    )
 
             pending_reviews.discard(message.from_user.id)
-            await message.reply("✅ Спасибо за отзыв!")
-            # notify admins
-            if ADMIN_IDS:
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await bot.send_message(admin_id, f"🆕 Новый отзыв от {message.from_user.first_name}: {message.text.strip()}")
-                    except:
-                        pass
+            # admins get it with the next review digest (review_digest_sender)
+            await message.reply("✅ Спасибо за отзыв! Он появится после проверки.")
             return
         except Exception as e:
             print(f"Error saving review: {e}")
@@ -1034,62 +4424,416 @@ async def handle_comment(message: types.Message):
             return
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT id FROM bookings WHERE user_id = ? AND comment IS NULL ORDER BY id DESC LIMIT 1",
-                (message.from_user.id,)
-            )
-            row = await cursor.fetchone()
-
-            if not row:
-                await message.reply("Я не нашёл запись для добавления комментария. Отправьте /start, чтобы записаться.")
-                return
-
-            booking_id = row[0]
-            await db.execute("UPDATE bookings SET comment = ? WHERE id = ?", (message.text.strip(), booking_id))
-            await db.commit()
+        row = await set_pending_comment(message.from_user.id, message.text.strip())
+        if not row:
+            await message.reply("Я не нашёл запись для добавления комментария. Отправьте /start, чтобы записаться.")
+            return
 
         await message.reply("✅ Комментарий сохранён. Ваша запись подтверждена.")
         # notify admins about comment
-        if ADMIN_IDS:
-            for admin_id in ADMIN_IDS:
-                try:
-                    await bot.send_message(admin_id, f"💬 Комментарий к записи от {message.from_user.first_name}: {message.text.strip()}")
-                except:
-                    pass
+        await notify_admins(f"💬 Комментарий к записи от {message.from_user.first_name}: {message.text.strip()}")
     except Exception as e:
         print(f"Error in handle_comment: {e}")
         await message.reply("❌ Ошибка при сохранении комментария")
 
 
-@dp.message(Command("skip"))
-async def skip_comment(message: types.Message):
+class UpdateTracker:
+    """
+    Resume state of polling. Every poll confirms all updates received so far
+    (the offset moves past them), so a slow handler never holds up intake. To
+    lose nothing, the raw JSON of each update is stored in bot_state before it
+    is confirmed and dropped once its handler is done; what is left on boot
+    was received but not handled, and is dispatched again.
+    """
+
+    def __init__(self, offset: int = None, pending=None, skip=()):
+        self.next_id = offset
+        self.in_flight = dict(pending or {})  # update_id -> raw JSON, stored in bot_state
+        self.finished_ids = set()  # handled; their bot_state rows are not deleted yet
+        # handled ids above the offset, from a checkpoint of an older version
+        self.skip = set(skip)
+
+    def known(self, update_id: int) -> bool:
+        """Received already: a redelivery to ignore."""
+        return (self.next_id is not None and update_id < self.next_id) or update_id in self.in_flight
+
+    def finished(self, update_id: int):
+        if self.in_flight.pop(update_id, None) is not None:
+            self.finished_ids.add(update_id)
+
+
+async def load_update_tracker() -> UpdateTracker:
+    async with db_connect() as db:
+        cursor = await db.execute("SELECT key, value FROM bot_state WHERE key = 'update_offset' OR key LIKE 'update:%'")
+        rows = await cursor.fetchall()
+    state = {}
+    pending = {}
+    for key, value in rows:
+        if key == "update_offset":
+            state = json.loads(value)
+        else:
+            pending[int(key.split(":", 1)[1])] = value
+    if not state:
+        return UpdateTracker(pending=pending)
+    print(f"Resuming updates from {state['offset']}, {len(pending)} unfinished to handle again")
+    return UpdateTracker(state["offset"], pending, state.get("skip", ()))
+
+
+async def save_update_state(tracker: UpdateTracker, received: dict = None):
+    """
+    In one transaction: drop the stored updates that were handled and, for a
+    poll, store the `received` ones ({update_id: raw JSON}) with the offset
+    past them. Only the poller passes `received`, so the offset never goes back.
+    """
+    done, tracker.finished_ids = tracker.finished_ids, set()
+    if not done and received is None:
+        return
+    offset = max([tracker.next_id or 0] + [update_id + 1 for update_id in received or ()])
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT id FROM bookings WHERE user_id = ? AND comment IS NULL ORDER BY id DESC LIMIT 1",
-                (message.from_user.id,)
-            )
-            row = await cursor.fetchone()
-            if not row:
-                await message.reply("Нет ожидающих комментариев.")
-                return
+        async with db_write() as db:
+            await db.executemany("DELETE FROM bot_state WHERE key = ?", [(f"update:{i}",) for i in done])
+            if received is not None:
+                await db.executemany(
+                    "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+                    [(f"update:{i}", raw) for i, raw in received.items()]
+                )
+                await db.execute(
+                    "INSERT OR REPLACE INTO bot_state (key, value) VALUES ('update_offset', ?)",
+                    (json.dumps({"offset": offset}),)
+                )
+    except Exception:
+        tracker.finished_ids |= done
+        raise
+    if received is not None:
+        tracker.next_id = offset
+        tracker.in_flight.update(received)
+        tracker.skip = {i for i in tracker.skip if i >= offset}
+
+
+async def update_checkpointer(tracker: UpdateTracker):
+    """Drop handled updates from bot_state while no polls come in to do it."""
+    while True:
+        await asyncio.sleep(UPDATE_CHECKPOINT_INTERVAL)
+        try:
+            await save_update_state(tracker)
+        except Exception as e:
+            print(f"Could not save the update state: {e}")
 
-            booking_id = row[0]
-            await db.execute("UPDATE bookings SET comment = ? WHERE id = ?", ("", booking_id))
-            await db.commit()
 
-        await message.reply("Комментарий пропущен. Ваша запись подтверждена.")
+async def poll_updates(stop: asyncio.Event, tracker: UpdateTracker, dispatch):
+    """
+    Long-poll getUpdates until `stop` is set and hand each new update to
+    `dispatch`, after dispatching what the last run left unfinished. A batch
+    is stored (save_update_state) before it is dispatched, and only then does
+    the next call confirm it to Telegram; if storing fails the batch is not
+    dispatched and comes again.
+    """
+    allowed_updates = dp.resolve_used_update_types()
+    for raw in list(tracker.in_flight.values()):
+        dispatch(types.Update.model_validate_json(raw, context={"bot": bot}))
+    stopping = asyncio.ensure_future(stop.wait())
+    try:
+        while not stop.is_set():
+            fetch = asyncio.ensure_future(bot.get_updates(
+                offset=tracker.next_id, timeout=30, allowed_updates=allowed_updates, request_timeout=90
+            ))
+            await asyncio.wait({fetch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if not fetch.done():
+                fetch.cancel()
+                break
+            try:
+                updates = fetch.result()
+            except Exception as e:
+                print(f"Failed to fetch updates: {e}")
+                await asyncio.wait({stopping}, timeout=1)
+                continue
+            fresh = [update for update in updates if not tracker.known(update.update_id)]
+            if not fresh:
+                continue
+            # handled before an upgrade: confirm, but neither store nor dispatch
+            received = {
+                update.update_id: update.model_dump_json(exclude_unset=True, by_alias=True)
+                for update in fresh if update.update_id not in tracker.skip
+            }
+            if not received:
+                tracker.next_id = max(update.update_id for update in fresh) + 1
+                continue
+            try:
+                await save_update_state(tracker, received)
+            except Exception as e:
+                print(f"Could not store received updates, fetching them again: {e}")
+                await asyncio.wait({stopping}, timeout=1)
+                continue
+            for update in fresh:
+                if update.update_id in received:
+                    dispatch(update)
+    finally:
+        stopping.cancel()
+
+
+def install_stop_signals(stop: asyncio.Event):
+    """SIGTERM (docker stop, deploys) and Ctrl+C stop intake and start the drain."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+
+async def stop_background(deadline: float):
+    """
+    Finish queued writes and notifications, then stop background jobs. Sweepers,
+    broadcasts and backups pick up where they were after the restart.
+    """
+    try:
+        await asyncio.wait_for(audit.flush(), max(0.1, deadline - monotonic()))
+        if booking_store:
+            await asyncio.wait_for(booking_store.journal.flush(), max(0.1, deadline - monotonic()))
+    except asyncio.TimeoutError:
+        print("Drain: queued writes did not finish in time")
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # the sender is stopped; deliver what is due ourselves while time is left
+    while monotonic() < deadline:
+        try:
+            if not await asyncio.wait_for(drain_outbox(), max(0.1, deadline - monotonic())):
+                break
+        except Exception as e:
+            print(f"Drain: outbox not emptied: {e}")
+            break
+
+
+async def serve(stop: asyncio.Event):
+    """
+    Poll and handle updates in this process until `stop` is set; then drain
+    in-flight handlers and queues within DRAIN_TIMEOUT and save the resume point.
+    """
+    tracker = await load_update_tracker()
+    tasks = set()
+
+    def dispatch(update):
+        async def handle():
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                # a failing update is not retried after a restart either
+                print(f"Error handling update {update.update_id}: {e}")
+            tracker.finished(update.update_id)
+
+        task = asyncio.create_task(handle())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    spawn_background(update_checkpointer(tracker))
+    try:
+        await poll_updates(stop, tracker, dispatch)
+    finally:
+        deadline = monotonic() + DRAIN_TIMEOUT
+        print(f"Stopping: draining {len(tasks)} updates in flight")
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=DRAIN_TIMEOUT)
+        for task in list(tasks):
+            # past the deadline: these updates stay unfinished and come again after the restart
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stop_background(deadline)
+        await save_update_state(tracker)
+        print(f"Stopped; resuming from update {tracker.next_id}, {len(tracker.in_flight)} unfinished")
+
+
+def shard_for(update: types.Update, workers: int) -> int:
+    """
+    Pick the worker for an update. Updates of one user always land on the same
+    worker, which keeps their order and the per-user in-memory state
+    (pending_reviews, pending_range) consistent without sharing it between processes.
+    """
+    try:
+        event = update.event
+    except Exception:
+        return 0
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id % workers
+    chat = getattr(event, "chat", None)
+    return chat.id % workers if chat is not None else 0
+
+
+async def _worker_loop(index: int, queue, done_queue):
+    loop = asyncio.get_running_loop()
+    # updates run as tasks; UserOrderingMiddleware keeps each user's updates in order
+    tasks = set()
+
+    async def handle(update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"Worker {index}: error handling update {update.update_id}: {e}")
+        # the ingress advances its resume point over finished updates only
+        done_queue.put(update.update_id)
+
+    print(f"Worker {index} started (pid {os.getpid()})")
+    await load_config()
+    install_reload_signal()
+    # booking-flow holds live with the worker that owns the user
+    await slot_holds.load()
+    spawn_background(loop_monitor.run())
+    spawn_background(slot_holds.sweeper())
+    spawn_background(audit.flusher())
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            update = types.Update.model_validate_json(raw, context={"bot": bot})
+            task = asyncio.create_task(handle(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            print(f"Worker {index}: draining {len(tasks)} updates in flight")
+            await asyncio.wait(set(tasks), timeout=DRAIN_TIMEOUT)
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await audit.flush()
+        await bot.session.close()
+
+
+def _worker_process(index: int, queue, done_queue):
+    # the ingress decides when to stop: a worker drains after its queue's sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, queue, done_queue))
+
+
+def _take_done(done_queue):
+    """Block briefly for finished update ids from the workers; returns them all."""
+    try:
+        ids = [done_queue.get(timeout=0.5)]
+    except queue_module.Empty:
+        return []
+    while True:
+        try:
+            ids.append(done_queue.get_nowait())
+        except queue_module.Empty:
+            return ids
+
+
+async def run_ingress(queues, done_queue, procs) -> bool:
+    """
+    Single poller: fetch updates and hand each one to its user's worker queue.
+    Returns False if a worker died, which stops the whole bot: its shard's
+    updates would otherwise go unhandled.
+    """
+    await load_config()
+    # SIGHUP (sent by an operator or by a worker's /reload) reaches every process
+    install_reload_signal(forward_to=[proc.pid for proc in procs])
+    stop = asyncio.Event()
+    install_stop_signals(stop)
+    loop = asyncio.get_running_loop()
+
+    try:
+        await bot.delete_webhook(drop_pending_updates=False)
     except Exception as e:
-        print(f"Error in skip_comment: {e}")
-        await message.reply("❌ Ошибка")
+        print(f"Webhook cleanup: {e}")
 
-async def main():
+    # workers only queue notifications; the ingress process delivers them
+    spawn_background(outbox_sender())
+    spawn_background(resume_broadcasts())
+    if BACKUP_INTERVAL_HOURS > 0:
+        spawn_background(backup_scheduler())
+    spawn_background(waitlist_sweeper())
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        spawn_background(archive_scheduler())
+    spawn_background(review_digest_sender())
+
+    tracker = await load_update_tracker()
+
+    async def collect_done():
+        while True:
+            for update_id in await loop.run_in_executor(None, _take_done, done_queue):
+                tracker.finished(update_id)
+
+    def dispatch(update):
+        if recorder:
+            recorder.record(update)
+        queues[shard_for(update, len(queues))].put(update.model_dump_json(exclude_unset=True, by_alias=True))
+
+    failed = []
+
+    async def watch_workers():
+        while not stop.is_set():
+            await asyncio.sleep(1)
+            for index, proc in enumerate(procs):
+                if not proc.is_alive() and not stop.is_set():
+                    # its unfinished updates are not confirmed and come again after the restart
+                    print(f"❌ Worker {index} (pid {proc.pid}) exited with code {proc.exitcode}; stopping the bot")
+                    failed.append(index)
+                    stop.set()
+
+    spawn_background(collect_done())
+    spawn_background(watch_workers())
+    spawn_background(update_checkpointer(tracker))
+    print(f"✅ Bot started: ingress sharding updates over {len(queues)} workers")
+    try:
+        await poll_updates(stop, tracker, dispatch)
+    finally:
+        deadline = monotonic() + DRAIN_TIMEOUT
+        print(f"Stopping: waiting for {len(procs)} workers to drain")
+        for q in queues:
+            q.put(None)
+        for proc in procs:
+            await loop.run_in_executor(None, proc.join, max(0.1, deadline - monotonic()))
+        # workers are done; what they reported last is still queued
+        for update_id in _take_done(done_queue):
+            tracker.finished(update_id)
+        await stop_background(deadline)
+        await save_update_state(tracker)
+        print(f"Stopped; resuming from update {tracker.next_id}, {len(tracker.in_flight)} unfinished")
+        await bot.session.close()
+    return not failed
+
+
+def run_sharded(workers: int):
+    # the schema must exist before workers read config and holds from it
+    asyncio.run(init_db())
+    # workers are started before the ingress's event loop exists so forking is safe
+    queues = [multiprocessing.Queue() for _ in range(workers)]
+    done_queue = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=_worker_process, args=(i, q, done_queue), daemon=True)
+        for i, q in enumerate(queues)
+    ]
+    for proc in procs:
+        proc.start()
+    if not asyncio.run(run_ingress(queues, done_queue, procs)):
+        # non-zero exit so docker/systemd restart the bot with all its workers
+        sys.exit(1)
+
+
+async def startup(standalone: bool = True):
+    """
+    Everything main() does before polling. src/multibot.py runs it once per
+    hosted bot with standalone=False: the host owns the signal handlers and
+    the (process-wide) event-loop monitor.
+    """
     await init_db()
+    await load_config()
+    if standalone:
+        install_reload_signal()
+    if booking_store:
+        await booking_store.load()
+        spawn_background(booking_store.journal.run())
+    await occupancy.load()
+    await slot_holds.load()
     
-    # Delete any existing webhook to use polling instead
+    # Delete any existing webhook to use polling instead; updates sent while
+    # the bot was down are kept and handled now
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
+        await bot.delete_webhook(drop_pending_updates=False)
     except Exception as e:
         print(f"Webhook cleanup: {e}")
     
@@ -1100,12 +4844,36 @@ async def main():
     except Exception as e:
         print(f"Could not fetch bot identity: {e}")
 
+    spawn_background(outbox_sender())
+    spawn_background(resume_broadcasts())
+    if BACKUP_INTERVAL_HOURS > 0:
+        spawn_background(backup_scheduler())
+    spawn_background(waitlist_sweeper())
+    spawn_background(slot_holds.sweeper())
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        spawn_background(archive_scheduler())
+    spawn_background(review_digest_sender())
+    spawn_background(audit.flusher())
+    if standalone:
+        spawn_background(loop_monitor.run())
+
+
+async def main():
+    await startup()
+    stop = asyncio.Event()
+    install_stop_signals(stop)
     print("✅ Bot started")
-    await dp.start_polling(bot)
+    try:
+        await serve(stop)
+    finally:
+        await bot.session.close()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if WORKERS > 1:
+            run_sharded(WORKERS)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\n❌ Bot stopped")
     except Exception as e:
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Host several bots (one per master) in one process.
+
+    python3 src/multibot.py tenants.json
+
+tenants.json lists the bots; `env` sets any other variable from .env per bot:
+
+    [
+      {"name": "anna", "token": "123:ABC", "db_path": "data/anna.db", "admin_ids": "111"},
+      {"name": "vika", "token": "456:DEF", "db_path": "data/vika.db", "admin_ids": "222,333",
+       "env": {"MEMORY_STORE": "1"}}
+    ]
+
+src/bot.py is compiled once and executed in a separate module namespace per
+bot, so all of its module-level state (DB path, schedule, caches, in-memory
+maps, admins, counters) is per tenant, while the code objects, the event loop
+and the Bot API connection pool are shared. A tenant costs its own state plus
+one set of function objects.
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import types
+from pathlib import Path
+
+BOT_SOURCE = Path(__file__).resolve().with_name("bot.py")
+# seconds between per-tenant stats lines in the log; 0 disables
+STATS_INTERVAL = float(os.getenv("TENANT_STATS_INTERVAL", "600"))
+
+
+def read_tenants(path: str):
+    with open(path, encoding="utf-8") as f:
+        specs = json.load(f)
+    if not isinstance(specs, list) or not specs:
+        raise ValueError(f"{path}: expected a non-empty list of bots")
+    for field in ("name", "token", "db_path"):
+        values = [spec.get(field) for spec in specs]
+        if not all(values):
+            raise ValueError(f"{path}: every bot needs '{field}'")
+        if len(set(values)) != len(values):
+            raise ValueError(f"{path}: '{field}' must be unique")
+    for spec in specs:
+        if not spec["name"].isidentifier():
+            raise ValueError(f"{path}: bot name {spec['name']!r} must be a valid identifier")
+    return specs
+
+
+def load_tenant(code, spec):
+    """Run the compiled bot module with this tenant's environment; returns the module."""
+    env = {str(k): str(v) for k, v in spec.get("env", {}).items()}
+    env.update({
+        "BOT_TOKEN": spec["token"],
+        "DB_PATH": spec["db_path"],
+        "ADMIN_IDS": str(spec.get("admin_ids", "")),
+        "TENANT_NAME": spec["name"],
+        # tenants share this process; sharding across workers is per process
+        "WORKERS": "1",
+    })
+    name = f"src.tenant_{spec['name']}"
+    module = types.ModuleType(name)
+    module.__file__ = str(BOT_SOURCE)
+    # dataclasses look their module up in sys.modules
+    sys.modules[name] = module
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        exec(code, module.__dict__)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return module
+
+
+def load_tenants(specs):
+    code = compile(BOT_SOURCE.read_text(encoding="utf-8"), str(BOT_SOURCE), "exec")
+    tenants = [load_tenant(code, spec) for spec in specs]
+    # one connection pool for every token (sessions are not tied to a bot) and
+    # one event-loop monitor, since the loop is shared too
+    session = tenants[0].bot.session
+    for tenant in tenants[1:]:
+        tenant.bot.session = session
+        tenant.loop_monitor = tenants[0].loop_monitor
+    return tenants
+
+
+async def report_stats(tenants):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        for tenant in tenants:
+            print(f"[{tenant.TENANT_NAME}] {tenant.update_stats.summary()}, "
+                  f"background tasks {len(tenant.background_tasks)}, held seats {len(tenant.slot_holds.by_user)}")
+
+
+async def run(tenants):
+    for tenant in tenants:
+        await tenant.startup(standalone=False)
+    first = tenants[0]
+    first.spawn_background(first.loop_monitor.run())
+    if STATS_INTERVAL > 0:
+        first.spawn_background(report_stats(tenants))
+
+    loop = asyncio.get_running_loop()
+    # one stop for all: every bot stops intake, drains and saves its resume point
+    stop = asyncio.Event()
+
+    def reload_all():
+        print("SIGHUP: reloading admins and settings of every bot")
+        for tenant in tenants:
+            tenant.spawn_background(tenant.load_config())
+
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, reload_all)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f"✅ Hosting {len(tenants)} bots: {', '.join(t.TENANT_NAME for t in tenants)}")
+    try:
+        await asyncio.gather(*(tenant.serve(stop) for tenant in tenants))
+    finally:
+        await first.bot.session.close()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("usage: python3 src/multibot.py tenants.json")
+        sys.exit(2)
+    tenants = load_tenants(read_tenants(sys.argv[1]))
+    asyncio.run(run(tenants))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n❌ Bots stopped")
@@ -0,0 +1,108 @@
+"""
+Micro-benchmarks of the calendar keyboards (pytest-benchmark).
+
+Not collected by a plain `pytest` run; use the Makefile:
+
+    make bench-baseline   # store the reference run for this machine
+    make bench            # compare with it, fail on a regression above BENCH_THRESHOLD
+
+"cold" runs drop the month availability (or weekdays keyboard) cache first,
+as after a booking or a schedule change; "warm" runs are served from it.
+"""
+import asyncio
+import importlib
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+DB_SIZES = [0, 1_000, 100_000]
+
+
+def fill_db(path, n: int, slots):
+    """`n` bookings, two per day: two months ahead, the rest as history going back."""
+    con = sqlite3.connect(str(path))
+    con.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT, date TEXT, time TEXT, comment TEXT)")
+    first = datetime.now().date() + timedelta(days=60)
+    con.executemany(
+        "INSERT INTO bookings (user_id, name, date, time) VALUES (?, ?, ?, ?)",
+        (
+            (i, f"user{i}", (first - timedelta(days=i // 2)).strftime("%d.%m.%Y"), slots[i % 2 * 3])
+            for i in range(n)
+        )
+    )
+    con.commit()
+    con.close()
+
+
+@pytest.fixture(scope="module", params=DB_SIZES, ids=lambda n: f"{n}_bookings")
+def loaded_bot(request, tmp_path_factory):
+    db_file = tmp_path_factory.mktemp("bench") / "bookings.db"
+    mp = pytest.MonkeyPatch()
+    mp.setenv("DB_PATH", str(db_file))
+    mp.setenv("BOT_TOKEN", "123:ABC")
+    mp.setenv("ADMIN_IDS", "")
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    fill_db(db_file, request.param, bot.TIME_SLOTS)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(bot.init_db())
+    loop.run_until_complete(bot.load_config())
+    yield bot, loop
+    loop.close()
+    mp.undo()
+
+
+def run(bot, loop, coro):
+    result = loop.run_until_complete(coro)
+    # neighbour prefetches are part of what a calendar tap costs
+    loop.run_until_complete(asyncio.gather(*bot.background_tasks))
+    return result
+
+
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+@pytest.mark.parametrize("admin_mode", [False, True], ids=["user", "admin"])
+@pytest.mark.parametrize("months", [1, 2, 12])
+def test_build_calendar(benchmark, loaded_bot, months, admin_mode, cache):
+    bot, loop = loaded_bot
+
+    def render():
+        if cache == "cold":
+            bot.invalidate_availability()
+        return run(bot, loop, bot.build_calendar(months=months, admin_mode=admin_mode))
+
+    markup = benchmark(render)
+    assert markup.inline_keyboard
+
+
+def test_time_keyboard(benchmark, loaded_bot):
+    bot, _ = loaded_bot
+    day = (datetime.now().date() + timedelta(days=3)).isoformat()
+    assert benchmark(bot.time_keyboard, day).inline_keyboard
+
+
+def test_month_picker(benchmark, loaded_bot):
+    bot, _ = loaded_bot
+    assert len(benchmark(bot.month_picker, datetime.now().year, True).inline_keyboard) == 4
+
+
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+def test_admin_keyboards(benchmark, loaded_bot, cache):
+    bot, _ = loaded_bot
+    # compiling the schedule is not part of drawing the keyboards: publish once
+    current = bot.publish_schedule()
+
+    def render():
+        if cache == "cold":
+            # as after a schedule change: the weekdays keyboard is drawn anew
+            bot._weekdays_keyboard_cache.clear()
+        return bot.admin_keyboard(), bot.weekdays_keyboard(current)
+
+    admin, weekdays = benchmark(render)
+    assert admin.inline_keyboard and weekdays.inline_keyboard
@@ -0,0 +1,50 @@
+import importlib
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_archive_moves_past_bookings_in_batches(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("REVIEWS_KEEP_LIVE", "2")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    old = (datetime.now() - timedelta(days=60)).strftime("%d.%m.%Y")
+    future = (datetime.now() + timedelta(days=5)).strftime("%d.%m.%Y")
+    legacy_iso = (datetime.now() - timedelta(days=90)).date().isoformat()
+    async with bot.db_write() as db:
+        for i in range(5):
+            await db.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (?, ?, ?, '10:00')", (i, f"old{i}", old))
+        await db.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (9, 'legacy', ?, '11:00')", (legacy_iso,))
+        await db.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (10, 'future', ?, '12:00')", (future,))
+        for i in range(4):
+            await db.execute("INSERT INTO reviews (user_id, name, text) VALUES (?, 'r', ?)", (i, f"review{i}"))
+
+    moved = await bot.archive_old_records(cutoff_days=30, batch_size=2)
+    assert moved == (6, 2)
+
+    async with bot.db_connect() as db:
+        live = await (await db.execute("SELECT name FROM bookings")).fetchall()
+        reviews = await (await db.execute("SELECT text FROM reviews ORDER BY id")).fetchall()
+    assert live == [("future",)]
+    assert reviews == [("review2",), ("review3",)]
+
+    # the archive is queryable by exact date, by month and by name
+    assert len(await bot.query_archive(old)) == 5
+    assert len(await bot.query_archive(old[3:])) >= 5
+    assert [r[1] for r in await bot.query_archive("legacy")] == ["legacy"]
+
+    # a second run has nothing left to move
+    assert await bot.archive_old_records(cutoff_days=30, batch_size=2) == (0, 0)
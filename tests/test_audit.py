@@ -0,0 +1,49 @@
+import importlib
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_audit_entries_are_batched_and_queryable(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    bot.audit.record(1, "cancel", 42, "A 01.02.2030 10:00")
+    bot.audit.record(2, "block", details="2030-02-03")
+    bot.audit.record(1, "move", 43, "B 01.02.2030 → 02.02.2030")
+    # recording does not touch the DB
+    async with bot.db_connect() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM audit_log")
+        assert (await cursor.fetchone())[0] == 0
+
+    assert await bot.audit.flush() == 3
+    assert await bot.audit.flush() == 0
+
+    assert [r[2] for r in await bot.query_audit(admin_id=1)] == ["move", "cancel"]
+    assert [r[2] for r in await bot.query_audit(booking_id=42)] == ["cancel"]
+    today = datetime.now().date().isoformat()
+    assert len(await bot.query_audit(since=today, until=today)) == 3
+    assert await bot.query_audit(since="2000-01-01", until="2000-01-02") == []
+    # queries flush what is still buffered
+    bot.audit.record(2, "unblock", details="2030-02-03")
+    assert [r[2] for r in await bot.query_audit(admin_id=2)] == ["unblock", "block"]
+
+    assert bot.parse_audit_query("admin 5") == {"admin_id": 5}
+    assert bot.parse_audit_query("01.02.2030 03.02.2030") == {"since": "2030-02-01", "until": "2030-02-03"}
+    with pytest.raises(ValueError):
+        bot.parse_audit_query("who knows")
+    async with bot.db_connect() as db:
+        cursor = await db.execute("EXPLAIN QUERY PLAN SELECT * FROM audit_log WHERE booking_id = 42")
+        assert "idx_audit_booking" in " ".join(str(r) for r in await cursor.fetchall())
@@ -0,0 +1,38 @@
+import importlib
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_backup_is_consistent_and_rotated(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    backup_dir = tmp_path / "backups"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    async with bot.db_write() as db:
+        await db.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'A', '01.01.2030', '10:00')")
+
+    paths = []
+    for _ in range(3):
+        path, result = await bot.backup_database(directory=str(backup_dir), keep=2)
+        assert result == "ok"
+        paths.append(path)
+
+    # only the two newest backups are kept, no partial files are left behind
+    assert sorted(p.name for p in backup_dir.iterdir()) == sorted(Path(p).name for p in paths[1:])
+
+    con = sqlite3.connect(paths[-1])
+    assert con.execute("SELECT name, date FROM bookings").fetchall() == [("A", "01.01.2030")]
+    con.close()
@@ -0,0 +1,102 @@
+import asyncio
+import importlib
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_broadcast_streams_distinct_clients_and_resumes(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("BROADCAST_CHUNK", "2")
+    monkeypatch.setenv("BROADCAST_RATE", "1000")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    from aiogram.exceptions import TelegramForbiddenError
+    from aiogram.methods import SendMessage
+
+    await bot.init_db()
+
+    con = sqlite3.connect(str(db_file))
+    for user_id, date in [(1, "01.01.2024"), (1, "01.06.2024"), (2, "01.01.2023"), (4, "01.03.2024"), (5, "01.05.2024"), (6, "01.07.2024")]:
+        con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (?, 'x', ?, '10:00')", (user_id, date))
+    # archived visits count too; user 3 blocked the bot earlier
+    con.execute("INSERT INTO bookings_archive (id, user_id, name, date, time) VALUES (100, 7, 'x', '01.08.2024', '10:00')")
+    # a client with live and archived visits is listed once; an old archived visit does not drop a recent live one
+    con.execute("INSERT INTO bookings_archive (id, user_id, name, date, time) VALUES (101, 6, 'x', '01.01.2020', '10:00')")
+    con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (3, 'x', '01.01.2024', '10:00')")
+    con.execute("INSERT INTO blocked_users (user_id) VALUES (3)")
+    con.commit()
+    con.close()
+
+    assert await bot.broadcast_recipients(0, limit=100) == [1, 2, 4, 5, 6, 7]
+    assert await bot.broadcast_recipients(4, limit=100) == [5, 6, 7]
+    assert await bot.broadcast_recipients(0, since="2024-05-01", limit=100) == [1, 5, 6, 7]
+
+    sent = []
+
+    async def fake_send(chat_id, text, reply_markup=None):
+        if chat_id == 5:
+            raise TelegramForbiddenError(method=SendMessage(chat_id=chat_id, text=text), message="Forbidden: bot was blocked by the user")
+        sent.append(chat_id)
+
+    monkeypatch.setattr(bot.bot, "send_message", fake_send)
+
+    # a broadcast interrupted after user 2 picks up from there
+    async with bot.db_write() as db:
+        await db.execute("INSERT INTO broadcasts (id, admin_id, text, last_user_id, sent) VALUES (1, 99, 'news', 2, 2)")
+    await bot.run_broadcast(1)
+
+    assert sent == [4, 6, 7]
+    con = sqlite3.connect(str(db_file))
+    assert con.execute("SELECT status, sent, failed FROM broadcasts WHERE id = 1").fetchone() == ("done", 5, 1)
+    assert con.execute("SELECT user_id FROM blocked_users ORDER BY user_id").fetchall() == [(3,), (5,)]
+    # the admin is told through the outbox
+    assert con.execute("SELECT chat_id FROM outbox").fetchall() == [(99,)]
+    con.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_broadcasts_share_one_send_rate(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("BROADCAST_RATE", "50")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    con = sqlite3.connect(str(db_file))
+    for user_id in range(1, 11):
+        con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (?, 'x', '01.01.2024', '10:00')", (user_id,))
+    con.execute("INSERT INTO broadcasts (id, admin_id, text) VALUES (1, 99, 'one')")
+    con.execute("INSERT INTO broadcasts (id, admin_id, text) VALUES (2, 99, 'two')")
+    con.commit()
+    con.close()
+
+    sent_at = []
+
+    async def fake_send(chat_id, text, reply_markup=None):
+        sent_at.append(bot.monotonic())
+
+    monkeypatch.setattr(bot.bot, "send_message", fake_send)
+
+    # 20 broadcast messages and the 2 completion notices go through the outbox, all at 50/s
+    await asyncio.gather(bot.run_broadcast(1), bot.run_broadcast(2))
+    await bot.drain_outbox()
+    assert len(sent_at) == 22
+    assert sent_at[-1] - sent_at[0] >= 21 / 50 * 0.9
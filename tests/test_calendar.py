@@ -1,3 +1,4 @@
+import asyncio
 import os
 import importlib
 import sqlite3
@@ -22,6 +23,16 @@ async def test_build_calendar_marks(tmp_path, monkeypatch):
     )''')
     cur.execute('''CREATE TABLE blocked_dates (date TEXT PRIMARY KEY)''')
     cur.execute('''CREATE TABLE closed_weekdays (weekday INTEGER PRIMARY KEY)''')
+    cur.execute('''CREATE TABLE waitlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        name TEXT,
+        date TEXT,
+        joined_at REAL,
+        status TEXT DEFAULT 'waiting',
+        offered_time TEXT,
+        offer_expires_at REAL
+    )''')
     con.commit()
 
     today = datetime.now().date()
@@ -76,3 +87,43 @@ async def test_build_calendar_marks(tmp_path, monkeypatch):
     assert any('🔴' in t for t in texts), "Expected a full-day mark (🔴)"
     # - one-slot day -> contains '(1/2)'
     assert any('(1/2)' in t for t in texts), "Expected a (1/2) mark"
+
+    # let the neighbour prefetches finish before the event loop closes
+    await asyncio.gather(*bot.background_tasks)
+
+
+@pytest.mark.asyncio
+async def test_windowed_calendar_pages_within_horizon(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    from pathlib import Path
+    import sys
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    today = datetime.now().date()
+    first = await bot.build_calendar(months=1, horizon=12)
+    # only one month is rendered; there is no way back before the current month
+    assert len(first.inline_keyboard) <= 12
+    nav_row = first.inline_keyboard[-2]
+    assert nav_row[0].callback_data == "noop"
+    assert nav_row[2].callback_data.startswith("cal_month_")
+    assert nav_row[2].callback_data.endswith("_1_0_12")
+
+    # the last month of the horizon has no ▶️
+    last_year, last_month = bot.shift_month(today.year, today.month, 12)
+    last = await bot.build_calendar(year=last_year, month=last_month, months=1, horizon=12)
+    nav_row = last.inline_keyboard[-2]
+    assert nav_row[2].callback_data == "noop"
+    # the size of a page does not depend on the horizon
+    assert len(last.inline_keyboard) <= 12
+
+    # let the neighbour prefetches finish before the event loop closes
+    await asyncio.gather(*bot.background_tasks)
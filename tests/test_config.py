@@ -0,0 +1,48 @@
+import importlib
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_admins_and_settings_reload_from_db(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "1")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+    await bot.load_config()
+    assert bot.is_admin(1) and not bot.is_admin(2)
+
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    con = sqlite3.connect(str(db_file))
+    con.execute("INSERT INTO admins (user_id) VALUES (2)")
+    con.execute("INSERT INTO settings (key, value) VALUES ('slots', '9:30,18:00')")
+    con.execute("INSERT INTO settings (key, value) VALUES ('capacity', 'lots')")
+    con.execute("INSERT INTO settings (key, value) VALUES ('contact', 'call me')")
+    con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (5, 'A', ?, '18:00')", (tomorrow.strftime("%d.%m.%Y"),))
+    con.commit()
+    con.close()
+
+    # nothing changes until a reload
+    assert not bot.is_admin(2)
+    await bot.occupancy.load()
+    assert await bot.reload_config()
+
+    assert bot.is_admin(1) and bot.is_admin(2)
+    assert bot.config.contact == "call me"
+    assert bot.schedule.slots == ("09:30", "18:00")
+    # an invalid stored value falls back to the default instead of breaking the bot
+    assert bot.schedule.capacity == bot.DAILY_CAPACITY
+    # the occupancy map follows the new slot layout on its next use
+    await bot.occupancy.ensure_current()
+    assert bot.occupancy.free_slots(tomorrow) == ["09:30"]
@@ -0,0 +1,42 @@
+import importlib
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_deep_link_and_slot_picker(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    assert bot.parse_deep_link("book_2030-12-31") == (date(2030, 12, 31), None)
+    assert bot.parse_deep_link("book_20301231_1000") == (date(2030, 12, 31), "10:00")
+    assert bot.parse_deep_link("book_2030-13-01") is None
+    assert bot.parse_deep_link("promo") is None
+
+    day = datetime.now().date() + timedelta(days=2)
+    con = sqlite3.connect(str(db_file))
+    con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'A', ?, ?)", (day.strftime("%d.%m.%Y"), bot.TIME_SLOTS[0]))
+    con.commit()
+    con.close()
+
+    text, markup = await bot.slot_picker(day)
+    callbacks = [btn.callback_data for row in markup.inline_keyboard for btn in row]
+    # the taken slot is not offered, the others book straight from the picker
+    assert f"time_{day.isoformat()}_{bot.TIME_SLOTS[0]}" not in callbacks
+    assert f"time_{day.isoformat()}_{bot.TIME_SLOTS[1]}" in callbacks
+    # neighbouring bookable days are one tap away
+    assert f"pick_{(day + timedelta(days=1)).isoformat()}" in callbacks
+    assert f"pick_{(day - timedelta(days=1)).isoformat()}" in callbacks
@@ -0,0 +1,111 @@
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_slow_update_does_not_hold_up_polling_and_survives_a_restart(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    stop = asyncio.Event()
+    offsets = []
+    # Telegram's side: updates stay until a call asks for a higher offset
+    server = [5, 6, 7]
+
+    async def get_updates(offset=None, **kwargs):
+        offsets.append(offset)
+        if offset is not None:
+            server[:] = [update_id for update_id in server if update_id >= offset]
+        if offset == 8:
+            # arrives while 6 is still running
+            server.append(8)
+        if len(offsets) > 2 or offset == 10:
+            asyncio.get_running_loop().call_soon(stop.set)
+        if server:
+            return [bot.types.Update(update_id=update_id) for update_id in server]
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(bot.bot, "get_updates", get_updates)
+
+    tracker = await bot.load_update_tracker()
+    seen = []
+
+    def dispatch(update):
+        seen.append(update.update_id)
+        if update.update_id != 6:
+            tracker.finished(update.update_id)
+
+    # 6 is still running: the next polls confirm it anyway and go on with 8
+    await asyncio.wait_for(bot.poll_updates(stop, tracker, dispatch), 5)
+    assert seen == [5, 6, 7, 8] and offsets == [None, 8, 9]
+    assert server == []
+    await bot.save_update_state(tracker)
+
+    # after the restart only 6 is handled again, from its stored copy
+    tracker = await bot.load_update_tracker()
+    assert tracker.next_id == 9 and list(tracker.in_flight) == [6]
+    offsets.clear()
+    seen.clear()
+    stop.clear()
+    server.append(9)
+
+    def handle_all(update):
+        seen.append(update.update_id)
+        tracker.finished(update.update_id)
+
+    await asyncio.wait_for(bot.poll_updates(stop, tracker, handle_all), 5)
+    assert seen == [6, 9] and offsets == [9, 10]
+    await bot.save_update_state(tracker)
+    tracker = await bot.load_update_tracker()
+    assert tracker.in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_updates_are_not_dispatched_unless_stored(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    stop = asyncio.Event()
+    offsets = []
+
+    async def get_updates(offset=None, **kwargs):
+        offsets.append(offset)
+        if len(offsets) > 1:
+            asyncio.get_running_loop().call_soon(stop.set)
+        return [bot.types.Update(update_id=3)]
+
+    real_save = bot.save_update_state
+    failures = [RuntimeError("database is locked")]
+
+    async def flaky_save(tracker, received=None):
+        if received and failures:
+            raise failures.pop()
+        await real_save(tracker, received)
+
+    monkeypatch.setattr(bot.bot, "get_updates", get_updates)
+    monkeypatch.setattr(bot, "save_update_state", flaky_save)
+    tracker = bot.UpdateTracker()
+    seen = []
+    # the first store fails: 3 is not confirmed, and handled once it is stored
+    await asyncio.wait_for(bot.poll_updates(stop, tracker, lambda u: seen.append(u.update_id)), 5)
+    assert offsets == [None, None] and seen == [3] and tracker.next_id == 4
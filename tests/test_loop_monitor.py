@@ -0,0 +1,39 @@
+import asyncio
+import importlib
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_reports_blocking_call(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test_bookings.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+
+    monitor = bot.LoopLagMonitor(interval=0.01, threshold=0.1)
+    task = asyncio.create_task(monitor.run())
+    try:
+        await asyncio.sleep(0.05)
+
+        def blocking_handler():
+            time.sleep(0.3)
+
+        blocking_handler()
+        await asyncio.sleep(0.05)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert monitor.stalls == 1
+    assert monitor.percentiles()["max"] >= 250
+    # the sampled stack points at the code that blocked the loop
+    assert "blocking_handler" in capsys.readouterr().out
@@ -0,0 +1,124 @@
+import asyncio
+import importlib
+import sqlite3
+import sys
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_memory_store_group_commits_writes(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("MEMORY_STORE", "1")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    con = sqlite3.connect(str(db_file))
+    con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'A', '01.01.2030', '10:00')")
+    con.commit()
+    con.close()
+
+    store = bot.booking_store
+    await store.load()
+    journal = asyncio.create_task(store.journal.run())
+    try:
+        day = date(2030, 1, 1)
+        assert bot.booking_store.check_slot(day, "10:00", [], 2) == "Это время уже занято"
+        assert bot.booking_store.check_slot(day, "11:00", [None], 2) is not None
+        assert await bot.month_availability(2030, 1) == {"2030-01-01": 1}
+
+        # concurrent writes share transactions
+        ids = await asyncio.gather(*(store.add(100 + i, "u", "02.01.2030", "12:00") for i in range(20)))
+        assert len(set(ids)) == 20
+        assert store.journal.commits < 20
+
+        row, promoted = await bot.cancel_booking(ids[0], notice="cancelled {date} {time}")
+        assert row[1] == 100 and not promoted
+        assert await bot.set_pending_comment(101, "hi") == ids[1]
+
+        # a failing write is rolled back alone and memory is resynced from the DB
+        async def broken(db):
+            raise RuntimeError("disk full")
+
+        # a booking made while memory is being reloaded is in memory afterwards too
+        reloads = []
+        late = []
+
+        async def reload():
+            reloads.append(len(store.journal._queue))
+            if not late:
+                late.append(asyncio.create_task(store.add(555, "late", "03.01.2030", "11:00")))
+            await store.load()
+
+        store.journal.on_failure = reload
+        with pytest.raises(RuntimeError):
+            await store.add(999, "x", "03.01.2030", "10:00", then=broken)
+        assert 999 not in store.by_user
+        await late[0]
+        assert reloads == [0, 0] and 555 in store.by_user
+    finally:
+        journal.cancel()
+        await asyncio.gather(journal, return_exceptions=True)
+
+    con = sqlite3.connect(str(db_file))
+    assert con.execute("SELECT COUNT(*) FROM bookings WHERE date = '02.01.2030'").fetchone()[0] == 19
+    assert con.execute("SELECT comment FROM bookings WHERE id = ?", (ids[1],)).fetchone()[0] == "hi"
+    assert con.execute("SELECT COUNT(*) FROM bookings WHERE user_id = 999").fetchone()[0] == 0
+    assert con.execute("SELECT text FROM outbox").fetchall() == [("cancelled 02.01.2030 12:00",)]
+    con.close()
+
+
+@pytest.mark.asyncio
+async def test_journal_survives_a_failed_reload(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test_bookings.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("MEMORY_STORE", "1")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    store = bot.booking_store
+    await store.load()
+    reloads = []
+
+    async def reload():
+        reloads.append(len(store.bookings))
+        if len(reloads) == 1:
+            raise RuntimeError("database is locked")
+        await store.load()
+
+    async def broken(db):
+        raise RuntimeError("disk full")
+
+    store.journal.on_failure = reload
+    store.journal.resync_delay = 0.05
+    journal = asyncio.create_task(store.journal.run())
+    try:
+        # the writer is answered although the reload failed, and later writes still commit
+        with pytest.raises(RuntimeError, match="disk full"):
+            await asyncio.wait_for(store.add(999, "x", "03.01.2030", "10:00", then=broken), 5)
+        assert await asyncio.wait_for(store.add(1, "a", "03.01.2030", "11:00"), 5)
+        # the retried reload drops the failed write from memory
+        for _ in range(100):
+            if 999 not in store.by_user:
+                break
+            await asyncio.sleep(0.02)
+        assert 999 not in store.by_user and 1 in store.by_user and len(reloads) == 2
+    finally:
+        journal.cancel()
+        await asyncio.gather(journal, return_exceptions=True)
@@ -0,0 +1,159 @@
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+def load_bot(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test_bookings.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+    import src.bot as bot
+    importlib.reload(bot)
+    return bot
+
+
+class FakeCall:
+    def __init__(self, user_id, data, message_id=1):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = SimpleNamespace(message_id=message_id)
+        self.data = data
+        self.answered = 0
+
+    async def answer(self, *args, **kwargs):
+        self.answered += 1
+
+
+@pytest.mark.asyncio
+async def test_user_ordering_serializes_per_user_only(tmp_path, monkeypatch):
+    bot = load_bot(tmp_path, monkeypatch)
+    mw = bot.UserOrderingMiddleware()
+    log = []
+
+    async def handler(event, data):
+        log.append(("start", event))
+        await asyncio.sleep(0.01)
+        log.append(("end", event))
+
+    def data_for(user_id):
+        return {"event_from_user": SimpleNamespace(id=user_id)}
+
+    await asyncio.gather(
+        mw(handler, "a1", data_for(1)),
+        mw(handler, "a2", data_for(1)),
+        mw(handler, "b1", data_for(2)),
+    )
+
+    # user 1 updates never overlap, user 2 runs alongside them
+    assert log.index(("end", "a1")) < log.index(("start", "a2"))
+    assert log.index(("start", "b1")) < log.index(("end", "a1"))
+    # lock map is empty once nothing is in flight
+    assert mw._locks == {}
+
+
+@pytest.mark.asyncio
+async def test_duplicate_tap_is_dropped(tmp_path, monkeypatch):
+    bot = load_bot(tmp_path, monkeypatch)
+    mw = bot.DuplicateTapMiddleware(window=60)
+    calls = []
+
+    async def handler(event, data):
+        calls.append(event.data)
+
+    first = FakeCall(1, "cal_day_2030-01-01_0")
+    second = FakeCall(1, "cal_day_2030-01-01_0")
+    other_user = FakeCall(2, "cal_day_2030-01-01_0")
+
+    await mw(handler, first, {})
+    await mw(handler, second, {})
+    await mw(handler, other_user, {})
+
+    assert calls == ["cal_day_2030-01-01_0", "cal_day_2030-01-01_0"]
+    # the dropped tap is still answered so the client stops spinning
+    assert second.answered == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_middleware_honours_retry_after(tmp_path, monkeypatch):
+    bot = load_bot(tmp_path, monkeypatch)
+    from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
+    from aiogram.methods import GetMe, SendMessage
+
+    method = SendMessage(chat_id=1, text="x")
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(bot.asyncio, "sleep", fake_sleep)
+    attempts = []
+
+    async def flaky(b, m):
+        attempts.append(m)
+        if len(attempts) == 1:
+            raise TelegramRetryAfter(method=m, message="Flood control", retry_after=3)
+        return "ok"
+
+    mw = bot.RetryMiddleware(max_retries=2)
+    assert await mw(flaky, None, method) == "ok"
+    assert sleeps == [3]
+
+    async def bad_request(b, m):
+        attempts.append(m)
+        raise TelegramBadRequest(method=m, message="Bad Request: chat not found")
+
+    attempts.clear()
+    with pytest.raises(TelegramBadRequest):
+        await mw(bad_request, None, method)
+    # client errors are not retried
+    assert len(attempts) == 1
+
+    async def lost_response(b, m):
+        attempts.append(m)
+        raise TelegramNetworkError(method=m, message="Request timeout error")
+
+    # a send whose response was lost may have been delivered: not sent twice
+    attempts.clear()
+    with pytest.raises(TelegramNetworkError):
+        await mw(lost_response, None, method)
+    assert len(attempts) == 1
+    # reads are safe to repeat
+    attempts.clear()
+    with pytest.raises(TelegramNetworkError):
+        await mw(lost_response, None, GetMe())
+    assert len(attempts) == 3
+
+
+@pytest.mark.asyncio
+async def test_throttle_token_bucket_per_user_and_class(tmp_path, monkeypatch):
+    bot = load_bot(tmp_path, monkeypatch)
+    mw = bot.ThrottleMiddleware(limits={"nav": (3, 1.0), "heavy": (2, 0.5), "text": (1, 1.0)})
+
+    # the burst passes, then the user is refused; only the first refusal is reported
+    assert [mw.allow(1, "heavy", now=0.0) for _ in range(4)] == [(True, False), (True, False), (False, True), (False, False)]
+    # other classes and other users have their own buckets
+    assert mw.allow(1, "nav", now=0.0) == (True, False)
+    assert mw.allow(2, "heavy", now=0.0) == (True, False)
+    # tokens come back at the class rate
+    assert mw.allow(1, "heavy", now=1.0)[0] is False
+    assert mw.allow(1, "heavy", now=2.0)[0] is True
+
+    # buckets that refilled completely are forgotten
+    mw._prune(100.0)
+    assert mw._buckets == {}
+
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.data)
+
+    data = {"event_from_user": bot.types.User(id=5, is_bot=False, first_name="u")}
+    for _ in range(3):
+        await mw(handler, FakeCall(5, "range_full"), data)
+    assert handled == ["range_full", "range_full"]
+    assert bot.throttle_class(FakeCall(5, "cal_disabled")) == "nav"
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_tenants_share_code_but_not_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "unused.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    from src import multibot
+
+    config = tmp_path / "tenants.json"
+    config.write_text(json.dumps([
+        {"name": "anna", "token": "1:AAA", "db_path": str(tmp_path / "anna.db"), "admin_ids": "11"},
+        {"name": "vika", "token": "2:BBB", "db_path": str(tmp_path / "vika.db"), "admin_ids": "22",
+         "env": {"THROTTLE_ENABLED": "0"}},
+    ]))
+    anna, vika = multibot.load_tenants(multibot.read_tenants(str(config)))
+
+    # one copy of the code and one connection pool, separate state
+    assert anna.time_selected.__code__ is vika.time_selected.__code__
+    assert anna.bot.session is vika.bot.session
+    assert anna.bot.token != vika.bot.token
+    assert anna.dp is not vika.dp and anna.occupancy is not vika.occupancy
+    assert anna.THROTTLE_ENABLED and not vika.THROTTLE_ENABLED
+
+    for tenant in (anna, vika):
+        await tenant.init_db()
+        await tenant.load_config()
+    assert anna.is_admin(11) and not anna.is_admin(22)
+    assert vika.is_admin(22) and not vika.is_admin(11)
+
+    # the tenant's environment is gone once its module is loaded
+    assert os.environ["BOT_TOKEN"] == "123:ABC"
+
+    async with anna.db_write() as db:
+        await db.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'A', '01.02.2030', '10:00')")
+    assert len(await anna.all_bookings()) == 1
+    assert await vika.all_bookings() == []
+
+    anna.publish_schedule(closed_weekdays=frozenset({0}))
+    assert anna.schedule.closed_weekdays == {0} and vika.schedule.closed_weekdays == frozenset()
+
+    # configs need unique names, tokens and databases
+    config.write_text(json.dumps([
+        {"name": "a", "token": "1:A", "db_path": "x.db"},
+        {"name": "b", "token": "2:B", "db_path": "x.db"},
+    ]))
+    with pytest.raises(ValueError):
+        multibot.read_tenants(str(config))
@@ -0,0 +1,57 @@
+import importlib
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_own_bookings_upcoming_first_and_self_service(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    past = (datetime.now().date() - timedelta(days=3)).strftime("%d.%m.%Y")
+    con = sqlite3.connect(str(db_file))
+    con.executemany(
+        "INSERT INTO bookings (user_id, name, date, time) VALUES (?, ?, ?, ?)",
+        [(1, "A", "05.02.2030", "11:00"), (1, "A", past, "10:00"), (1, "A", "01.02.2030", "12:00"),
+         (2, "B", "01.02.2030", "10:00"), (2, "B", "06.02.2030", "10:00")]
+    )
+    con.commit()
+    con.close()
+
+    rows = await bot.user_bookings(1)
+    assert [(r[1], r[4]) for r in rows] == [("01.02.2030", True), ("05.02.2030", True), (past, False)]
+
+    # someone else's booking and past bookings cannot be touched
+    assert await bot.own_upcoming_booking(4, 1) is None
+    assert await bot.own_upcoming_booking(2, 1) is None
+    row, error = await bot.reschedule_booking(4, 1, date(2030, 2, 7), "10:00")
+    assert row is None and error
+
+    # the new slot goes through the same checks as a new booking
+    row, error = await bot.reschedule_booking(3, 1, date(2030, 2, 1), "10:00")
+    assert row is None and error == "Это время уже занято"
+    row, error = await bot.reschedule_booking(3, 1, date(2030, 2, 6), "14:00")
+    assert error is None and row[3] == "01.02.2030"
+    async with bot.db_connect() as db:
+        cursor = await db.execute("SELECT date, time FROM bookings WHERE id = 3")
+        assert await cursor.fetchone() == ("06.02.2030", "14:00")
+    # 06.02 is now full (capacity 2), even for a move
+    row, error = await bot.reschedule_booking(1, 1, date(2030, 2, 6), "15:00")
+    assert error == "На эту дату уже записано максимальное количество людей"
+
+    row, _ = await bot.cancel_booking(1)
+    assert row[3] == "05.02.2030"
+    assert [r[1] for r in await bot.user_bookings(1)] == ["06.02.2030", past]
@@ -0,0 +1,61 @@
+import importlib
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_nearest_free_skips_unavailable_days(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    today = datetime.now().date()
+    day1 = today + timedelta(days=1)
+    day2 = today + timedelta(days=2)
+    day3 = today + timedelta(days=3)
+
+    con = sqlite3.connect(str(db_file))
+    # day1 is blocked, day2 is full, day3 has its first slot taken
+    con.execute("INSERT INTO blocked_dates (date) VALUES (?)", (day1.isoformat(),))
+    for t in bot.TIME_SLOTS[:bot.DAILY_CAPACITY]:
+        con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'A', ?, ?)", (day2.strftime("%d.%m.%Y"), t))
+    con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (2, 'B', ?, ?)", (day3.strftime("%d.%m.%Y"), bot.TIME_SLOTS[0]))
+    # every day except the ones above is closed, so day3 is the only candidate
+    for wd in range(7):
+        if wd not in (day1.weekday(), day2.weekday(), day3.weekday()):
+            con.execute("INSERT INTO closed_weekdays (weekday) VALUES (?)", (wd,))
+    con.commit()
+    con.close()
+
+    occ = bot.OccupancyMap(horizon_days=4)
+    await occ.load()
+    # start the search at the beginning of tomorrow so the result does not depend on the clock
+    start = datetime.combine(day1, datetime.min.time())
+
+    slots = occ.nearest_free(2, now=start)
+    assert slots == [(day3, bot.TIME_SLOTS[1]), (day3, bot.TIME_SLOTS[2])]
+
+    # another user's hold takes day3's last seat
+    held = {day3: [None]}
+    assert occ.nearest_free(2, now=start, held=lambda d: held.get(d, [])) == []
+    held = {day3: [bot.TIME_SLOTS[1]]}
+    assert occ.nearest_free(10, now=start, held=lambda d: held.get(d, [])) == []
+
+    # handlers keep the map current without a reload
+    occ.book(day3, bot.TIME_SLOTS[1])
+    assert occ.nearest_free(10, now=start) == []
+    occ.unbook(day3, bot.TIME_SLOTS[1])
+    bot.publish_schedule(blocked=bot.schedule.blocked - {day1})
+    assert occ.nearest_free(1, now=start) == [(day1, bot.TIME_SLOTS[0])]
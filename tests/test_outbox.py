@@ -0,0 +1,60 @@
+import importlib
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_outbox_delivers_and_retries(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+    from aiogram.methods import SendMessage
+
+    await bot.init_db()
+
+    # a notification queued in a rolled back transaction must not survive
+    with pytest.raises(RuntimeError):
+        async with bot.db_write() as db:
+            await bot.enqueue_notification(db, 1, "lost")
+            raise RuntimeError("booking change failed")
+
+    async with bot.db_write() as db:
+        await bot.enqueue_notification(db, 1, "ok")
+        await bot.enqueue_notification(db, 2, "blocked")
+        await bot.enqueue_notification(db, 3, "flaky")
+
+    sent = []
+
+    async def fake_send(chat_id, text, reply_markup=None):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id == 2:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if chat_id == 3:
+            raise TelegramNetworkError(method=method, message="timeout")
+        sent.append((chat_id, text))
+
+    monkeypatch.setattr(bot.bot, "send_message", fake_send)
+
+    assert await bot.drain_outbox() == 3
+    assert sent == [(1, "ok")]
+
+    con = sqlite3.connect(str(db_file))
+    rows = {r[0]: r[1:] for r in con.execute("SELECT chat_id, status, attempts FROM outbox")}
+    con.close()
+    # delivered message is removed, blocked user is given up on, network error is retried later
+    assert 1 not in rows
+    assert rows[2] == ("failed", 1)
+    assert rows[3] == ("pending", 1)
+    # the retry is scheduled in the future, so nothing is due right now
+    assert await bot.drain_outbox() == 0
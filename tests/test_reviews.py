@@ -0,0 +1,126 @@
+import importlib
+import json
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_reviews_are_published_after_moderation(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "7,8")
+    monkeypatch.setenv("REVIEW_DIGEST_SIZE", "3")
+    monkeypatch.setenv("REVIEWS_KEEP_LIVE", "1")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+    await bot.load_config()
+
+    async with bot.db_write() as db:
+        # written before moderation existed: already public
+        await db.execute("INSERT INTO reviews (user_id, name, text) VALUES (1, 'old', 'legacy')")
+        for i in range(4):
+            await db.execute(
+                "INSERT INTO reviews (user_id, name, text, status) VALUES (?, ?, ?, 'pending')", (i, f"u{i}", f"text{i}")
+            )
+
+    page = await bot.reviews_page()
+    assert "legacy" in page and "text0" not in page
+
+    # one message per admin for a whole batch, then the rest in the next digest
+    assert await bot.send_review_digest() == 3
+    assert await bot.send_review_digest() == 1
+    assert await bot.send_review_digest() == 0
+    con = sqlite3.connect(str(db_file))
+    digests = con.execute("SELECT chat_id, text, reply_markup FROM outbox ORDER BY id").fetchall()
+    assert [d[0] for d in digests] == [7, 8, 7, 8]
+    assert "text0" in digests[0][1] and "text2" in digests[0][1] and "text3" not in digests[0][1]
+    buttons = [b["callback_data"] for row in json.loads(digests[0][2])["inline_keyboard"] for b in row]
+    assert buttons == ["revok_2_4_2", "revno_2_4_2", "revok_2_4_3", "revno_2_4_3", "revok_2_4_4", "revno_2_4_4", "revok_2_4_0"]
+
+    # reject one, approve the rest of the digest; a second tap finds nothing left
+    assert await bot.moderate_reviews(3, 3, "rejected") == [3]
+    assert await bot.moderate_reviews(2, 4, "approved") == [2, 4]
+    assert await bot.moderate_reviews(2, 4, "approved") == []
+    page = await bot.reviews_page()
+    assert "text0" in page and "text2" in page and "text1" not in page
+
+    text, markup = bot.review_digest(await bot.review_rows(2, 4))
+    assert text.startswith("📝 Отзывы разобраны") and markup is None
+
+    # archival keeps pending reviews and the newest approved one
+    await bot.archive_old_records()
+    live = con.execute("SELECT id, status FROM reviews ORDER BY id").fetchall()
+    assert live == [(4, "approved"), (5, "pending")]
+    con.close()
+
+
+@pytest.mark.asyncio
+async def test_review_digest_is_marked_only_once_an_admin_got_it(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+    from aiogram.methods import SendMessage
+
+    await bot.init_db()
+    await bot.load_config()
+
+    async with bot.db_write() as db:
+        await db.execute("INSERT INTO reviews (user_id, name, text, status) VALUES (1, 'u1', 'text1', 'pending')")
+
+    def digest_state():
+        con = sqlite3.connect(str(db_file))
+        state = con.execute("SELECT digest_sent FROM reviews").fetchone()[0]
+        con.close()
+        return state
+
+    # no admin to send it to: the review keeps waiting
+    assert await bot.send_review_digest() == 0
+    assert digest_state() == 0
+
+    delivered = []
+
+    async def send_message(chat_id, text, reply_markup=None):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id == 7:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if chat_id == 8 and not delivered:
+            raise TelegramBadRequest(method=method, message="Bad Request: chat not found")
+        delivered.append(chat_id)
+
+    monkeypatch.setattr(bot.bot, "send_message", send_message)
+    async with bot.db_write() as db:
+        await db.execute("INSERT INTO admins (user_id) VALUES (7), (8)")
+    await bot.load_config()
+
+    # every copy failed: the review goes into the next digest again
+    assert await bot.send_review_digest() == 1
+    assert digest_state() == 2
+    assert await bot.send_review_digest() == 0
+    await bot.drain_outbox()
+    assert digest_state() == 0 and delivered == []
+
+    # one admin got it: done, even though the other copy failed
+    delivered.append(None)
+    async with bot.db_write() as db:
+        await db.execute("DELETE FROM blocked_users")
+    assert await bot.send_review_digest() == 1
+    await bot.drain_outbox()
+    assert delivered == [None, 8] and digest_state() == 1
+    assert await bot.send_review_digest() == 0
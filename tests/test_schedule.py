@@ -0,0 +1,100 @@
+import importlib
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_schedule_snapshot_versions(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    con = sqlite3.connect(str(db_file))
+    con.execute("INSERT INTO closed_weekdays (weekday) VALUES (6)")
+    con.execute("INSERT INTO blocked_dates (date) VALUES ('2030-01-02')")
+    con.commit()
+    con.close()
+
+    first = await bot.load_schedule()
+    assert first.version == 1
+    assert first.closed_weekdays == {6}
+    assert first.is_closed(date(2030, 1, 2))
+
+    # reloading an unchanged schedule keeps the version (and every cache keyed on it)
+    assert (await bot.load_schedule()).version == 1
+
+    # a toggle publishes a new snapshot; readers holding the old one are unaffected
+    second = bot.publish_schedule(closed_weekdays=first.closed_weekdays - {6})
+    assert second.version == 2 and bot.schedule is second
+    assert first.closed_weekdays == {6}
+    assert bot.weekdays_keyboard(second) is bot.weekdays_keyboard(second)
+    assert bot.weekdays_keyboard(first) is not bot.weekdays_keyboard(second)
+
+
+@pytest.mark.asyncio
+async def test_schedule_rules_compile_to_slot_masks(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    today = datetime.now().date()
+    monday = today + timedelta(days=7 - today.weekday())
+    # every other Tuesday from next week: no 11:00 slot
+    close = bot.parse_rule_args(f"close days=2 every=2 from={monday.strftime('%d.%m.%Y')} slots=11:00")
+    con = sqlite3.connect(str(db_file))
+    con.execute(
+        "INSERT INTO schedule_rules (action, weekdays, slots, start_date, every_weeks, priority) VALUES (?, ?, ?, ?, ?, ?)",
+        (close["action"], close["weekdays"], close["slots"], close["start_date"], close["every_weeks"], close["priority"])
+    )
+    con.commit()
+    con.close()
+
+    current = await bot.load_schedule()
+    tuesday = monday + timedelta(days=1)
+    without_11 = [t for t in bot.TIME_SLOTS if t != "11:00"]
+    assert current.open_slots(tuesday) == without_11
+    assert current.open_slots(tuesday + timedelta(days=7)) == bot.TIME_SLOTS
+    assert current.open_slots(tuesday + timedelta(days=14)) == without_11
+    assert not current.is_open(tuesday, "11:00") and current.is_open(tuesday, "10:00")
+    # every compiled day agrees with compiling it from scratch
+    assert all(current.masks[i] == current.compile_day(today + timedelta(days=i)) for i in range(len(current.masks)))
+
+    # an incremental publish only touches the affected days and still matches a full compile
+    closed = bot.publish_schedule(affected=lambda d: d.weekday() == 1, closed_weekdays=frozenset({1}))
+    assert closed.is_closed(tuesday) and closed.is_closed(tuesday + timedelta(days=7))
+    assert closed.masks == bot.publish_schedule().masks
+
+    # /rule_add when the snapshot is reloaded from the DB (another worker's change): the rule is in it once
+    answers = []
+
+    async def answer(text):
+        answers.append(text)
+
+    monkeypatch.setattr(bot, "is_admin", lambda user_id: True)
+    monkeypatch.setattr(bot, "WORKERS", 2)
+    monkeypatch.setattr(bot, "_schedule_checked_at", float("-inf"))
+    message = SimpleNamespace(from_user=SimpleNamespace(id=1), answer=answer)
+    await bot.rule_add_cmd(message, SimpleNamespace(args="close days=4 slots=10:00"))
+    assert answers[-1].startswith("✅")
+    assert sorted(r.id for r in bot.schedule.rules) == [1, 2]
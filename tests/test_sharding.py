@@ -0,0 +1,51 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_shard_for_keeps_user_on_one_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test_bookings.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    from aiogram.types import Update
+
+    def callback_update(update_id, user_id, data):
+        return Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+                "chat_instance": "x",
+                "data": data,
+            },
+        })
+
+    def message_update(update_id, user_id, text):
+        return Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 1700000000,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+                "text": text,
+            },
+        })
+
+    # a callback and the follow-up comment of the same user go to the same worker
+    first = bot.shard_for(callback_update(1, 1001, "time_2030-01-01_10:00"), 4)
+    second = bot.shard_for(message_update(2, 1001, "комментарий"), 4)
+    assert first == second
+
+    # different users spread over workers
+    shards = {bot.shard_for(message_update(i, 1000 + i, "x"), 4) for i in range(8)}
+    assert shards == {0, 1, 2, 3}
@@ -0,0 +1,61 @@
+import asyncio
+import importlib
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_hold_reserves_seat_until_it_expires(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("SLOT_HOLD_SECONDS", "0.3")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    day = datetime.now().date() + timedelta(days=2)
+    display = day.strftime("%d.%m.%Y")
+    con = sqlite3.connect(str(db_file))
+    con.execute("INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'A', ?, ?)", (display, bot.TIME_SLOTS[0]))
+    con.commit()
+    con.close()
+
+    await bot.occupancy.load()
+    # user 2 opens the picker and takes the last seat of the day
+    text, markup = await bot.slot_picker(day, user_id=2)
+    assert bot.bookable_slots(day, user_id=2)
+    assert bot.bookable_slots(day, user_id=3) == []
+    async with bot.db_connect() as db:
+        assert await bot.held_slots(db, display, 3) == [None]
+        assert await bot.held_slots(db, display, 2) == []
+
+    def day_button(markup):
+        return next(b for row in markup.inline_keyboard for b in row if b.callback_data.endswith(day.isoformat() + "_0"))
+
+    # the holder still sees the seat as theirs; others see it taken for now, not a waitlist
+    now = datetime.now()
+    own = day_button(await bot.build_calendar(now.year, now.month, months=2, user_id=2))
+    other = day_button(await bot.build_calendar(now.year, now.month, months=2, user_id=3))
+    assert own.text == f"{day.day} (1/{bot.schedule.capacity})"
+    assert other.text == f"⏳{day.day}" and other.callback_data.startswith("cal_day_")
+
+    sweeper = asyncio.create_task(bot.slot_holds.sweeper())
+    try:
+        await asyncio.sleep(0.6)
+    finally:
+        sweeper.cancel()
+        await asyncio.gather(sweeper, return_exceptions=True)
+    assert bot.bookable_slots(day, user_id=3)
+    async with bot.db_connect() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM slot_holds")
+        assert (await cursor.fetchone())[0] == 0
@@ -0,0 +1,150 @@
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_freed_slot_goes_to_waitlist_in_join_order(tmp_path, monkeypatch):
+    db_file = tmp_path / "test_bookings.db"
+    monkeypatch.setenv("DB_PATH", str(db_file))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    assert await bot.join_waitlist(10, "first", "01.01.2030") == 1
+    assert await bot.join_waitlist(20, "second", "01.01.2030") == 2
+    # joining twice keeps the original place
+    assert await bot.join_waitlist(10, "first", "01.01.2030") == 1
+
+    async with bot.db_write() as db:
+        assert await bot.promote_waitlist(db, "01.01.2030", "10:00")
+    async with bot.db_connect() as db:
+        # the slot is held for the first user only, and the offer waits in the outbox
+        assert await bot.held_slots(db, "01.01.2030", 20) == ["10:00"]
+        assert await bot.held_slots(db, "01.01.2030", 10) == []
+        cursor = await db.execute("SELECT chat_id FROM outbox")
+        assert [r[0] for r in await cursor.fetchall()] == [10]
+
+    # an expired hold moves on to the next user, then the slot is released
+    async with bot.db_write() as db:
+        await db.execute("UPDATE waitlist SET offer_expires_at = 0 WHERE status = 'offered'")
+    assert await bot.expire_waitlist_offers() == 1
+    async with bot.db_connect() as db:
+        assert await bot.held_slots(db, "01.01.2030", 10) == ["10:00"]
+        await db.execute("UPDATE waitlist SET offer_expires_at = 0 WHERE status = 'offered'")
+        await db.commit()
+    assert await bot.expire_waitlist_offers() == 1
+    async with bot.db_connect() as db:
+        assert await bot.held_slots(db, "01.01.2030", 0) == []
+
+
+@pytest.mark.asyncio
+async def test_memory_store_accept_claims_offer_with_the_booking(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test_bookings.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("MEMORY_STORE", "1")
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+    await bot.booking_store.load()
+    journal = asyncio.create_task(bot.booking_store.journal.run())
+
+    class FakeCall:
+        def __init__(self, data):
+            self.from_user = SimpleNamespace(id=10, first_name="first")
+            self.message = SimpleNamespace(edit_text=self.edit_text)
+            self.data = data
+            self.alerts = []
+            self.edited = []
+
+        async def answer(self, text=None, show_alert=False):
+            if show_alert:
+                self.alerts.append(text)
+
+        async def edit_text(self, text, reply_markup=None):
+            self.edited.append(text)
+
+    try:
+        await bot.join_waitlist(10, "first", "01.01.2030")
+        async with bot.db_write() as db:
+            await bot.promote_waitlist(db, "01.01.2030", "10:00")
+
+        # a double tap books once
+        first, second = FakeCall("wl_accept_1"), FakeCall("wl_accept_1")
+        await asyncio.gather(bot.waitlist_accept(first), bot.waitlist_accept(second))
+        assert len(first.edited + second.edited) == 1 and len(first.alerts + second.alerts) == 1
+        assert len(bot.booking_store.rows()) == 1
+
+        # an offer gone in the DB by the time the journal commits leaves no booking behind
+        await bot.join_waitlist(10, "first", "02.01.2030")
+        async with bot.db_write() as db:
+            await bot.promote_waitlist(db, "02.01.2030", "10:00")
+            await db.execute("UPDATE waitlist SET status = 'declined' WHERE id = 2")
+        monkeypatch.setattr(bot, "_offer_error", lambda row: None)
+        call = FakeCall("wl_accept_2")
+        await bot.waitlist_accept(call)
+        assert call.alerts == ["Предложение уже недействительно"]
+        assert [r[3] for r in bot.booking_store.rows()] == ["01.01.2030"]
+        async with bot.db_connect() as db:
+            cursor = await db.execute("SELECT date FROM bookings")
+            assert await cursor.fetchall() == [("01.01.2030",)]
+    finally:
+        journal.cancel()
+        await asyncio.gather(journal, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("memory_store", ["0", "1"])
+async def test_open_offer_counts_until_it_expires(tmp_path, monkeypatch, memory_store):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test_bookings.db"))
+    monkeypatch.setenv("BOT_TOKEN", "123:ABC")
+    monkeypatch.setenv("ADMIN_IDS", "")
+    monkeypatch.setenv("MEMORY_STORE", memory_store)
+
+    proj_root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(proj_root))
+
+    import src.bot as bot
+    importlib.reload(bot)
+    await bot.init_db()
+
+    d = bot.datetime.now().date() + bot.timedelta(days=3)
+    date_display = d.strftime("%d.%m.%Y")
+    async with bot.db_write() as db:
+        await db.execute(
+            "INSERT INTO bookings (user_id, name, date, time) VALUES (1, 'a', ?, '10:00')", (date_display,)
+        )
+    if bot.booking_store:
+        await bot.booking_store.load()
+    await bot.join_waitlist(10, "first", date_display)
+    async with bot.db_write() as db:
+        await bot.promote_waitlist(db, date_display, "11:00")
+    bot.invalidate_availability()
+
+    # the offer takes the second seat: neither the calendar nor the picker offers it
+    await bot.occupancy.load()
+    assert (await bot.month_availability(d.year, d.month))[d.isoformat()] == 2
+    assert bot.occupancy.free_slots(d) == []
+
+    # once expired with nobody waiting, the seat is back and counted once
+    async with bot.db_write() as db:
+        await db.execute("UPDATE waitlist SET offer_expires_at = 0 WHERE status = 'offered'")
+    assert await bot.expire_waitlist_offers() == 1
+    assert (await bot.month_availability(d.year, d.month))[d.isoformat()] == 1
+    assert bot.occupancy.counts[bot.occupancy._index(d)] == 1
+    assert "11:00" in bot.occupancy.free_slots(d)